@@ -1,49 +1,622 @@
-import json
-import boto3
+from datetime import datetime, timezone
+import hashlib
 import os
-from datetime import datetime
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-s3 = boto3.client('s3')
+import db
+import pdf_split
+import submission
+from db import execute_values
 
-def lambda_handler(event, context):
+# boto3 clients by service name, see aws_client()
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Bedrock Data Automation is called in us-east-1 whatever the function's region
+CLIENT_REGIONS = {'bedrock-data-automation-runtime': 'us-east-1'}
+
+# submission.py does the retrying for Bedrock, so botocore must not retry too
+# (botocore Config options, built in aws_client())
+CLIENT_CONFIGS = {'bedrock-data-automation-runtime': {'retries': {'total_max_attempts': 1}}}
+
+# Parallel Bedrock submissions, and the rate they share (per second, burst)
+SUBMIT_CONCURRENCY = int(os.environ.get('SUBMIT_CONCURRENCY', '4'))
+SUBMIT_RATE_PER_SECOND = float(os.environ.get('SUBMIT_RATE_PER_SECOND', '5'))
+SUBMIT_BURST = int(os.environ.get('SUBMIT_BURST', '5'))
+
+# Retries of a throttled submission within one invocation
+SUBMIT_MAX_RETRIES = int(os.environ.get('SUBMIT_MAX_RETRIES', '6'))
+
+# pending_submissions: PDFs claimed per invocation, how long a claim is held,
+# how many invocations may try a PDF and when a failed one is tried again
+SUBMIT_BATCH_SIZE = int(os.environ.get('SUBMIT_BATCH_SIZE', '100'))
+SUBMIT_LEASE_SECONDS = int(os.environ.get('SUBMIT_LEASE_SECONDS', '900'))
+SUBMIT_MAX_ATTEMPTS = int(os.environ.get('SUBMIT_MAX_ATTEMPTS', '5'))
+SUBMIT_RETRY_AFTER_SECONDS = int(os.environ.get('SUBMIT_RETRY_AFTER_SECONDS', '60'))
+
+# Time kept back from the Lambda timeout for bookkeeping after the submissions
+SUBMIT_DEADLINE_MARGIN_MS = int(os.environ.get('SUBMIT_DEADLINE_MARGIN_MS', '10000'))
+
+# Submitted jobs are written to bedrock_jobs / pending_submissions in chunks
+# of this many while the rest of the batch is still being submitted
+SUBMIT_RECORD_EVERY = int(os.environ.get('SUBMIT_RECORD_EVERY', '10'))
+
+# Parallel S3 reads when hashing or splitting a batch of PDFs, and the size
+# of each read when hashing
+HASH_CONCURRENCY = int(os.environ.get('HASH_CONCURRENCY', '8'))
+HASH_CHUNK_BYTES = 1024 * 1024
+
+# PDFs with more pages than SPLIT_PAGE_THRESHOLD go to Bedrock as chunks of
+# SPLIT_CHUNK_PAGES pages, uploaded under SPLIT_CHUNK_PREFIX (0 disables it)
+SPLIT_PAGE_THRESHOLD = int(os.environ.get('SPLIT_PAGE_THRESHOLD', '0'))
+SPLIT_CHUNK_PAGES = int(os.environ.get('SPLIT_CHUNK_PAGES', '25'))
+SPLIT_CHUNK_PREFIX = os.environ.get('SPLIT_CHUNK_PREFIX', 'chunks/')
+
+# delete_objects takes at most 1000 keys per call
+S3_DELETE_BATCH = 1000
+
+# Shared by the invocations of a warm container, so a throttled rate persists
+submit_bucket = submission.TokenBucket(SUBMIT_RATE_PER_SECOND, SUBMIT_BURST)
+
+
+def aws_client(service):
     """
-    Triggered when PDF uploaded to incoming bucket
-    Invokes Bedrock Data Automation to process the invoice
-    Stores original filename as S3 metadata for later retrieval
+    boto3 client for service, built on first use and reused by warm invocations.
+
+    Creating a client loads its service model - for bedrock-data-automation-runtime
+    that is one of the most expensive things this function does.
+    """
+    if service not in _clients:
+        # Hashing, splitting and submission threads may ask for the same
+        # client at once, and boto3's default session is not thread-safe
+        with _clients_lock:
+            if service not in _clients:
+                # bedrock-data-automation-runtime needs the boto3 packaged with the
+                # function (see requirements.txt), not the one in the Lambda runtime
+                import boto3
+                from botocore.config import Config
+
+                options = CLIENT_CONFIGS.get(service)
+                _clients[service] = boto3.client(
+                    service,
+                    region_name=CLIENT_REGIONS.get(service),
+                    config=Config(**options) if options else None
+                )
+    return _clients[service]
+
+
+def record_jobs(jobs, hashes=None):
+    """
+    Index job_id -> original PDF so the processor can find it with one lookup.
+
+    jobs are (job_id, bucket, key, invocation_arn, duplicate_of). hashes maps
+    job_id -> SHA-256 of its PDF, added to document_hashes so later uploads of
+    the same document can be recognized. Returns False if the write failed.
+
+    The PDF tags stay the source of truth if this write fails; the processor
+    falls back to scanning them.
     """
-    
+    if not jobs:
+        return True
+    hashes = hashes or {}
+
+    def write(cursor):
+        execute_values(cursor, """
+            INSERT INTO bedrock_jobs (job_id, source_bucket, source_key, invocation_arn, duplicate_of)
+            VALUES %s
+            ON CONFLICT (job_id) DO UPDATE SET
+                source_bucket = EXCLUDED.source_bucket,
+                source_key = EXCLUDED.source_key,
+                invocation_arn = EXCLUDED.invocation_arn,
+                duplicate_of = EXCLUDED.duplicate_of
+        """, jobs, page_size=len(jobs))
+        hash_rows = [
+            (hashes[job_id], job_id, bucket, key)
+            for job_id, bucket, key, _, _ in jobs if job_id in hashes
+        ]
+        if hash_rows:
+            # The first job to extract a document stays its reference copy
+            execute_values(cursor, """
+                INSERT INTO document_hashes (sha256, job_id, source_bucket, source_key)
+                VALUES %s
+                ON CONFLICT (sha256) DO NOTHING
+            """, hash_rows, page_size=len(hash_rows))
+        chunk_rows = [(job_id, key) for job_id, _, key, _, _ in jobs if is_chunk(key)]
+        if chunk_rows:
+            # How the processor tells a chunk's result from a whole invoice
+            execute_values(cursor, """
+                UPDATE document_chunks AS c
+                SET job_id = v.job_id
+                FROM (VALUES %s) AS v(job_id, chunk_key)
+                WHERE c.chunk_key = v.chunk_key
+            """, chunk_rows, page_size=len(chunk_rows))
+
     try:
-        # Create client inside function with latest boto3
-        bedrock_runtime = boto3.client('bedrock-data-automation-runtime', region_name='us-east-1')
-        
-        # Get S3 event details
-        bucket = event['Records'][0]['s3']['bucket']['name']
-        key = event['Records'][0]['s3']['object']['key']
-        
-        print(f"New PDF uploaded: s3://{bucket}/{key}")
-        
-        # Invoke Bedrock Data Automation
-        response = bedrock_runtime.invoke_data_automation_async(
-            dataAutomationConfiguration={
-                'dataAutomationProjectArn': os.environ['BEDROCK_PROJECT_ARN']
-            },
-            inputConfiguration={
-                's3Uri': f's3://{bucket}/{key}'
-            },
-            outputConfiguration={
-                's3Uri': os.environ['OUTPUT_BUCKET']
-            },
-            dataAutomationProfileArn=os.environ['BEDROCK_PROFILE_ARN']
+        db.run_in_transaction(write)
+        print(f"✓ Indexed {len(jobs)} job(s) in bedrock_jobs")
+        return True
+    except Exception as e:
+        print(f"⚠ Could not index jobs, processor will fall back to tags: {str(e)}")
+        return False
+
+
+def hash_pdf(bucket, key):
+    """SHA-256 of an S3 object, streamed in chunks so a large PDF is never held in memory"""
+    digest = hashlib.sha256()
+    body = aws_client('s3').get_object(Bucket=bucket, Key=key)['Body']
+    for chunk in body.iter_chunks(HASH_CHUNK_BYTES):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_pdfs(pdfs):
+    """
+    {(bucket, key): sha256} for a batch, read concurrently. A PDF that can't
+    be read is left out and simply goes to Bedrock.
+    """
+    hashes = {}
+    if not pdfs:
+        return hashes
+
+    with ThreadPoolExecutor(max_workers=min(HASH_CONCURRENCY, len(pdfs))) as pool:
+        futures = {pool.submit(hash_pdf, *pdf): pdf for pdf in pdfs}
+        for future in as_completed(futures):
+            try:
+                hashes[futures[future]] = future.result()
+            except Exception as e:
+                print(f"⚠ Could not hash {futures[future][1]}: {str(e)}")
+    return hashes
+
+
+def find_extracted(hashes):
+    """{sha256: job_id} for the hashes whose document was already extracted and saved"""
+    if not hashes:
+        return {}
+
+    def lookup(cursor):
+        cursor.execute("""
+            SELECT sha256, job_id
+            FROM document_hashes
+            WHERE sha256 = ANY(%s)
+              AND extracted_at IS NOT NULL
+        """, (list(hashes),))
+        return dict(cursor.fetchall())
+
+    try:
+        return db.run_in_transaction(lookup)
+    except Exception as e:
+        print(f"⚠ Duplicate check failed, submitting everything: {str(e)}")
+        return {}
+
+
+def output_location():
+    """(bucket, prefix) Bedrock writes job outputs under"""
+    bucket, _, prefix = os.environ['OUTPUT_BUCKET'][len('s3://'):].partition('/')
+    prefix = prefix.strip('/')
+    return bucket, f'{prefix}/' if prefix else ''
+
+
+def reuse_extraction(original_job_id, job_id):
+    """
+    Copy a finished job's Bedrock output under a new job_id.
+
+    The copies raise the same S3 events as a real Bedrock run, so the processor
+    persists the duplicate through its normal path. job_metadata.json goes
+    last, with its paths rewritten, because job_completion_handler starts from
+    it and needs every result in place.
+    """
+    s3 = aws_client('s3')
+    bucket, prefix = output_location()
+    source_prefix = f'{prefix}{original_job_id}/'
+    target_prefix = f'{prefix}{job_id}/'
+
+    metadata_keys = []
+    copied = 0
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=source_prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('job_metadata.json'):
+                metadata_keys.append(obj['Key'])
+                continue
+            s3.copy_object(
+                CopySource={'Bucket': bucket, 'Key': obj['Key']},
+                Bucket=bucket,
+                Key=target_prefix + obj['Key'][len(source_prefix):]
+            )
+            copied += 1
+    if not copied:
+        raise ValueError(f"No stored output for job {original_job_id}")
+
+    for key in metadata_keys:
+        metadata = s3.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+        s3.put_object(
+            Bucket=bucket,
+            Key=target_prefix + key[len(source_prefix):],
+            Body=metadata.replace(f's3://{bucket}/{source_prefix}', f's3://{bucket}/{target_prefix}').encode('utf-8'),
+            ContentType='application/json'
         )
-        
-        invocation_arn = response['invocationArn']
-        job_id = invocation_arn.split('/')[-1]
-        
-        print(f"✓ Bedrock invocation started: {invocation_arn}")
-        print(f"Job ID: {job_id}")
-        
-        # Tag the original PDF with job_id for later retrieval
-        s3.put_object_tagging(
+
+
+def find_split_parts(job_ids):
+    """
+    {document_id: (page_count, [(first_page, last_page, chunk job_id)])} for
+    the job_ids that are split documents, chunks in page order. The chunks'
+    Bedrock outputs are where such a document's extraction is stored.
+    """
+    if not job_ids:
+        return {}
+
+    def lookup(cursor):
+        cursor.execute("""
+            SELECT d.document_id, d.page_count, c.first_page, c.last_page, c.job_id
+            FROM split_documents d
+            JOIN document_chunks c ON c.document_id = d.document_id
+            WHERE d.document_id = ANY(%s)
+            ORDER BY d.document_id, c.chunk_index
+        """, (list(job_ids),))
+        return cursor.fetchall()
+
+    parts = {}
+    for document_id, page_count, first, last, job_id in db.run_in_transaction(lookup):
+        parts.setdefault(document_id, (page_count, []))[1].append((first, last, job_id))
+    return parts
+
+
+def record_split_duplicates(duplicates, parts):
+    """
+    Index re-uploads of split documents as split documents of their own.
+
+    duplicates map (bucket, key) -> (document_id, original document_id). Each
+    gets split_documents and document_chunks rows with the original's page
+    ranges, and a chunk job per original chunk (no chunk PDF is uploaded), so
+    the copied chunk outputs are stored and merged by the processor like any
+    split. Returns {(bucket, key): [(original chunk job_id, chunk job_id)]},
+    or {} if the rows could not be written.
+    """
+    chunk_jobs = {
+        pdf: [(original_job_id, f'dup-{uuid.uuid4()}', first, last)
+              for first, last, original_job_id in parts[original_id][1]]
+        for pdf, (_, original_id) in duplicates.items()
+    }
+
+    def write(cursor):
+        execute_values(cursor, """
+            INSERT INTO split_documents (document_id, source_bucket, source_key, page_count, chunk_count)
+            VALUES %s
+        """, [
+            (document_id, bucket, key, parts[original_id][0], len(chunk_jobs[(bucket, key)]))
+            for (bucket, key), (document_id, original_id) in duplicates.items()
+        ], page_size=len(duplicates))
+        chunk_rows = [
+            (document_id, index, first, last,
+             pdf_split.chunk_key(SPLIT_CHUNK_PREFIX, document_id, first, last), job_id)
+            for pdf, (document_id, _) in duplicates.items()
+            for index, (_, job_id, first, last) in enumerate(chunk_jobs[pdf])
+        ]
+        execute_values(cursor, """
+            INSERT INTO document_chunks (document_id, chunk_index, first_page, last_page, chunk_key, job_id)
+            VALUES %s
+        """, chunk_rows, page_size=len(chunk_rows))
+        job_rows = [
+            (document_id, bucket, key, original_id)
+            for (bucket, key), (document_id, original_id) in duplicates.items()
+        ]
+        job_rows += [
+            (job_id, bucket, pdf_split.chunk_key(SPLIT_CHUNK_PREFIX, duplicates[(bucket, key)][0], first, last),
+             original_job_id)
+            for (bucket, key), chunks in chunk_jobs.items()
+            for original_job_id, job_id, first, last in chunks
+        ]
+        execute_values(cursor, """
+            INSERT INTO bedrock_jobs (job_id, source_bucket, source_key, duplicate_of)
+            VALUES %s
+        """, job_rows, page_size=len(job_rows))
+
+    try:
+        db.run_in_transaction(write)
+    except Exception as e:
+        print(f"⚠ Could not index split duplicates, submitting them to Bedrock: {str(e)}")
+        return {}
+    return {
+        pdf: [(original_job_id, job_id) for original_job_id, job_id, _, _ in chunks]
+        for pdf, chunks in chunk_jobs.items()
+    }
+
+
+def reuse_extractions(copies):
+    """reuse_extraction for each (original job_id, job_id) in copies"""
+    for original_job_id, job_id in copies:
+        reuse_extraction(original_job_id, job_id)
+
+
+def route_duplicates(duplicates):
+    """
+    Send re-uploads of already extracted documents to the processor without
+    running Bedrock again.
+
+    duplicates are ((bucket, key), original_job_id). Each gets a job_id of its
+    own, indexed with duplicate_of before any output exists so the processor
+    recognizes it. A duplicate of a split document becomes a split document
+    of its own, its chunks reusing the original chunks' outputs. Returns
+    {(bucket, key): result} for the routed PDFs; the rest (e.g. the stored
+    output has expired) go to Bedrock as usual.
+    """
+    routed = {}
+    if not duplicates:
+        return routed
+
+    jobs = {
+        pdf: (f'dup-{uuid.uuid4()}', original_job_id)
+        for pdf, original_job_id in duplicates
+    }
+    try:
+        parts = find_split_parts({original_job_id for _, original_job_id in jobs.values()})
+    except Exception as e:
+        print(f"⚠ Could not look up split documents, submitting duplicates to Bedrock: {str(e)}")
+        return routed
+
+    whole = {pdf: job for pdf, job in jobs.items() if job[1] not in parts}
+    copies = {}
+    if whole and record_jobs([
+        (job_id, bucket, key, None, original_job_id)
+        for (bucket, key), (job_id, original_job_id) in whole.items()
+    ]):
+        copies = {pdf: [(original_job_id, job_id)] for pdf, (job_id, original_job_id) in whole.items()}
+    split = {pdf: job for pdf, job in jobs.items() if job[1] in parts}
+    if split:
+        copies.update(record_split_duplicates(split, parts))
+    if not copies:
+        return routed
+
+    with ThreadPoolExecutor(max_workers=min(HASH_CONCURRENCY, len(copies))) as pool:
+        futures = {pool.submit(reuse_extractions, pdf_copies): pdf for pdf, pdf_copies in copies.items()}
+        for future in as_completed(futures):
+            pdf = futures[future]
+            key = pdf[1]
+            job_id, original_job_id = jobs[pdf]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"⚠ Could not reuse extraction for {key}, submitting to Bedrock: {str(e)}")
+                continue
+            print(f"✓ {key} is a duplicate of job {original_job_id}, reusing its extraction as {job_id}")
+            routed[pdf] = {
+                'statusCode': 200,
+                'job_id': job_id,
+                'duplicate_of': original_job_id,
+                'original_key': key,
+                'message': f'Duplicate of job {original_job_id}, Bedrock skipped for {key}'
+            }
+    return routed
+
+
+def is_chunk(key):
+    """True for the page-range chunks split_document uploads"""
+    return key.startswith(SPLIT_CHUNK_PREFIX)
+
+
+def document_of(chunk_key):
+    """document_id of a chunk, from <SPLIT_CHUNK_PREFIX><document_id>/pages-....pdf"""
+    return chunk_key[len(SPLIT_CHUNK_PREFIX):].split('/')[0]
+
+
+def record_pipeline(entries):
+    """
+    Start the pipeline_ledger rows of submitted documents.
+
+    entries are (job_id, bucket, key, uploaded_at, bedrock_started_at), with
+    the S3 event time as uploaded_at when there is one; otherwise the time the
+    PDF entered pending_submissions is used. The chunks of a split document
+    share its row, which keeps their earliest start. The processor may have
+    created the row first (a duplicate is quick), so it is upserted both
+    ways. Best effort: the ledger is for measuring, never a reason to fail a
+    submission.
+    """
+    rows = {}
+    for job_id, bucket, key, uploaded_at, started_at in entries:
+        row = rows.setdefault(job_id, [job_id, bucket, key, uploaded_at, started_at])
+        if started_at and (row[4] is None or started_at < row[4]):
+            row[4] = started_at
+    if not rows:
+        return
+
+    def write(cursor):
+        execute_values(cursor, """
+            INSERT INTO pipeline_ledger (job_id, source_bucket, source_key, uploaded_at, bedrock_started_at)
+            SELECT v.job_id,
+                   COALESCE(d.source_bucket, v.source_bucket),
+                   COALESCE(d.source_key, v.source_key),
+                   COALESCE(v.uploaded_at, p.created_at, NOW()),
+                   v.bedrock_started_at
+            FROM (VALUES %s) AS v(job_id, source_bucket, source_key, uploaded_at, bedrock_started_at)
+            LEFT JOIN split_documents d
+              ON d.document_id = v.job_id
+            LEFT JOIN pending_submissions p
+              ON p.source_bucket = COALESCE(d.source_bucket, v.source_bucket)
+             AND p.source_key = COALESCE(d.source_key, v.source_key)
+            ON CONFLICT (job_id) DO UPDATE SET
+                source_bucket = COALESCE(pipeline_ledger.source_bucket, EXCLUDED.source_bucket),
+                source_key = COALESCE(pipeline_ledger.source_key, EXCLUDED.source_key),
+                uploaded_at = COALESCE(pipeline_ledger.uploaded_at, EXCLUDED.uploaded_at),
+                bedrock_started_at = LEAST(pipeline_ledger.bedrock_started_at, EXCLUDED.bedrock_started_at)
+        """, [tuple(row) for row in rows.values()],
+            template='(%s, %s, %s, %s::timestamptz, %s::timestamptz)', page_size=len(rows))
+
+    try:
+        db.run_in_transaction(write)
+    except Exception as e:
+        print(f"⚠ Could not write pipeline_ledger: {str(e)}")
+
+
+def split_document(bucket, key):
+    """
+    Split one PDF into page-range chunks if it has more than SPLIT_PAGE_THRESHOLD pages.
+
+    Returns (document_id, page_count, ranges, chunk_keys), or None to submit
+    the PDF whole. The chunks are uploaded next to the original; track_splits
+    records them. Runs in split_large_pdfs' threads, so it must not touch the
+    database: db.py's connection is not shared between threads.
+    """
+    s3 = aws_client('s3')
+    data = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    page_count = pdf_split.count_pages(data)
+    if page_count <= SPLIT_PAGE_THRESHOLD:
+        return None
+
+    document_id = f'split-{uuid.uuid4()}'
+    ranges = pdf_split.page_ranges(page_count, SPLIT_CHUNK_PAGES)
+    chunk_keys = [pdf_split.chunk_key(SPLIT_CHUNK_PREFIX, document_id, first, last) for first, last in ranges]
+    for chunk_key, body in zip(chunk_keys, pdf_split.split_pdf(data, ranges)):
+        s3.put_object(Bucket=bucket, Key=chunk_key, Body=body, ContentType='application/pdf')
+    return document_id, page_count, ranges, chunk_keys
+
+
+def track_splits(splits, tracked, hashes):
+    """
+    Record split documents in one transaction.
+
+    splits maps (bucket, key) -> split_document's result. Each document goes
+    in split_documents, its chunks in document_chunks, and the document itself
+    in bedrock_jobs under its document_id, the job the processor saves the
+    merged invoice as. Its SHA-256 from hashes goes in document_hashes under
+    that job too, so a re-upload is recognized once the merge is saved. With
+    pending_submissions (tracked), the chunks start out claimed there, so a
+    chunk that fails to submit is retried like any other PDF.
+    """
+    def track(cursor):
+        execute_values(cursor, """
+            INSERT INTO split_documents (document_id, source_bucket, source_key, page_count, chunk_count)
+            VALUES %s
+        """, [
+            (document_id, bucket, key, page_count, len(ranges))
+            for (bucket, key), (document_id, page_count, ranges, _) in splits.items()
+        ], page_size=len(splits))
+        chunk_rows = [
+            (document_id, index, first, last, chunk_key)
+            for document_id, _, ranges, chunk_keys in splits.values()
+            for index, ((first, last), chunk_key) in enumerate(zip(ranges, chunk_keys))
+        ]
+        execute_values(cursor, """
+            INSERT INTO document_chunks (document_id, chunk_index, first_page, last_page, chunk_key)
+            VALUES %s
+        """, chunk_rows, page_size=len(chunk_rows))
+        execute_values(cursor, """
+            INSERT INTO bedrock_jobs (job_id, source_bucket, source_key)
+            VALUES %s
+        """, [
+            (document_id, bucket, key)
+            for (bucket, key), (document_id, _, _, _) in splits.items()
+        ], page_size=len(splits))
+        hash_rows = [
+            (hashes[pdf], document_id, *pdf)
+            for pdf, (document_id, _, _, _) in splits.items() if pdf in hashes
+        ]
+        if hash_rows:
+            execute_values(cursor, """
+                INSERT INTO document_hashes (sha256, job_id, source_bucket, source_key)
+                VALUES %s
+                ON CONFLICT (sha256) DO NOTHING
+            """, hash_rows, page_size=len(hash_rows))
+        if tracked:
+            pending_rows = [
+                (bucket, chunk_key, SUBMIT_LEASE_SECONDS)
+                for (bucket, _), (_, _, _, chunk_keys) in splits.items()
+                for chunk_key in chunk_keys
+            ]
+            execute_values(cursor, """
+                INSERT INTO pending_submissions (source_bucket, source_key, attempts, next_attempt_at)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+            """, pending_rows, template="(%s, %s, 1, NOW() + %s * INTERVAL '1 second')", page_size=len(pending_rows))
+
+    db.run_in_transaction(track)
+
+
+def delete_chunks(splits):
+    """Best effort: remove the uploaded chunks of splits that were not recorded"""
+    chunk_keys = {}
+    for (bucket, _), (_, _, _, keys) in splits.items():
+        chunk_keys.setdefault(bucket, []).extend(keys)
+    for bucket, keys in chunk_keys.items():
+        for start in range(0, len(keys), S3_DELETE_BATCH):
+            try:
+                aws_client('s3').delete_objects(Bucket=bucket, Delete={
+                    'Objects': [{'Key': key} for key in keys[start:start + S3_DELETE_BATCH]],
+                    'Quiet': True
+                })
+            except Exception as e:
+                print(f"⚠ Could not delete chunk PDFs in {bucket}: {str(e)}")
+
+
+def split_large_pdfs(pdfs, tracked, hashes):
+    """
+    {(bucket, key): [chunk (bucket, key)]} for the PDFs of a batch that were
+    split. The PDFs are read, split and uploaded concurrently; the splits are
+    then recorded together from this thread, with the PDFs' SHA-256 from hashes. A PDF that can't be read or split
+    is left out and goes to Bedrock whole, and so does the whole batch if the
+    splits can't be recorded.
+    """
+    split = {}
+    if not pdfs:
+        return split
+
+    splits = {}
+    with ThreadPoolExecutor(max_workers=min(HASH_CONCURRENCY, len(pdfs))) as pool:
+        futures = {pool.submit(split_document, *pdf): pdf for pdf in pdfs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"⚠ Could not split {futures[future][1]}, submitting it whole: {str(e)}")
+                continue
+            if result:
+                splits[futures[future]] = result
+    if not splits:
+        return split
+
+    try:
+        track_splits(splits, tracked, hashes)
+    except Exception as e:
+        print(f"⚠ Could not record {len(splits)} split document(s), submitting them whole: {str(e)}")
+        delete_chunks(splits)
+        return split
+
+    for (bucket, key), (document_id, page_count, ranges, chunk_keys) in splits.items():
+        print(f"✓ Split {key} ({page_count} pages) into {len(ranges)} chunks as {document_id}")
+        split[(bucket, key)] = [(bucket, chunk_key) for chunk_key in chunk_keys]
+    return split
+
+
+def start_extraction(bedrock_runtime, bucket, key):
+    """Invoke Bedrock Data Automation for one PDF and tag it with the job_id"""
+    print(f"New PDF uploaded: s3://{bucket}/{key}")
+
+    # Invoke Bedrock Data Automation
+    response = bedrock_runtime.invoke_data_automation_async(
+        dataAutomationConfiguration={
+            'dataAutomationProjectArn': os.environ['BEDROCK_PROJECT_ARN']
+        },
+        inputConfiguration={
+            's3Uri': f's3://{bucket}/{key}'
+        },
+        outputConfiguration={
+            's3Uri': os.environ['OUTPUT_BUCKET']
+        },
+        dataAutomationProfileArn=os.environ['BEDROCK_PROFILE_ARN']
+    )
+
+    invocation_arn = response['invocationArn']
+    job_id = invocation_arn.split('/')[-1]
+
+    print(f"✓ Bedrock invocation started: {invocation_arn}")
+    print(f"Job ID: {job_id}")
+
+    # Tag the original PDF with job_id for later retrieval. The job is already
+    # running, so a failure here must not make the submission look failed and
+    # get it resubmitted - bedrock_jobs covers the lookup.
+    try:
+        aws_client('s3').put_object_tagging(
             Bucket=bucket,
             Key=key,
             Tagging={
@@ -53,22 +626,259 @@ def lambda_handler(event, context):
                 ]
             }
         )
-        
         print(f"✓ Tagged PDF with job_id: {job_id}")
-        
-        return {
-            'statusCode': 200,
-            'invocationArn': invocation_arn,
-            'job_id': job_id,
-            'original_key': key,
-            'message': f'Processing started for {key}'
-        }
-        
+    except Exception as e:
+        print(f"⚠ Could not tag PDF with job_id {job_id}: {str(e)}")
+
+    return {
+        'statusCode': 200,
+        'invocationArn': invocation_arn,
+        'job_id': job_id,
+        'original_key': key,
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'message': f'Processing started for {key}'
+    }
+
+
+def claim_pending(new_pdfs):
+    """
+    Track new PDFs in pending_submissions and claim a batch to submit.
+
+    The batch is the oldest due PDFs, so earlier leftovers (throttled, or
+    beyond a previous batch) go first. Claimed rows are leased so concurrent
+    invocations never submit the same PDF; a claim that is never finished
+    (e.g. the function timed out) becomes due again when the lease runs out.
+    """
+    def claim(cursor):
+        if new_pdfs:
+            execute_values(cursor, """
+                INSERT INTO pending_submissions (source_bucket, source_key)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+            """, new_pdfs, page_size=len(new_pdfs))
+        cursor.execute("""
+            UPDATE pending_submissions
+            SET next_attempt_at = NOW() + %s * INTERVAL '1 second',
+                attempts = attempts + 1
+            WHERE (source_bucket, source_key) IN (
+                SELECT source_bucket, source_key
+                FROM pending_submissions
+                WHERE next_attempt_at <= NOW()
+                  AND attempts < %s
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING source_bucket, source_key
+        """, (SUBMIT_LEASE_SECONDS, SUBMIT_MAX_ATTEMPTS, SUBMIT_BATCH_SIZE))
+        return cursor.fetchall()
+
+    return db.run_in_transaction(claim)
+
+
+def finish_pending(submitted, retry, released=()):
+    """
+    Drop submitted PDFs; put retry {(bucket, key): error} back with a delay.
+    Released PDFs were never tried, so they are due again at once and the
+    attempt they were claimed with is handed back.
+    """
+    def finish(cursor):
+        if submitted:
+            execute_values(cursor, """
+                DELETE FROM pending_submissions AS p
+                USING (VALUES %s) AS v(source_bucket, source_key)
+                WHERE p.source_bucket = v.source_bucket
+                  AND p.source_key = v.source_key
+            """, submitted, page_size=len(submitted))
+        if retry:
+            execute_values(cursor, """
+                UPDATE pending_submissions AS p
+                SET last_error = v.error,
+                    next_attempt_at = NOW() + v.delay * INTERVAL '1 second'
+                FROM (VALUES %s) AS v(source_bucket, source_key, error, delay)
+                WHERE p.source_bucket = v.source_bucket
+                  AND p.source_key = v.source_key
+            """, [
+                (bucket, key, error, SUBMIT_RETRY_AFTER_SECONDS)
+                for (bucket, key), error in retry.items()
+            ], template='(%s, %s, %s, %s::integer)', page_size=len(retry))
+        if released:
+            execute_values(cursor, """
+                UPDATE pending_submissions AS p
+                SET next_attempt_at = NOW(),
+                    attempts = GREATEST(p.attempts - 1, 0)
+                FROM (VALUES %s) AS v(source_bucket, source_key)
+                WHERE p.source_bucket = v.source_bucket
+                  AND p.source_key = v.source_key
+            """, list(released), page_size=len(released))
+
+    try:
+        db.run_in_transaction(finish)
+    except Exception as e:
+        print(f"⚠ Could not update pending_submissions: {str(e)}")
+
+
+def lambda_handler(event, context):
+    """
+    Triggered when PDF uploaded to incoming bucket
+    Invokes Bedrock Data Automation to process the invoice
+    Stores original filename as S3 metadata for later retrieval
+
+    The event's PDFs are added to pending_submissions and submitted together
+    with any earlier leftovers, with bounded concurrency and backoff on
+    throttling (submission.py). PDFs that still can't be submitted stay
+    pending for the next invocation; a scheduled invocation with an empty
+    event just drains the backlog. A failure on one PDF is reported in the
+    results and does not stop the others. With SPLIT_PAGE_THRESHOLD set,
+    long PDFs are submitted as page-range chunks instead (pdf_split.py).
+    """
+
+    try:
+        bedrock_runtime = aws_client('bedrock-data-automation-runtime')
     except Exception as e:
         print(f"Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
         return {
             'statusCode': 500,
             'error': str(e)
-        }
\ No newline at end of file
+        }
+
+    # Chunks uploaded by split_document raise events too; they are already
+    # being submitted by the invocation that split them
+    new_pdfs = [
+        (record['s3']['bucket']['name'], record['s3']['object']['key'])
+        for record in event.get('Records', [])
+        if not is_chunk(record['s3']['object']['key'])
+    ]
+    upload_times = {
+        (record['s3']['bucket']['name'], record['s3']['object']['key']): record.get('eventTime')
+        for record in event.get('Records', [])
+    }
+
+    try:
+        batch = claim_pending(new_pdfs)
+        tracked = True
+    except Exception as e:
+        # Without the table, still submit this event's PDFs - just untracked
+        print(f"⚠ Could not track pending submissions: {str(e)}")
+        batch = new_pdfs
+        tracked = False
+    if tracked and len(batch) > len(new_pdfs):
+        print(f"Submitting {len(batch)} PDF(s), including {len(batch) - len(new_pdfs)} pending from earlier")
+
+    # Re-uploads of documents we already extracted skip Bedrock
+    hashes = hash_pdfs([pdf for pdf in batch if not is_chunk(pdf[1])])
+    extracted = find_extracted(set(hashes.values()))
+    routed = route_duplicates([
+        (pdf, extracted[hashes[pdf]]) for pdf in batch if hashes.get(pdf) in extracted
+    ])
+    to_submit = [pdf for pdf in batch if pdf not in routed]
+
+    # Long documents go to Bedrock as page-range chunks, extracted in parallel
+    split = {}
+    if SPLIT_PAGE_THRESHOLD:
+        split = split_large_pdfs([pdf for pdf in to_submit if not is_chunk(pdf[1])], tracked, hashes)
+        to_submit = [chunk for pdf in to_submit for chunk in split.get(pdf, [pdf])]
+
+    def time_left():
+        return (context.get_remaining_time_in_millis() - SUBMIT_DEADLINE_MARGIN_MS) / 1000
+
+    results = list(routed.values())
+    # Upload -> Bedrock start, per document; duplicates never start Bedrock
+    record_pipeline([
+        (result['job_id'], bucket, key, upload_times.get((bucket, key)), None)
+        for (bucket, key), result in routed.items()
+    ])
+    if tracked and (routed or split):
+        finish_pending(list(routed) + list(split), {})
+
+    # Each job is recorded shortly after it starts, so a timeout later in the
+    # batch cannot leave a submitted PDF pending, to be submitted again
+    unrecorded = {'jobs': [], 'pipeline': [], 'submitted': [], 'retry': {}, 'released': []}
+    chunk_of = {chunk: pdf for pdf, chunks in split.items() for chunk in chunks}
+
+    def record_outcomes():
+        jobs = unrecorded['jobs']
+        if not any(unrecorded.values()):
+            return
+        record_jobs(jobs, {
+            job_id: hashes[(bucket, key)]
+            for job_id, bucket, key, _, _ in jobs if (bucket, key) in hashes
+        })
+        # Before finish_pending, which drops the pending rows it falls back on
+        record_pipeline(unrecorded['pipeline'])
+        if tracked:
+            finish_pending(unrecorded['submitted'], unrecorded['retry'], unrecorded['released'])
+        unrecorded.update(jobs=[], pipeline=[], submitted=[], retry={}, released=[])
+
+    def on_outcome(index, outcome):
+        bucket, key = to_submit[index]
+        result, error, throttled = outcome
+        if error is None:
+            results.append(result)
+            unrecorded['submitted'].append((bucket, key))
+            unrecorded['jobs'].append((result['job_id'], bucket, key, result['invocationArn'], None))
+            source = chunk_of.get((bucket, key), (bucket, key))
+            unrecorded['pipeline'].append((
+                document_of(key) if is_chunk(key) else result['job_id'],
+                *source,
+                upload_times.get(source),
+                result['started_at']
+            ))
+        elif isinstance(error, submission.DeadlineReached):
+            unrecorded['released'].append((bucket, key))
+            results.append({
+                'statusCode': 202,
+                'original_key': key,
+                'pending': tracked,
+                'message': f'Not submitted before the deadline: {key}'
+            })
+        else:
+            print(f"Error: {key}: {str(error)}")
+            unrecorded['retry'][(bucket, key)] = str(error)
+            results.append({
+                'statusCode': 429 if throttled else 500,
+                'error': str(error),
+                'original_key': key,
+                'pending': tracked
+            })
+        if sum(len(outcomes) for outcomes in unrecorded.values()) >= SUBMIT_RECORD_EVERY:
+            record_outcomes()
+
+    submission.submit_all(
+        to_submit,
+        lambda pdf: start_extraction(bedrock_runtime, *pdf),
+        submit_bucket,
+        concurrency=SUBMIT_CONCURRENCY,
+        max_retries=SUBMIT_MAX_RETRIES,
+        time_left=time_left if context is not None else None,
+        on_outcome=on_outcome
+    )
+    record_outcomes()
+
+    # Event PDFs left out of this batch (older ones went first)
+    claimed = set(batch)
+    for bucket, key in new_pdfs:
+        if (bucket, key) not in claimed:
+            results.append({
+                'statusCode': 202,
+                'original_key': key,
+                'pending': True,
+                'message': f'Queued behind earlier submissions: {key}'
+            })
+
+    if len(results) == 1:
+        result = results[0]
+        if result['statusCode'] != 200:
+            result.pop('original_key', None)
+        return result
+
+    failures = [result for result in results if result['statusCode'] not in (200, 202)]
+    queued = [result for result in results if result['statusCode'] == 202]
+    return {
+        'statusCode': 200 if not failures else 207,
+        'submitted': len(results) - len(failures) - len(queued),
+        'queued': len(queued),
+        'failed': len(failures),
+        'results': results,
+        'failures': failures
+    }
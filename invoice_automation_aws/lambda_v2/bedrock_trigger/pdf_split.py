@@ -0,0 +1,50 @@
+"""
+Page-range splitting of long PDFs
+
+A statement with hundreds of pages used to be one Bedrock job, extracted
+serially from the first page to the last. Splitting it into page-range chunks
+lets the chunks be extracted in parallel; the processor merges their results
+back into one invoice in page order.
+
+Nothing in here knows about S3 or the database, so it can be run against local
+files (scripts/check_pdf_splitting.py).
+"""
+
+import io
+
+
+def page_ranges(page_count, chunk_pages):
+    """[(first_page, last_page)], 1-based and inclusive, covering every page in order"""
+    return [
+        (first, min(first + chunk_pages - 1, page_count))
+        for first in range(1, page_count + 1, chunk_pages)
+    ]
+
+
+def count_pages(data):
+    """Number of pages of a PDF given as bytes"""
+    # Imported here: only needed when splitting is enabled
+    from pypdf import PdfReader
+
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+def split_pdf(data, ranges):
+    """One PDF (bytes) per (first_page, last_page) range of the PDF given as bytes"""
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(io.BytesIO(data))
+    chunks = []
+    for first, last in ranges:
+        writer = PdfWriter()
+        for number in range(first - 1, last):
+            writer.add_page(reader.pages[number])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        chunks.append(buffer.getvalue())
+    return chunks
+
+
+def chunk_key(prefix, document_id, first_page, last_page):
+    """Key of one chunk; zero-padded so the chunks of a document list in page order"""
+    return f'{prefix}{document_id}/pages-{first_page:04d}-{last_page:04d}.pdf'
@@ -0,0 +1,148 @@
+"""
+Throttling-aware submission of Bedrock Data Automation jobs
+
+A burst of uploads used to mean one invoke_data_automation_async call per PDF,
+all at once, and every ThrottlingException was a lost document. Here a batch
+of submissions runs on a small thread pool behind a shared token bucket:
+
+- the bucket's rate halves on every throttle and creeps back up on success
+  (additive increase, multiplicative decrease), so the whole pool slows down
+  together instead of each worker hammering the service;
+- a throttled submission is retried after a jittered exponential backoff;
+- whatever has not gone through when the retries or the time budget run out
+  is returned as still pending for the caller to keep track of; once the
+  budget is spent no further submission is started, however long the queue;
+- each outcome is handed to the caller's thread as soon as it is known, so
+  the caller can record submitted jobs while the rest are still going.
+
+Nothing in here knows about boto3 clients or the database, so it can be
+driven by a stub client (scripts/simulate_bedrock_throttling.py).
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceQuotaExceededException',
+    'ServiceUnavailableException',
+    'SlowDown',
+}
+
+
+class DeadlineReached(Exception):
+    """The time budget ran out before this item was submitted"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose refill rate adapts to throttling"""
+
+    def __init__(self, rate, burst, min_rate=0.5, increase=0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.increase = increase
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """
+        Block until a token is available, then take it. With a timeout (in
+        seconds), give up and return False rather than wait past it.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def on_throttle(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Drop the saved-up burst too, or it would all go out at once
+            self._tokens = min(self._tokens, 1)
+
+    def on_success(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+def is_throttling(error):
+    """True for errors that mean "slow down", as opposed to a bad request"""
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in THROTTLING_ERROR_CODES
+
+
+def backoff_delay(attempt, base=0.5, cap=20.0):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2^attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def submit_all(items, submit, bucket, concurrency=4, max_retries=6, time_left=None, on_outcome=None):
+    """
+    Run submit(item) for every item with bounded concurrency.
+
+    Throttled calls are retried up to max_retries times with jittered backoff.
+    time_left, if given, returns the seconds still available; a retry that
+    would not fit is not attempted, and an item whose token would only come
+    after the deadline is not submitted at all (DeadlineReached). Returns one
+    (result, error, throttled) tuple per item, in order: result is submit's
+    return value on success; otherwise error is the last exception and
+    throttled tells whether it was a throttle or the deadline (i.e. worth
+    trying again later). on_outcome(index, outcome), if given, is called
+    from the caller's thread as each item finishes.
+    """
+    outcomes = [None] * len(items)
+    if not items:
+        return outcomes
+
+    def run(index, item):
+        attempt = 0
+        while True:
+            # Checked before every start, not once when the item is queued
+            if not bucket.acquire(None if time_left is None else max(0, time_left())):
+                outcomes[index] = (None, DeadlineReached('Time budget ran out before submission'), True)
+                return
+            try:
+                result = submit(item)
+            except Exception as e:
+                if not is_throttling(e):
+                    outcomes[index] = (None, e, False)
+                    return
+                bucket.on_throttle()
+                delay = backoff_delay(attempt)
+                attempt += 1
+                if attempt > max_retries or (time_left is not None and time_left() < delay + 1):
+                    outcomes[index] = (None, e, True)
+                    return
+                time.sleep(delay)
+                continue
+            bucket.on_success()
+            outcomes[index] = (result, None, False)
+            return
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(items))) as pool:
+        futures = {pool.submit(run, index, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            future.result()
+            if on_outcome is not None:
+                on_outcome(futures[future], outcomes[futures[future]])
+    return outcomes
@@ -0,0 +1,203 @@
+"""
+Database access shared by the invoice Lambdas
+
+Credentials and the Postgres connection live at module level so they survive
+across warm invocations of the same container. A Lambda container only runs one
+invocation at a time, so a single connection is all the "pool" we need.
+
+boto3 and psycopg2 are imported on first use, not when the function loads, so
+a cold start only pays for the ones its invocation actually reaches.
+"""
+
+import json
+import os
+import time
+
+SECRET_ID = os.environ.get('DB_SECRET_ID', 'invoice-automation/db-credentials')
+
+# Re-read the secret at least this often so rotated passwords get picked up
+SECRET_TTL_SECONDS = int(os.environ.get('DB_SECRET_TTL_SECONDS', '300'))
+
+# Only ping the server if the connection has been idle longer than this
+HEALTH_CHECK_INTERVAL_SECONDS = int(os.environ.get('DB_HEALTH_CHECK_INTERVAL_SECONDS', '30'))
+
+CONNECT_TIMEOUT_SECONDS = int(os.environ.get('DB_CONNECT_TIMEOUT_SECONDS', '5'))
+
+# Built on first use - warm invocations with a cached secret never need it
+_secretsmanager = None
+
+_secret = None
+_secret_fetched_at = 0.0
+
+_conn = None
+_conn_last_used = 0.0
+
+# Counters for the lifetime of this container
+stats = {
+    'secret_fetches': 0,
+    'secret_cache_hits': 0,
+    'connections_opened': 0,
+    'connection_reuses': 0,
+    'reconnects': 0,
+}
+
+
+def get_db_credentials(force_refresh=False):
+    """Retrieve database credentials from Secrets Manager, cached with a TTL"""
+    global _secret, _secret_fetched_at, _secretsmanager
+
+    age = time.monotonic() - _secret_fetched_at
+    if _secret is not None and not force_refresh and age < SECRET_TTL_SECONDS:
+        stats['secret_cache_hits'] += 1
+        return _secret
+
+    if _secretsmanager is None:
+        import boto3
+        _secretsmanager = boto3.client('secretsmanager')
+
+    try:
+        response = _secretsmanager.get_secret_value(SecretId=SECRET_ID)
+    except Exception as e:
+        print(f"Error retrieving credentials: {str(e)}")
+        raise
+
+    _secret = json.loads(response['SecretString'])
+    _secret_fetched_at = time.monotonic()
+    stats['secret_fetches'] += 1
+    return _secret
+
+
+def _connect(db_creds):
+    import psycopg2
+
+    conn = psycopg2.connect(
+        host=db_creds['host'],
+        port=db_creds['port'],
+        database=db_creds['dbname'],
+        user=db_creds['username'],
+        password=db_creds['password'],
+        connect_timeout=CONNECT_TIMEOUT_SECONDS,
+        keepalives=1,
+        keepalives_idle=30,
+    )
+    conn.autocommit = False
+    stats['connections_opened'] += 1
+    return conn
+
+
+def _open_connection():
+    """Connect with cached credentials, refreshing them once if auth fails (rotation)"""
+    import psycopg2
+
+    try:
+        return _connect(get_db_credentials())
+    except psycopg2.OperationalError as e:
+        print(f"Connect failed, refreshing credentials: {str(e).strip()}")
+        return _connect(get_db_credentials(force_refresh=True))
+
+
+def _is_healthy(conn):
+    import psycopg2
+
+    if conn.closed:
+        return False
+    if time.monotonic() - _conn_last_used < HEALTH_CHECK_INTERVAL_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def discard_connection():
+    """Drop the cached connection so the next checkout opens a fresh one"""
+    global _conn
+    if _conn is not None:
+        import psycopg2
+
+        try:
+            _conn.close()
+        except psycopg2.Error:
+            pass
+    _conn = None
+
+
+def get_connection():
+    """Return the container's connection, reconnecting if it was dropped"""
+    global _conn, _conn_last_used
+
+    if _conn is not None:
+        if _is_healthy(_conn):
+            stats['connection_reuses'] += 1
+            _conn_last_used = time.monotonic()
+            return _conn
+        print("Cached DB connection is no longer usable, reconnecting")
+        discard_connection()
+        stats['reconnects'] += 1
+
+    _conn = _open_connection()
+    _conn_last_used = time.monotonic()
+    return _conn
+
+
+def run_in_transaction(work):
+    """
+    Run work(cursor) in a transaction and commit it.
+
+    If the server dropped the connection while work ran, nothing was
+    committed, so we reconnect and run it once more before giving up. A failed
+    commit is never retried: the server may have committed before the
+    connection went away, and running work again would apply it twice.
+    """
+    import psycopg2
+
+    for attempt in (1, 2):
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            result = work(cursor)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if not conn.closed:
+                # Query-level failure on a live connection - not ours to retry
+                conn.rollback()
+                raise
+            discard_connection()
+            stats['reconnects'] += 1
+            if attempt == 2:
+                raise
+            print(f"DB connection lost mid-transaction, retrying: {str(e).strip()}")
+            continue
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            else:
+                discard_connection()
+            raise
+        finally:
+            if not conn.closed:
+                cursor.close()
+
+        try:
+            conn.commit()
+        except psycopg2.Error:
+            if conn.closed:
+                discard_connection()
+                stats['reconnects'] += 1
+            else:
+                conn.rollback()
+            raise
+        return result
+
+
+def execute_values(cursor, sql, argslist, **kwargs):
+    """psycopg2.extras.execute_values, imported on first use like the rest of psycopg2"""
+    from psycopg2 import extras
+
+    return extras.execute_values(cursor, sql, argslist, **kwargs)
+
+
+def log_stats():
+    print(f"DB connection stats: {json.dumps(stats)}")
@@ -1,101 +1,145 @@
+from datetime import datetime
+import html
 import json
-import psycopg2
-import boto3
 import os
-from datetime import datetime
 
-secretsmanager = boto3.client('secretsmanager')
+import db
 
-def get_db_credentials():
-    """Retrieve database credentials from Secrets Manager"""
-    try:
-        response = secretsmanager.get_secret_value(
-            SecretId='invoice-automation/db-credentials'
-        )
-        return json.loads(response['SecretString'])
-    except Exception as e:
-        print(f"Error retrieving credentials: {str(e)}")
-        raise
+# Most invoices one batch request may change; a filter matching more only
+# changes the first ones (by invoice_id) and says so on the summary page
+MAX_BATCH_INVOICES = int(os.environ.get('APPROVAL_MAX_BATCH', '200'))
 
-def lambda_handler(event, context):
+# Statuses an invoice can be decided from. Anything else was already decided,
+# by an approver or by the processor, and is left as it is
+ALLOWED_PRIOR_STATUSES = {
+    'approved': ('pending', 'pending_review'),
+    'rejected': ('pending', 'pending_review'),
+}
+
+
+def _error_page(status_code, message):
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'text/html'},
+        'body': f'<html><body><h1>Error: {html.escape(message)}</h1></body></html>'
+    }
+
+
+def parse_request(event):
     """
-    Approve or reject an invoice
-    Called via API Gateway with query parameters: invoice_id and action
+    Merge the query string and an optional JSON body into one dict of parameters.
+
+    invoice_ids can be a comma-separated string (query string), a list (JSON
+    body) or invoice_id repeated in the query string. Raises ValueError for
+    anything that isn't an integer ID.
     """
-    
+    params = dict(event.get('queryStringParameters') or {})
+    if event.get('body'):
+        body = json.loads(event['body'])
+        if not isinstance(body, dict):
+            raise ValueError('Request body must be a JSON object')
+        params.update(body)
+
+    raw_ids = []
+    repeated = (event.get('multiValueQueryStringParameters') or {}).get('invoice_id') or []
+    raw_ids.extend(repeated or ([params['invoice_id']] if params.get('invoice_id') else []))
+    invoice_ids = params.get('invoice_ids')
+    if isinstance(invoice_ids, str):
+        raw_ids.extend(part for part in invoice_ids.split(',') if part.strip())
+    elif isinstance(invoice_ids, list):
+        raw_ids.extend(invoice_ids)
+
     try:
-        # Parse query parameters
-        params = event.get('queryStringParameters', {})
-        invoice_id = params.get('invoice_id')
-        action = params.get('action')  # 'approve' or 'reject'
-        
-        if not invoice_id or not action:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'text/html'},
-                'body': '<html><body><h1>Error: Missing invoice_id or action</h1></body></html>'
-            }
-        
-        if action not in ['approve', 'reject']:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'text/html'},
-                'body': '<html><body><h1>Error: Action must be approve or reject</h1></body></html>'
-            }
-        
-        # Connect to database
-        db_creds = get_db_credentials()
-        conn = psycopg2.connect(
-            host=db_creds['host'],
-            port=db_creds['port'],
-            database=db_creds['dbname'],
-            user=db_creds['username'],
-            password=db_creds['password']
+        params['invoice_ids'] = sorted({int(str(value).strip()) for value in raw_ids})
+    except ValueError:
+        raise ValueError('invoice_id must be an integer')
+    return params
+
+
+def apply_action(cursor, new_status, invoice_ids=None, vendor=None, status=None, limit=MAX_BATCH_INVOICES):
+    """
+    Move the selected invoices to new_status in one statement.
+
+    Invoices are selected by ID and/or by vendor name (case-insensitive) and
+    current status, and only change if their status is one of
+    ALLOWED_PRIOR_STATUSES[new_status]. The rows are locked in the same
+    UPDATE, and Postgres re-checks the status of a row another transaction
+    changed while we waited for it, so of two concurrent decisions only the
+    first applies. Each change is appended to invoice_status_audit by the same
+    statement.
+
+    Returns (changed, unchanged), both lists of (invoice_id, invoice_number,
+    vendor_name, total_amount, status) by invoice_id: the previous status of
+    the changed invoices, and the requested IDs that exist but did not change
+    with the status they had when the statement started.
+    """
+    cursor.execute("""
+        WITH changed AS (
+            UPDATE invoices AS i
+            SET status = %(new_status)s,
+                processed_at = %(now)s,
+                approved_at = CASE WHEN %(new_status)s = 'approved' THEN %(now)s ELSE i.approved_at END
+            FROM (
+                SELECT i.invoice_id, i.status, v.vendor_name
+                FROM invoices i
+                LEFT JOIN vendors v ON v.vendor_id = i.vendor_id
+                WHERE i.status = ANY(%(allowed)s)
+                  AND (%(invoice_ids)s::integer[] IS NULL OR i.invoice_id = ANY(%(invoice_ids)s::integer[]))
+                  AND (%(vendor)s::text IS NULL OR LOWER(v.vendor_name) = LOWER(%(vendor)s::text))
+                  AND (%(status)s::text IS NULL OR i.status = %(status)s::text)
+                ORDER BY i.invoice_id
+                LIMIT %(limit)s
+                FOR UPDATE OF i
+            ) AS previous
+            WHERE i.invoice_id = previous.invoice_id
+            RETURNING i.invoice_id, i.invoice_number, previous.vendor_name, i.total_amount,
+                      previous.status AS previous_status
+        ),
+        audit AS (
+            INSERT INTO invoice_status_audit (invoice_id, from_status, to_status, changed_at)
+            SELECT invoice_id, previous_status, %(new_status)s, %(now)s
+            FROM changed
         )
-        
-        cursor = conn.cursor()
-        
-        # Get invoice details
-        cursor.execute("""
-            SELECT i.invoice_number, v.vendor_name, i.total_amount, i.status
-            FROM invoices i
-            JOIN vendors v ON i.vendor_id = v.vendor_id
-            WHERE i.invoice_id = %s
-        """, (invoice_id,))
-        
-        result = cursor.fetchone()
-        
-        if not result:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'text/html'},
-                'body': '<html><body><h1>Error: Invoice not found</h1></body></html>'
-            }
-        
-        invoice_number, vendor_name, total_amount, current_status = result
-        
-        # Update status
-        new_status = 'approved' if action == 'approve' else 'rejected'
-        
-        cursor.execute("""
-            UPDATE invoices 
-            SET status = %s, processed_at = %s
-            WHERE invoice_id = %s
-        """, (new_status, datetime.now(), invoice_id))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        print(f"Invoice {invoice_number} {new_status}")
-        
-        # Return success page
-        action_text = 'Approved' if action == 'approve' else 'Rejected'
-        color = 'green' if action == 'approve' else 'red'
-        
-        html = f"""
+        SELECT TRUE, invoice_id, invoice_number, vendor_name, total_amount, previous_status
+        FROM changed
+        UNION ALL
+        SELECT FALSE, i.invoice_id, i.invoice_number, v.vendor_name, i.total_amount, i.status
+        FROM invoices i
+        LEFT JOIN vendors v ON v.vendor_id = i.vendor_id
+        WHERE i.invoice_id = ANY(%(invoice_ids)s::integer[])
+          AND i.invoice_id NOT IN (SELECT invoice_id FROM changed)
+        ORDER BY 2
+    """, {
+        'new_status': new_status,
+        'allowed': list(ALLOWED_PRIOR_STATUSES[new_status]),
+        'now': datetime.now(),
+        'invoice_ids': invoice_ids or None,
+        'vendor': vendor,
+        'status': status,
+        'limit': limit,
+    })
+    changed, unchanged = [], []
+    for was_changed, *invoice in cursor.fetchall():
+        (changed if was_changed else unchanged).append(tuple(invoice))
+    return changed, unchanged
+
+
+def decided_as(current_status, new_status):
+    """How to describe the status of an invoice apply_action left unchanged"""
+    # Still undecided as of the statement's snapshot: another approver
+    # committed while this request waited for the row lock
+    if current_status in ALLOWED_PRIOR_STATUSES[new_status]:
+        return 'by another request'
+    return current_status or '-'
+
+
+def render_single(action, new_status, invoice):
+    """The page an approver gets from a single-invoice link"""
+    _, invoice_number, vendor_name, total_amount, current_status = invoice
+    action_text = 'Approved' if action == 'approve' else 'Rejected'
+    color = 'green' if action == 'approve' else 'red'
+
+    return f"""
         <html>
         <head>
             <title>Invoice {action_text}</title>
@@ -119,17 +163,150 @@ def lambda_handler(event, context):
         </body>
         </html>
         """
-        
+
+
+def render_summary(action, new_status, invoices, unchanged, not_found, limited):
+    """One page listing every invoice a batch request changed"""
+    action_text = 'Approved' if action == 'approve' else 'Rejected'
+    color = 'green' if action == 'approve' else 'red'
+    total = sum(float(invoice[3] or 0) for invoice in invoices)
+
+    rows = ''.join(
+        f"""
+                <tr>
+                    <td>{html.escape(str(invoice_number))}</td>
+                    <td>{html.escape(vendor_name or '-')}</td>
+                    <td class="amount">${float(total_amount or 0):,.2f}</td>
+                    <td>{html.escape(previous_status or '-')}</td>
+                </tr>"""
+        for _, invoice_number, vendor_name, total_amount, previous_status in invoices
+    )
+    notes = ''
+    if unchanged:
+        notes += "<p><strong>Not changed, already decided:</strong> " + ', '.join(
+            f"{html.escape(str(invoice_number))} ({html.escape(decided_as(current_status, new_status))})"
+            for _, invoice_number, _, _, current_status in unchanged
+        ) + "</p>"
+    if not_found:
+        notes += f"<p><strong>Not found:</strong> {', '.join(str(invoice_id) for invoice_id in not_found)}</p>"
+    if limited:
+        notes += (f"<p><strong>Limited to {len(invoices)} invoices.</strong> "
+                  f"Send the request again for the rest.</p>")
+
+    return f"""
+        <html>
+        <head>
+            <title>{len(invoices)} Invoices {action_text}</title>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 50px; }}
+                .success {{ color: {color}; font-size: 24px; font-weight: bold; }}
+                .details {{ margin-top: 20px; background: #f5f5f5; padding: 20px; border-radius: 5px; }}
+                table {{ border-collapse: collapse; margin-top: 20px; }}
+                th, td {{ padding: 6px 14px; border-bottom: 1px solid #ddd; text-align: left; }}
+                .amount {{ text-align: right; }}
+            </style>
+        </head>
+        <body>
+            <h1 class="success">&#10003; {len(invoices)} Invoice(s) {action_text}</h1>
+            <div class="details">
+                <p><strong>New Status:</strong> {new_status}</p>
+                <p><strong>Total Amount:</strong> ${total:,.2f}</p>
+                <p><strong>Action Time:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
+                {notes}
+            </div>
+            <table>
+                <tr><th>Invoice Number</th><th>Vendor</th><th class="amount">Amount</th><th>Previous Status</th></tr>{rows}
+            </table>
+            <p style="margin-top: 30px;">You can close this window.</p>
+        </body>
+        </html>
+        """
+
+
+def lambda_handler(event, context):
+    """
+    Approve or reject one invoice or a batch of them
+    Called via API Gateway with query parameters: invoice_id and action
+
+    For a batch, pass invoice_ids (comma-separated, or invoice_id repeated)
+    and/or a filter of vendor plus status, e.g.
+    ?action=approve&vendor=ACME%20CORPORATION&status=pending_review. The same
+    parameters are accepted as a JSON body. Every selected invoice changes in
+    one UPDATE and the response is a single summary page.
+
+    Only invoices in ALLOWED_PRIOR_STATUSES change; a single-invoice link for
+    an invoice that was already decided gets a 409.
+    """
+
+    try:
+        try:
+            params = parse_request(event)
+        except ValueError as e:
+            return _error_page(400, str(e))
+        invoice_ids = params['invoice_ids']
+        vendor = params.get('vendor') or None
+        status = params.get('status') or None
+        action = params.get('action')  # 'approve' or 'reject'
+
+        if not (invoice_ids or vendor or status) or not action:
+            return _error_page(400, 'Missing invoice_id or action')
+
+        if action not in ['approve', 'reject']:
+            return _error_page(400, 'Action must be approve or reject')
+
+        new_status = 'approved' if action == 'approve' else 'rejected'
+
+        # Filters alone must say which status they change, so the link shows
+        # what it acts on
+        if not invoice_ids and not status:
+            return _error_page(400, 'A vendor filter needs a status')
+
+        if status and status not in ALLOWED_PRIOR_STATUSES[new_status]:
+            return _error_page(
+                400, f"Only {' or '.join(ALLOWED_PRIOR_STATUSES[new_status])} invoices can be {new_status}"
+            )
+
+        if len(invoice_ids) > MAX_BATCH_INVOICES:
+            return _error_page(400, f'At most {MAX_BATCH_INVOICES} invoices per request')
+
+        invoices, unchanged = db.run_in_transaction(
+            lambda cursor: apply_action(cursor, new_status, invoice_ids, vendor, status)
+        )
+        db.log_stats()
+
+        single = len(invoice_ids) == 1 and not (vendor or status)
+        if single and unchanged:
+            _, invoice_number, _, _, current_status = unchanged[0]
+            decided = decided_as(current_status, new_status)
+            print(f"⚠ Invoice {invoice_number} not {new_status}: already decided ({decided})")
+            return _error_page(409, f'Invoice {invoice_number} was already decided ({decided})')
+
+        if single and not invoices:
+            return _error_page(404, 'Invoice not found')
+
+        for invoice in invoices:
+            print(f"Invoice {invoice[1]} {new_status}")
+
+        # Return success page
+        if single:
+            body = render_single(action, new_status, invoices[0])
+        else:
+            found = {invoice[0] for invoice in invoices + unchanged}
+            body = render_summary(
+                action,
+                new_status,
+                invoices,
+                unchanged,
+                not_found=[invoice_id for invoice_id in invoice_ids if invoice_id not in found],
+                limited=not invoice_ids and len(invoices) == MAX_BATCH_INVOICES
+            )
+
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'text/html'},
-            'body': html
+            'body': body
         }
-        
+
     except Exception as e:
         print(f"Error: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'text/html'},
-            'body': f'<html><body><h1>Error: {str(e)}</h1></body></html>'
-        }
\ No newline at end of file
+        return _error_page(500, str(e))
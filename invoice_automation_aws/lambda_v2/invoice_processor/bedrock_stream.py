@@ -0,0 +1,79 @@
+"""
+Streaming parser for large Bedrock result.json files
+
+json.loads on a big result keeps the raw bytes, the decoded string and the
+whole object tree in memory at once. Here the S3 body is read incrementally
+with ijson: everything except inference_result.invoice_items is built as usual,
+while the line items are spooled one at a time to a temporary file and read
+back lazily when they are inserted.
+"""
+
+import json
+import tempfile
+
+ITEMS_PREFIX = 'inference_result.invoice_items'
+ITEM_PREFIX = ITEMS_PREFIX + '.item'
+
+
+class LineItemSpool:
+    """Line items parked on local disk as JSON lines; iterates one item at a time"""
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+        self._count = 0
+
+    def append(self, item):
+        self._file.write(json.dumps(item))
+        self._file.write('\n')
+        self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def __iter__(self):
+        self._file.flush()
+        self._file.seek(0)
+        for line in self._file:
+            yield json.loads(line)
+
+    def close(self):
+        self._file.close()
+
+
+def parse_bedrock_stream(body):
+    """
+    Parse a Bedrock result from a file-like body (e.g. an S3 StreamingBody).
+
+    Returns the same structure json.loads would, except that
+    inference_result.invoice_items is a LineItemSpool.
+    """
+    # Imported here: most results are small and never need it
+    import ijson
+
+    builder = ijson.ObjectBuilder()
+    item_builder = None
+    spool = LineItemSpool()
+
+    for prefix, event, value in ijson.parse(body, use_float=True):
+        if prefix == ITEM_PREFIX or prefix.startswith(ITEM_PREFIX + '.'):
+            if item_builder is None:
+                if event != 'start_map':
+                    # Not an object - nothing we could insert
+                    continue
+                item_builder = ijson.ObjectBuilder()
+            item_builder.event(event, value)
+            if prefix == ITEM_PREFIX and event == 'end_map':
+                spool.append(item_builder.value)
+                item_builder = None
+            continue
+
+        builder.event(event, value)
+
+    document = builder.value if hasattr(builder, 'value') else {}
+    inference = document.get('inference_result')
+    if isinstance(inference, dict):
+        inference['invoice_items'] = spool
+    return document
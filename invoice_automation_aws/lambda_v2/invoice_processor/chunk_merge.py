@@ -0,0 +1,58 @@
+"""
+Merging the Bedrock results of a split PDF
+
+bedrock_trigger submits long PDFs as page-range chunks. Each chunk's result
+only covers its own pages: the header (invoice number, vendor, dates) is on
+the first pages, the totals on the last ones, and the line items are spread
+across all of them. merge_chunk_outputs puts them back together as the result
+Bedrock would have produced for the whole document.
+
+Nothing in here knows about S3 or the database, so it can be run against local
+files (scripts/check_pdf_splitting.py).
+"""
+
+import bedrock_stream
+
+# Printed at the end of a document, so the last chunk that has them wins
+SUMMARY_FIELDS = ('subtotal', 'discount', 'tax', 'total_amount')
+
+
+def _is_empty(value):
+    return value is None or value == '' or value == {} or value == []
+
+
+def merge_chunk_outputs(outputs):
+    """
+    Merge chunk results, given in page order, into one Bedrock result.
+
+    Line items are concatenated in page order. Other fields take the first
+    chunk's value that is not empty, except SUMMARY_FIELDS, which take the
+    last. Line items streamed to disk stay on disk; the confidence is the
+    lowest of the chunks'.
+    """
+    merged = {}
+    streamed = any(
+        isinstance(output.get('inference_result', {}).get('invoice_items'), bedrock_stream.LineItemSpool)
+        for output in outputs
+    )
+    items = bedrock_stream.LineItemSpool() if streamed else []
+
+    for output in outputs:
+        inference = output.get('inference_result', {})
+        for field, value in inference.items():
+            if field == 'invoice_items' or _is_empty(value):
+                continue
+            if field in SUMMARY_FIELDS or field not in merged:
+                merged[field] = value
+        for item in inference.get('invoice_items') or []:
+            items.append(item)
+    merged['invoice_items'] = items
+
+    blueprints = [output.get('matched_blueprint', {}) for output in outputs]
+    return {
+        'matched_blueprint': {
+            **blueprints[0],
+            'confidence': min(blueprint.get('confidence', 0) for blueprint in blueprints)
+        },
+        'inference_result': merged
+    }
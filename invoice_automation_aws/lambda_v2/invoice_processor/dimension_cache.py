@@ -0,0 +1,95 @@
+"""
+Bounded LRU caches for vendor and customer IDs
+
+The caches live at module level so they survive across warm invocations.
+Each entry maps a normalized name to (fingerprint, id), where the fingerprint
+is the tuple of attributes we would write for that row. A lookup only hits
+when the fingerprint matches, so a changed address or phone goes back to the
+database.
+
+Entries must only be added after the transaction that created or confirmed
+the row has committed.
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+DIMENSION_CACHE_SIZE = int(os.environ.get('DIMENSION_CACHE_SIZE', '1000'))
+
+
+class LRUCache:
+    """Least-recently-used mapping with hit/miss/eviction counters"""
+
+    def __init__(self, name, max_size):
+        self.name = name
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, fingerprint):
+        """Return the cached id for key if its fingerprint still matches"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != fingerprint:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, fingerprint, value):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (fingerprint, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+vendors = LRUCache('vendors', DIMENSION_CACHE_SIZE)
+customers = LRUCache('customers', DIMENSION_CACHE_SIZE)
+
+
+def normalize_name(name):
+    """Trim and collapse whitespace so 'Acme  Corp ' and 'Acme Corp' are one vendor"""
+    if not isinstance(name, str):
+        return name
+    return ' '.join(name.split())
+
+
+def vendor_fingerprint(invoice_data):
+    return (invoice_data.get('company_address'), invoice_data.get('company_contact'))
+
+
+def customer_fingerprint(invoice_data):
+    return (invoice_data.get('bill_to'), invoice_data.get('client_email'))
+
+
+def remember(entries):
+    """Add committed (cache, key, fingerprint, id) entries"""
+    for cache, key, fingerprint, value in entries:
+        cache.put(key, fingerprint, value)
+
+
+def clear():
+    """Forget everything, e.g. after the rows behind cached ids were deleted"""
+    vendors.clear()
+    customers.clear()
+
+
+def log_stats():
+    print(f"Dimension cache stats: {json.dumps({'vendors': vendors.stats(), 'customers': customers.stats()})}")
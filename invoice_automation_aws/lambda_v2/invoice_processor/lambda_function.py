@@ -1,241 +1,598 @@
 import json
-import boto3
-import psycopg2
-from datetime import datetime
+from datetime import datetime, timezone
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-s3 = boto3.client('s3')
-sns = boto3.client('sns')
-secretsmanager = boto3.client('secretsmanager')
+import bedrock_stream
+import chunk_merge
+import db
+import dimension_cache
+from db import execute_values
+from timing import StageTimer, emit_metrics
 
-def get_db_credentials():
-    """Retrieve database credentials from Secrets Manager"""
-    try:
-        response = secretsmanager.get_secret_value(
-            SecretId='invoice-automation/db-credentials'
-        )
-        return json.loads(response['SecretString'])
-    except Exception as e:
-        print(f"Error retrieving credentials: {str(e)}")
-        raise
+# Per-call timeouts and attempts, so one slow S3/SNS request cannot eat the
+# invocation: a PDF move or an SNS publish is bounded to a few seconds
+AWS_CONNECT_TIMEOUT_SECONDS = int(os.environ.get('AWS_CONNECT_TIMEOUT_SECONDS', '1'))
+AWS_READ_TIMEOUT_SECONDS = int(os.environ.get('AWS_READ_TIMEOUT_SECONDS', '3'))
+AWS_CALL_ATTEMPTS = int(os.environ.get('AWS_CALL_ATTEMPTS', '2'))
+# botocore Config options, built in aws_client()
+AWS_CLIENT_CONFIG = {
+    'connect_timeout': AWS_CONNECT_TIMEOUT_SECONDS,
+    'read_timeout': AWS_READ_TIMEOUT_SECONDS,
+    'retries': {'total_max_attempts': AWS_CALL_ATTEMPTS, 'mode': 'standard'},
+}
 
-def lambda_handler(event, context):
+# Longest one S3/SNS call can take: every attempt timing out on connect and
+# on read, plus the standard-mode backoff before each retry (up to 2^n seconds)
+AWS_CALL_WORST_CASE_MS = 1000 * (
+    AWS_CALL_ATTEMPTS * (AWS_CONNECT_TIMEOUT_SECONDS + AWS_READ_TIMEOUT_SECONDS)
+    + sum(2 ** n for n in range(AWS_CALL_ATTEMPTS - 1))
+)
+
+# boto3 clients by service name, see aws_client()
+_clients = {}
+_clients_lock = threading.Lock()
+
+HIGH_VALUE_THRESHOLD = 50000  # $50,000
+
+# Columns Postgres rejects as NULL - a record missing one can never be stored
+REQUIRED_FIELDS = ['invoice_number', 'company_name', 'total_amount', 'invoice_date']
+
+# Batches with at least this many line items are streamed with COPY instead of
+# a multi-row INSERT (see scripts/benchmark_line_items.py). 0 = always COPY.
+LINE_ITEM_COPY_THRESHOLD = int(os.environ.get('LINE_ITEM_COPY_THRESHOLD', '50'))
+
+# Results at least this large are parsed incrementally (bedrock_stream.py)
+STREAM_PARSE_THRESHOLD_BYTES = int(os.environ.get('STREAM_PARSE_THRESHOLD_BYTES', str(5 * 1024 * 1024)))
+
+# Parallel S3 downloads when a batch or job has several result files
+FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', '8'))
+
+# Parallel post-commit side effects (SNS publishes, PDF moves)
+SIDE_EFFECT_CONCURRENCY = int(os.environ.get('SIDE_EFFECT_CONCURRENCY', '8'))
+
+# A side effect that would start with less than this much of the invocation
+# left is written to deferred_actions for deferred_actions_handler instead.
+# By default the worst case of the longest one, a PDF move (copy, then
+# delete), so a move that starts is never cut off between its two calls.
+DEFER_BELOW_REMAINING_MS = int(os.environ.get('DEFER_BELOW_REMAINING_MS', str(2 * AWS_CALL_WORST_CASE_MS)))
+
+# Sweeper: actions claimed per round, how long a claim is held before another
+# sweep may retry it, and how many attempts an action gets
+DEFERRED_BATCH_SIZE = int(os.environ.get('DEFERRED_BATCH_SIZE', '100'))
+DEFERRED_LEASE_SECONDS = int(os.environ.get('DEFERRED_LEASE_SECONDS', '900'))
+DEFERRED_MAX_ATTEMPTS = int(os.environ.get('DEFERRED_MAX_ATTEMPTS', '5'))
+
+# Sweeper: a digest or PDF move is not started with less than this much of
+# the invocation left; it is released for the next sweep instead. By default
+# a move (copy, then delete) plus a few seconds to record the round
+DEFERRED_ITEM_RESERVE_MS = int(os.environ.get('DEFERRED_ITEM_RESERVE_MS', str(2 * AWS_CALL_WORST_CASE_MS + 5000)))
+
+# Invoices per SNS approval digest (SNS messages are capped at 256 KB)
+DIGEST_MAX_INVOICES = 50
+
+# invoice_data fields a deferred approval notification needs
+NOTIFICATION_FIELDS = (
+    'invoice_number', 'company_name', 'total_amount', 'invoice_date',
+    'due_date', 'po_number', 'confidence_score'
+)
+
+# delete_objects takes at most 1000 keys per call
+S3_DELETE_BATCH = 1000
+
+LINE_ITEM_COLUMNS = ('invoice_id', 'description', 'quantity', 'unit_price', 'amount', 'line_number')
+
+
+def aws_client(service):
     """
-    Triggered when Bedrock outputs result.json
-    Extracts data, validates, and writes to database
+    boto3 client for service, built on first use and reused by warm invocations.
+
+    Creating a client loads its service model, so functions that never need
+    one (e.g. SNS for a batch without high-value invoices) don't pay for it.
     """
-    
+    if service not in _clients:
+        # Fetch threads may ask for the same client at once
+        with _clients_lock:
+            if service not in _clients:
+                import boto3
+                from botocore.config import Config
+
+                _clients[service] = boto3.client(service, config=Config(**AWS_CLIENT_CONFIG))
+    return _clients[service]
+
+
+def extract_invoice_data(bedrock_output, bucket, key):
+    """Map a Bedrock custom_output result onto our invoice fields"""
+    inference = bedrock_output.get('inference_result', {})
+
+    invoice_data = {
+        'invoice_number': inference.get('invoice_number'),
+        'company_name': dimension_cache.normalize_name(inference.get('company_name')),
+        'company_address': inference.get('company_address'),
+        'company_contact': inference.get('company_contact_information'),
+        'bill_to': inference.get('bill_to'),
+        'client_email': inference.get('client_email'),
+        'invoice_date': inference.get('invoice_date'),
+        'due_date': inference.get('due_date'),
+        'po_number': inference.get('po_number'),
+        'subtotal': inference.get('subtotal'),
+        'discount': inference.get('discount'),
+        'tax': inference.get('tax'),
+        'total_amount': inference.get('total_amount'),
+        'payment_terms': inference.get('payment_terms'),
+        'payment_instructions': inference.get('payment_details', {}).get('payment_instructions'),
+        'bank_name': inference.get('bank_details', {}).get('bank_name'),
+        'account_number': inference.get('bank_details', {}).get('account_number'),
+        'routing_number': inference.get('bank_details', {}).get('routing_number'),
+        'line_items': inference.get('invoice_items', []),
+        's3_key': key,
+        's3_bucket': bucket,
+    }
+
+    confidence = bedrock_output.get('matched_blueprint', {}).get('confidence', 0) * 100
+    invoice_data['confidence_score'] = round(confidence, 2)
+
+    print(f"Extracted: {invoice_data['invoice_number']}, Confidence: {confidence}%")
+    return invoice_data
+
+
+def invoice_total(invoice_data):
     try:
-        # Get S3 event details
-        bucket = event['Records'][0]['s3']['bucket']['name']
-        key = event['Records'][0]['s3']['object']['key']
-        
-        # Only process custom_output result.json files
-        if 'custom_output' not in key or not key.endswith('result.json'):
-            print(f"Skipping non-custom-output file: {key}")
-            return {'statusCode': 200, 'message': 'Skipped'}
-        
-        print(f"Processing: s3://{bucket}/{key}")
-        
-        # 1. EXTRACT - Download and parse Bedrock output
-        response = s3.get_object(Bucket=bucket, Key=key)
-        bedrock_output = json.loads(response['Body'].read().decode('utf-8'))
-        
-        inference = bedrock_output.get('inference_result', {})
-        
-        invoice_data = {
-            'invoice_number': inference.get('invoice_number'),
-            'company_name': inference.get('company_name'),
-            'company_address': inference.get('company_address'),
-            'company_contact': inference.get('company_contact_information'),
-            'bill_to': inference.get('bill_to'),
-            'client_email': inference.get('client_email'),
-            'invoice_date': inference.get('invoice_date'),
-            'due_date': inference.get('due_date'),
-            'po_number': inference.get('po_number'),
-            'subtotal': inference.get('subtotal'),
-            'discount': inference.get('discount'),
-            'tax': inference.get('tax'),
-            'total_amount': inference.get('total_amount'),
-            'payment_terms': inference.get('payment_terms'),
-            'payment_instructions': inference.get('payment_details', {}).get('payment_instructions'),
-            'bank_name': inference.get('bank_details', {}).get('bank_name'),
-            'account_number': inference.get('bank_details', {}).get('account_number'),
-            'routing_number': inference.get('bank_details', {}).get('routing_number'),
-            'line_items': inference.get('invoice_items', []),
-            's3_key': key,
-            's3_bucket': bucket,
-        }
-        
-        confidence = bedrock_output.get('matched_blueprint', {}).get('confidence', 0) * 100
-        invoice_data['confidence_score'] = round(confidence, 2)
-        
-        print(f"Extracted: {invoice_data['invoice_number']}, Confidence: {confidence}%")
-        
-        # 2. VALIDATE - Business rules
-        validation_errors = []
-        warnings = []
-        
-        # Required fields
-        required_fields = ['invoice_number', 'company_name', 'total_amount', 'invoice_date']
-        for field in required_fields:
-            if not invoice_data.get(field):
-                validation_errors.append(f"Missing required field: {field}")
-        
-        # Total amount must be positive
-        total = invoice_data.get('total_amount')
-        if total is not None and total != '':
-            try:
-                if float(total) <= 0:
-                    validation_errors.append(f"Invalid total amount: {total}")
-            except (ValueError, TypeError):
-                validation_errors.append(f"Invalid total amount format: {total}")
-        
-        # Confidence threshold
-        if confidence < 70:
-            warnings.append(f"Low confidence: {confidence}%")
-        
-        is_valid = len(validation_errors) == 0
-        needs_review = len(warnings) > 0
-
-        # Determine status based on validation and amount
-        total_amount_float = float(invoice_data.get('total_amount', 0))
-        HIGH_VALUE_THRESHOLD = 50000  # $50,000
-
-        if not is_valid:
-            print(f"✗ Validation failed: {validation_errors}")
-            status = 'failed'
-        elif total_amount_float > HIGH_VALUE_THRESHOLD:
-            print(f"💰 High-value invoice: ${total_amount_float:,.2f} - Requires approval")
-            status = 'pending_review'
-        elif needs_review:
-            print(f"⚠ Needs review: {warnings}")
-            status = 'pending_review'
-        else:
-            print(f"✓ Validation passed")
-            status = 'approved'
-        
-        # 3. PROCESS - Write to database
-        db_creds = get_db_credentials()
-        conn = psycopg2.connect(
-            host=db_creds['host'],
-            port=db_creds['port'],
-            database=db_creds['dbname'],
-            user=db_creds['username'],
-            password=db_creds['password']
-        )
-        
-        cursor = conn.cursor()
-        conn.autocommit = False
-        
+        return float(invoice_data.get('total_amount') or 0)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def validate_invoice(invoice_data):
+    """Apply business rules; returns (status, validation_errors)"""
+    validation_errors = []
+    warnings = []
+
+    # Required fields
+    for field in REQUIRED_FIELDS:
+        if not invoice_data.get(field):
+            validation_errors.append(f"Missing required field: {field}")
+
+    # Total amount must be positive
+    total = invoice_data.get('total_amount')
+    if total is not None and total != '':
         try:
-            # Insert vendor
-            cursor.execute("""
-                INSERT INTO vendors (vendor_name, vendor_address, vendor_phone, vendor_email, payment_terms, is_approved)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                ON CONFLICT (vendor_name) DO UPDATE SET
-                    vendor_address = EXCLUDED.vendor_address,
-                    vendor_phone = EXCLUDED.vendor_phone
-                RETURNING vendor_id
-            """, (
-                invoice_data.get('company_name'),
-                invoice_data.get('company_address'),
-                invoice_data.get('company_contact'),
-                None,
-                invoice_data.get('payment_terms'),
-                True
-            ))
-            vendor_id = cursor.fetchone()[0]
-            
-            # Insert customer
+            if float(total) <= 0:
+                validation_errors.append(f"Invalid total amount: {total}")
+        except (ValueError, TypeError):
+            validation_errors.append(f"Invalid total amount format: {total}")
+
+    # Confidence threshold
+    confidence = invoice_data.get('confidence_score', 0)
+    if confidence < 70:
+        warnings.append(f"Low confidence: {confidence}%")
+
+    is_valid = len(validation_errors) == 0
+    needs_review = len(warnings) > 0
+
+    # Determine status based on validation and amount
+    total_amount_float = invoice_total(invoice_data)
+
+    if not is_valid:
+        print(f"✗ Validation failed: {validation_errors}")
+        status = 'failed'
+    elif total_amount_float > HIGH_VALUE_THRESHOLD:
+        print(f"💰 High-value invoice: ${total_amount_float:,.2f} - Requires approval")
+        status = 'pending_review'
+    elif needs_review:
+        print(f"⚠ Needs review: {warnings}")
+        status = 'pending_review'
+    else:
+        print(f"✓ Validation passed")
+        status = 'approved'
+
+    return status, validation_errors
+
+
+def _copy_value(value):
+    """Format one value for COPY ... FROM STDIN (text format)"""
+    if value is None:
+        return '\\N'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+class _CopyStream:
+    """File-like view of line item rows as COPY text, encoded lazily on read()"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += '\t'.join(_copy_value(value) for value in row) + '\n'
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def insert_line_items(cursor, rows, count=None):
+    """
+    Write line item rows (tuples in LINE_ITEM_COLUMNS order) in one round trip:
+    a single multi-row INSERT, or a COPY stream for large batches.
+
+    rows may be a generator if count is given; the COPY path consumes it one
+    row at a time so spooled line items never have to sit in memory together.
+    """
+    if count is None:
+        rows = list(rows)
+        count = len(rows)
+    if not count:
+        return
+
+    if count >= LINE_ITEM_COPY_THRESHOLD:
+        cursor.copy_expert(
+            f"COPY invoice_line_items ({', '.join(LINE_ITEM_COLUMNS)}) FROM STDIN",
+            _CopyStream(rows)
+        )
+        return
+
+    rows = list(rows)
+    execute_values(cursor, f"""
+        INSERT INTO invoice_line_items ({', '.join(LINE_ITEM_COLUMNS)})
+        VALUES %s
+    """, rows, page_size=len(rows))
+
+
+def upsert_vendors(cursor, vendor_rows):
+    """
+    Return {vendor_name: vendor_id} for vendor rows, writing only what changed.
+
+    Existing vendors are resolved with a plain indexed read that takes no
+    locks. Only vendors whose address/phone differ get an UPDATE, and only
+    unknown vendors get an INSERT, so a burst of invoices from an unchanged
+    vendor never serializes on its row lock or writes new tuple versions.
+    vendor_rows are tuples of (name, address, phone, email, payment_terms, is_approved).
+    """
+    rows_by_name = {row[0]: row for row in vendor_rows}
+    names = sorted(rows_by_name)
+
+    cursor.execute("""
+        SELECT vendor_name, vendor_id, vendor_address, vendor_phone
+        FROM vendors
+        WHERE vendor_name = ANY(%s)
+    """, (names,))
+    existing = {name: (vendor_id, address, phone) for name, vendor_id, address, phone in cursor.fetchall()}
+
+    vendor_ids = {}
+    missing = []
+    for name in names:
+        if name not in existing:
+            missing.append(rows_by_name[name])
+            continue
+        vendor_ids[name] = existing[name][0]
+
+    if missing:
+        inserted = execute_values(cursor, """
+            INSERT INTO vendors (vendor_name, vendor_address, vendor_phone, vendor_email, payment_terms, is_approved)
+            VALUES %s
+            ON CONFLICT (vendor_name) DO NOTHING
+            RETURNING vendor_name, vendor_id
+        """, missing, page_size=len(missing), fetch=True)
+        vendor_ids.update(dict(inserted))
+
+        # Lost an insert race to a concurrent invoice - the winner has
+        # committed by now, so read its row like any other existing vendor
+        raced = [row[0] for row in missing if row[0] not in vendor_ids]
+        if raced:
             cursor.execute("""
-                INSERT INTO customers (customer_name, customer_address, customer_email)
-                VALUES (%s, %s, %s)
-                ON CONFLICT DO NOTHING
-                RETURNING customer_id
-            """, (
-                invoice_data.get('bill_to'),
-                invoice_data.get('bill_to'),
-                invoice_data.get('client_email')
+                SELECT vendor_name, vendor_id, vendor_address, vendor_phone
+                FROM vendors
+                WHERE vendor_name = ANY(%s)
+            """, (raced,))
+            for name, vendor_id, address, phone in cursor.fetchall():
+                existing[name] = (vendor_id, address, phone)
+                vendor_ids[name] = vendor_id
+
+    changed = [
+        (name, rows_by_name[name][1], rows_by_name[name][2])
+        for name in names
+        if name in existing and existing[name][1:] != rows_by_name[name][1:3]
+    ]
+    if changed:
+        # IS DISTINCT FROM re-checks under the row lock, so a concurrent
+        # writer that already applied the same change costs us nothing
+        execute_values(cursor, """
+            UPDATE vendors v SET
+                vendor_address = u.vendor_address,
+                vendor_phone = u.vendor_phone
+            FROM (VALUES %s) AS u (vendor_name, vendor_address, vendor_phone)
+            WHERE v.vendor_name = u.vendor_name
+              AND (v.vendor_address IS DISTINCT FROM u.vendor_address
+                   OR v.vendor_phone IS DISTINCT FROM u.vendor_phone)
+        """, changed, page_size=len(changed))
+
+    return vendor_ids
+
+
+def resolve_vendor_ids(cursor, records, cache_entries):
+    """
+    Map each distinct vendor name in the batch to its vendor_id.
+
+    Vendors whose cached attributes match what we'd write are served from the
+    LRU cache without touching the database; the rest go through
+    upsert_vendors. The last record for a vendor in the batch wins. New
+    (cache, key, fingerprint, id) entries are appended to cache_entries for
+    the caller to remember after commit.
+    """
+    vendor_ids = {}
+    to_upsert = {}
+    for record in records:
+        data = record['invoice_data']
+        name = data.get('company_name')
+        fingerprint = dimension_cache.vendor_fingerprint(data)
+        vendor_id = dimension_cache.vendors.get(name, fingerprint)
+        if vendor_id is not None:
+            vendor_ids[name] = vendor_id
+            continue
+        to_upsert[name] = (fingerprint, (
+            name,
+            data.get('company_address'),
+            data.get('company_contact'),
+            None,
+            data.get('payment_terms'),
+            True
+        ))
+
+    if to_upsert:
+        upserted = upsert_vendors(cursor, [row for _, row in to_upsert.values()])
+        for name, vendor_id in upserted.items():
+            vendor_ids[name] = vendor_id
+            cache_entries.append((dimension_cache.vendors, name, to_upsert[name][0], vendor_id))
+
+    return vendor_ids
+
+
+def resolve_customer_ids(cursor, records, cache_entries):
+    """
+    Return a customer_id per record, inserting customers we haven't cached.
+
+    Customers have no natural key, so new IDs are allocated up front and the
+    rows inserted with explicit IDs - that keeps the record -> customer_id
+    mapping exact.
+    """
+    customer_ids = [None] * len(records)
+    missing = {}
+    for idx, record in enumerate(records):
+        data = record['invoice_data']
+        name = dimension_cache.normalize_name(data.get('bill_to'))
+        fingerprint = dimension_cache.customer_fingerprint(data)
+        customer_id = dimension_cache.customers.get(name, fingerprint)
+        if customer_id is not None:
+            customer_ids[idx] = customer_id
+        else:
+            missing.setdefault((name, fingerprint), []).append(idx)
+
+    if missing:
+        cursor.execute("""
+            SELECT nextval(pg_get_serial_sequence('customers', 'customer_id'))
+            FROM generate_series(1, %s)
+        """, (len(missing),))
+        new_ids = [row[0] for row in cursor.fetchall()]
+        customer_rows = []
+        for customer_id, ((name, fingerprint), indexes) in zip(new_ids, missing.items()):
+            data = records[indexes[0]]['invoice_data']
+            customer_rows.append((
+                customer_id,
+                data.get('bill_to'),
+                data.get('bill_to'),
+                data.get('client_email')
             ))
-            result = cursor.fetchone()
-            customer_id = result[0] if result else None
-            
-            # Insert invoice
-            cursor.execute("""
-                INSERT INTO invoices (
-                    invoice_number, vendor_id, customer_id,
-                    invoice_date, due_date,
-                    subtotal, discount, tax_amount, total_amount,
-                    po_number, payment_terms, payment_instructions,
-                    status, confidence_score,
-                    s3_key, s3_bucket,
-                    processed_at
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING invoice_id
-            """, (
-                invoice_data.get('invoice_number'),
-                vendor_id,
+            for idx in indexes:
+                customer_ids[idx] = customer_id
+            cache_entries.append((dimension_cache.customers, name, fingerprint, customer_id))
+
+        execute_values(cursor, """
+            INSERT INTO customers (customer_id, customer_name, customer_address, customer_email)
+            VALUES %s
+            ON CONFLICT DO NOTHING
+        """, customer_rows, page_size=len(customer_rows))
+
+    return customer_ids
+
+
+def _insert_batch(cursor, records, cache_entries, timer):
+    """
+    Set-based insert of a batch of records.
+
+    Each record is a dict with 'invoice_data' and 'status'. Returns
+    ({index: invoice_id}, {index: error}) where the errors are records whose
+    invoice_number is already in the database. Each table's write time is
+    added to timer.
+    """
+    with timer.stage('db_vendors'):
+        vendor_ids = resolve_vendor_ids(cursor, records, cache_entries)
+    with timer.stage('db_customers'):
+        customer_ids = resolve_customer_ids(cursor, records, cache_entries)
+
+    # Invoices - an invoice_number that already exists is reported per record
+    with timer.stage('db_invoices'):
+        invoice_rows = execute_values(cursor, """
+            INSERT INTO invoices (
+                invoice_number, vendor_id, customer_id,
+                invoice_date, due_date,
+                subtotal, discount, tax_amount, total_amount,
+                po_number, payment_terms, payment_instructions,
+                status, confidence_score,
+                s3_key, s3_bucket,
+                processed_at
+            )
+            VALUES %s
+            ON CONFLICT (invoice_number) DO NOTHING
+            RETURNING invoice_number, invoice_id
+        """, [
+            (
+                data.get('invoice_number'),
+                vendor_ids[data.get('company_name')],
                 customer_id,
-                invoice_data.get('invoice_date'),
-                invoice_data.get('due_date'),
-                invoice_data.get('subtotal'),
-                abs(float(invoice_data.get('discount') or 0)),
-                invoice_data.get('tax'),
-                invoice_data.get('total_amount'),
-                invoice_data.get('po_number'),
-                invoice_data.get('payment_terms'),
-                invoice_data.get('payment_instructions'),
-                status,
-                invoice_data.get('confidence_score'),
-                invoice_data.get('s3_key'),
-                invoice_data.get('s3_bucket'),
+                data.get('invoice_date'),
+                data.get('due_date'),
+                data.get('subtotal'),
+                abs(float(data.get('discount') or 0)),
+                data.get('tax'),
+                data.get('total_amount'),
+                data.get('po_number'),
+                data.get('payment_terms'),
+                data.get('payment_instructions'),
+                record['status'],
+                data.get('confidence_score'),
+                data.get('s3_key'),
+                data.get('s3_bucket'),
                 datetime.now()
-            ))
-            invoice_id = cursor.fetchone()[0]
-            
-            # Insert line items
-            line_items = invoice_data.get('line_items', [])
-            if line_items:
-                for idx, item in enumerate(line_items, 1):
-                    cursor.execute("""
-                        INSERT INTO invoice_line_items (
-                            invoice_id, description, quantity, unit_price, amount, line_number
-                        )
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (
-                        invoice_id,
-                        item.get('description'),
-                        item.get('quantity'),
-                        item.get('unit_price'),
-                        item.get('amount'),
-                        idx
-                    ))
-            
-            # Insert bank details
-            if invoice_data.get('bank_name'):
-                cursor.execute("""
-                    INSERT INTO bank_details (vendor_id, bank_name, account_number, routing_number)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT DO NOTHING
-                """, (
-                    vendor_id,
-                    invoice_data.get('bank_name'),
-                    invoice_data.get('account_number'),
-                    invoice_data.get('routing_number')
-                ))
-            
-            conn.commit()
-            print(f"✓ Invoice {invoice_data.get('invoice_number')} saved (ID: {invoice_id})")
-            
-            # Send SNS notification for high-value invoices
-            if total_amount_float > HIGH_VALUE_THRESHOLD:
-                try:
-                    approve_url = f"{os.environ.get('APPROVAL_API_ENDPOINT')}?invoice_id={invoice_id}&action=approve"
-                    reject_url = f"{os.environ.get('APPROVAL_API_ENDPOINT')}?invoice_id={invoice_id}&action=reject"
-                    
-                    message = f"""
+            )
+            for customer_id, record in zip(customer_ids, records)
+            for data in [record['invoice_data']]
+        ], page_size=len(records), fetch=True)
+    invoice_ids_by_number = dict(invoice_rows)
+
+    saved = {}
+    duplicates = {}
+    for idx, record in enumerate(records):
+        invoice_number = record['invoice_data'].get('invoice_number')
+        if invoice_number in invoice_ids_by_number:
+            saved[idx] = invoice_ids_by_number[invoice_number]
+        else:
+            duplicates[idx] = f"Duplicate invoice_number: {invoice_number}"
+
+    # Line items for every saved invoice in one round trip
+    line_item_rows = (
+        (
+            saved[idx],
+            item.get('description'),
+            item.get('quantity'),
+            item.get('unit_price'),
+            item.get('amount'),
+            line_number
+        )
+        for idx, record in enumerate(records) if idx in saved
+        for line_number, item in enumerate(record['invoice_data'].get('line_items') or [], 1)
+    )
+    line_item_count = sum(
+        len(record['invoice_data'].get('line_items') or [])
+        for idx, record in enumerate(records) if idx in saved
+    )
+    with timer.stage('db_line_items'):
+        insert_line_items(cursor, line_item_rows, line_item_count)
+
+    # Bank details
+    bank_rows = [
+        (
+            vendor_ids[data.get('company_name')],
+            data.get('bank_name'),
+            data.get('account_number'),
+            data.get('routing_number')
+        )
+        for idx, record in enumerate(records) if idx in saved
+        for data in [record['invoice_data']]
+        if data.get('bank_name')
+    ]
+    if bank_rows:
+        with timer.stage('db_bank_details'):
+            execute_values(cursor, """
+                INSERT INTO bank_details (vendor_id, bank_name, account_number, routing_number)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+            """, bank_rows, page_size=len(bank_rows))
+
+    return saved, duplicates
+
+
+def save_invoices(cursor, records, timer=None):
+    """
+    Write a batch of records inside the caller's transaction.
+
+    The whole batch goes in with set-based inserts. If Postgres rejects it
+    (bad date, oversized field, ...) or a value cannot be converted on our
+    side (a discount of '$5.00'), we fall back to one savepoint per record so
+    a single bad document only fails itself.
+    Returns ({index: invoice_id}, {index: error}, cache_entries); the cache
+    entries are only safe to remember once the transaction commits.
+    """
+    if not records:
+        return {}, {}, []
+    import psycopg2.errors
+
+    timer = timer or StageTimer()
+
+    cursor.execute("SAVEPOINT invoice_batch")
+    try:
+        cache_entries = []
+        saved, failed = _insert_batch(cursor, records, cache_entries, timer)
+        cursor.execute("RELEASE SAVEPOINT invoice_batch")
+        return saved, failed, cache_entries
+    except psycopg2.errors.ForeignKeyViolation as e:
+        # A cached vendor/customer id points at a row that no longer exists
+        print(f"Stale dimension cache, clearing it: {str(e).strip()}")
+        cursor.execute("ROLLBACK TO SAVEPOINT invoice_batch")
+        dimension_cache.clear()
+    except (psycopg2.DataError, psycopg2.IntegrityError, ValueError, TypeError) as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT invoice_batch")
+        if len(records) == 1:
+            return {}, {0: str(e).strip()}, []
+        print(f"Batch insert failed, retrying record by record: {str(e).strip()}")
+
+    saved = {}
+    failed = {}
+    cache_entries = []
+    for idx, record in enumerate(records):
+        cursor.execute("SAVEPOINT invoice_record")
+        record_cache_entries = []
+        try:
+            record_saved, record_failed = _insert_batch(cursor, [record], record_cache_entries, timer)
+            cursor.execute("RELEASE SAVEPOINT invoice_record")
+            cache_entries.extend(record_cache_entries)
+            if record_saved:
+                saved[idx] = record_saved[0]
+            else:
+                failed[idx] = record_failed[0]
+        except (psycopg2.DataError, psycopg2.IntegrityError, ValueError, TypeError) as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT invoice_record")
+            failed[idx] = str(e).strip()
+    return saved, failed, cache_entries
+
+
+def approval_urls(invoice_id):
+    endpoint = os.environ.get('APPROVAL_API_ENDPOINT')
+    return (
+        f"{endpoint}?invoice_id={invoice_id}&action=approve",
+        f"{endpoint}?invoice_id={invoice_id}&action=reject"
+    )
+
+
+def batch_approval_urls(invoice_ids):
+    """Links that approve or reject all of invoice_ids in one request"""
+    endpoint = os.environ.get('APPROVAL_API_ENDPOINT')
+    ids = ','.join(str(invoice_id) for invoice_id in invoice_ids)
+    return (
+        f"{endpoint}?invoice_ids={ids}&action=approve",
+        f"{endpoint}?invoice_ids={ids}&action=reject"
+    )
+
+
+def send_approval_notification(invoice_data, invoice_id, timer=None):
+    """Email approvers about a high-value invoice via SNS; raises on failure"""
+    total_amount_float = invoice_total(invoice_data)
+    timer = timer or StageTimer()
+    approve_url, reject_url = approval_urls(invoice_id)
+
+    message = f"""
 High-Value Invoice Requires Approval
 
 Invoice Number: {invoice_data.get('invoice_number')}
@@ -257,92 +614,1370 @@ REJECT: {reject_url}
 
 Click one of the links above to approve or reject this invoice.
 """
-                    
-                    sns.publish(
-                        TopicArn=os.environ['SNS_TOPIC_ARN'],
-                        Subject=f'🔔 High-Value Invoice Approval Required: {invoice_data.get("invoice_number")}',
-                        Message=message.strip()
-                    )
-                    print(f"✓ Approval notification sent via SNS")
-                except Exception as e:
-                    print(f"⚠ Failed to send SNS notification: {str(e)}")
-            
-            cursor.close()
-            conn.close()
-            
-            # Move PDF to appropriate bucket based on status
-            # Extract job_id from S3 key (format: /job-id/0/custom_output/0/result.json)
-            parts = key.split('/')
-            job_id = parts[1] if len(parts) > 1 and parts[0] == '' else parts[0]
-            print(f"Extracted job_id: {job_id}")
-            
+
+    with timer.stage('sns_publish'):
+        aws_client('sns').publish(
+            TopicArn=os.environ['SNS_TOPIC_ARN'],
+            Subject=f'🔔 High-Value Invoice Approval Required: {invoice_data.get("invoice_number")}',
+            Message=message.strip()
+        )
+    print(f"✓ Approval notification sent via SNS")
+
+
+def send_approval_digest(notifications):
+    """Email approvers one SNS message covering several high-value invoices"""
+    sections = []
+    for invoice_data in notifications:
+        approve_url, reject_url = approval_urls(invoice_data['invoice_id'])
+        sections.append(f"""
+Invoice Number: {invoice_data.get('invoice_number')}
+Vendor: {invoice_data.get('company_name')}
+Amount: ${invoice_total(invoice_data):,.2f}
+Date: {invoice_data.get('invoice_date')}
+Due Date: {invoice_data.get('due_date')}
+PO Number: {invoice_data.get('po_number')}
+Confidence Score: {invoice_data.get('confidence_score')}%
+
+APPROVE: {approve_url}
+REJECT: {reject_url}
+""".strip())
+
+    approve_all_url, reject_all_url = batch_approval_urls(
+        invoice_data['invoice_id'] for invoice_data in notifications
+    )
+    message = f"""
+{len(notifications)} High-Value Invoices Require Approval
+
+These invoices exceed the ${HIGH_VALUE_THRESHOLD:,.2f} threshold and require manual approval.
+Click the links below each invoice to approve or reject it.
+
+APPROVE ALL: {approve_all_url}
+REJECT ALL: {reject_all_url}
+
+"""
+    aws_client('sns').publish(
+        TopicArn=os.environ['SNS_TOPIC_ARN'],
+        Subject=f'🔔 {len(notifications)} High-Value Invoices Require Approval',
+        Message=(message + '\n\n----------\n\n'.join(sections)).strip()
+    )
+    print(f"✓ Approval digest for {len(notifications)} invoices sent via SNS")
+
+
+def job_id_from_key(key):
+    """
+    Extract job_id from a Bedrock output key.
+
+    Outputs live under [prefix/]<job_id>/<asset>/custom_output/<segment>/result.json
+    and the job's metadata under [prefix/]<job_id>/job_metadata.json.
+    """
+    parts = [part for part in key.split('/') if part]
+    if 'custom_output' in parts:
+        idx = parts.index('custom_output')
+        if idx >= 2:
+            return parts[idx - 2]
+    if parts and parts[-1] == 'job_metadata.json' and len(parts) >= 2:
+        return parts[-2]
+    return parts[0] if parts else key
+
+
+def lookup_source_pdfs(cursor, job_ids):
+    """Resolve job_ids to (bucket, key) of their original PDFs via the bedrock_jobs index"""
+    if not job_ids:
+        return {}
+    cursor.execute("""
+        SELECT job_id, source_bucket, source_key
+        FROM bedrock_jobs
+        WHERE job_id = ANY(%s)
+    """, (list(job_ids),))
+    return {job_id: (bucket, key) for job_id, bucket, key in cursor.fetchall()}
+
+
+def resolve_duplicate_uploads(cursor, records, failed):
+    """
+    Re-uploads of an already extracted PDF are routed here by bedrock_trigger
+    with a copy of the original's Bedrock output (bedrock_jobs.duplicate_of),
+    so their invoice_number is already taken. Those are not failures: returns
+    {index: existing invoice_id} for them and removes them from failed.
+    """
+    if not failed:
+        return {}
+
+    cursor.execute("""
+        SELECT job_id
+        FROM bedrock_jobs
+        WHERE job_id = ANY(%s)
+          AND duplicate_of IS NOT NULL
+    """, (list({job_id_from_key(records[idx]['invoice_data']['s3_key']) for idx in failed}),))
+    duplicate_jobs = {job_id for job_id, in cursor.fetchall()}
+    candidates = {
+        idx: records[idx]['invoice_data']['invoice_number']
+        for idx in failed
+        if job_id_from_key(records[idx]['invoice_data']['s3_key']) in duplicate_jobs
+    }
+    if not candidates:
+        return {}
+
+    cursor.execute("""
+        SELECT invoice_number, invoice_id
+        FROM invoices
+        WHERE invoice_number = ANY(%s)
+    """, (list(set(candidates.values())),))
+    existing = dict(cursor.fetchall())
+
+    reused = {idx: existing[number] for idx, number in candidates.items() if number in existing}
+    for idx in reused:
+        del failed[idx]
+    return reused
+
+
+def mark_extracted(cursor, job_ids):
+    """Let bedrock_trigger reuse these jobs' output for later uploads of the same PDF"""
+    if job_ids:
+        cursor.execute("""
+            UPDATE document_hashes
+            SET extracted_at = NOW()
+            WHERE job_id = ANY(%s)
+              AND extracted_at IS NULL
+        """, (list(job_ids),))
+
+
+def find_original_pdfs_by_tag(job_ids):
+    """
+    Fallback for jobs missing from bedrock_jobs (e.g. submitted before the
+    index existed): scan the incoming bucket for matching bedrock_job_id tags.
+    One scan covers every job in job_ids; returns {job_id: (bucket, key)}.
+    """
+    incoming_bucket = os.environ['INCOMING_BUCKET']
+    found = {}
+    paginator = aws_client('s3').get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=incoming_bucket):
+        for obj in page.get('Contents', []):
             try:
-                # Find the original PDF in incoming bucket by job_id tag
-                incoming_bucket = os.environ['INCOMING_BUCKET']
-                
-                # List objects in incoming bucket and find the one with matching job_id tag
-                response = s3.list_objects_v2(Bucket=incoming_bucket)
-                
-                original_pdf_key = None
-                if 'Contents' in response:
-                    for obj in response['Contents']:
-                        try:
-                            tags_response = s3.get_object_tagging(
-                                Bucket=incoming_bucket,
-                                Key=obj['Key']
-                            )
-                            for tag in tags_response.get('TagSet', []):
-                                if tag['Key'] == 'bedrock_job_id' and tag['Value'] == job_id:
-                                    original_pdf_key = obj['Key']
-                                    break
-                            if original_pdf_key:
-                                break
-                        except:
-                            continue
-                
-                if original_pdf_key:
-                    if status == 'approved':
-                        # Move to processed bucket
-                        dest_bucket = os.environ['PROCESSED_BUCKET']
-                        s3.copy_object(
-                            CopySource={'Bucket': incoming_bucket, 'Key': original_pdf_key},
-                            Bucket=dest_bucket,
-                            Key=original_pdf_key
-                        )
-                        s3.delete_object(Bucket=incoming_bucket, Key=original_pdf_key)
-                        print(f"✓ Moved {original_pdf_key} to processed bucket")
-                    else:
-                        # Move to failed bucket (pending_review, rejected, or failed)
-                        dest_bucket = os.environ['FAILED_BUCKET']
-                        s3.copy_object(
-                            CopySource={'Bucket': incoming_bucket, 'Key': original_pdf_key},
-                            Bucket=dest_bucket,
-                            Key=original_pdf_key
-                        )
-                        s3.delete_object(Bucket=incoming_bucket, Key=original_pdf_key)
-                        print(f"⚠ Moved {original_pdf_key} to failed bucket (status: {status})")
-                else:
-                    print(f"⚠ Could not find original PDF for job_id: {job_id}")
-                    
+                tags_response = aws_client('s3').get_object_tagging(
+                    Bucket=incoming_bucket,
+                    Key=obj['Key']
+                )
+            except Exception:
+                continue
+            for tag in tags_response.get('TagSet', []):
+                if tag['Key'] == 'bedrock_job_id' and tag['Value'] in job_ids:
+                    found[tag['Value']] = (incoming_bucket, obj['Key'])
+                    if len(found) == len(job_ids):
+                        return found
+    return found
+
+
+def move_original_pdf(job_id, source, status, timer=None):
+    """
+    Move the source PDF out of the incoming bucket based on invoice status.
+    source is resolved by the caller (bedrock_jobs, then one tag scan for the
+    whole batch). Returns False if there is none; raises on failure.
+    """
+    print(f"Extracted job_id: {job_id}")
+    timer = timer or StageTimer()
+
+    if source:
+        incoming_bucket, original_pdf_key = source
+        if status == 'approved':
+            # Move to processed bucket
+            dest_bucket = os.environ['PROCESSED_BUCKET']
+            with timer.stage('pdf_move'):
+                aws_client('s3').copy_object(
+                    CopySource={'Bucket': incoming_bucket, 'Key': original_pdf_key},
+                    Bucket=dest_bucket,
+                    Key=original_pdf_key
+                )
+                aws_client('s3').delete_object(Bucket=incoming_bucket, Key=original_pdf_key)
+            print(f"✓ Moved {original_pdf_key} to processed bucket")
+        else:
+            # Move to failed bucket (pending_review, rejected, or failed)
+            dest_bucket = os.environ['FAILED_BUCKET']
+            with timer.stage('pdf_move'):
+                aws_client('s3').copy_object(
+                    CopySource={'Bucket': incoming_bucket, 'Key': original_pdf_key},
+                    Bucket=dest_bucket,
+                    Key=original_pdf_key
+                )
+                aws_client('s3').delete_object(Bucket=incoming_bucket, Key=original_pdf_key)
+            print(f"⚠ Moved {original_pdf_key} to failed bucket (status: {status})")
+        return True
+
+    print(f"⚠ Could not find original PDF for job_id: {job_id}")
+    return False
+
+
+def normalize_etag(etag):
+    # S3 events carry the ETag bare, GetObject returns it quoted
+    return etag.strip('"') if etag else None
+
+
+def fetch_bedrock_result(bucket, key, timer=None):
+    """
+    Download and parse one Bedrock result.json, returning (output, etag)
+
+    Large results are parsed straight off the S3 stream, with their line
+    items spooled to disk instead of held in memory. A streamed body is read
+    while parsing, so its download time lands in json_parse.
+    """
+    timer = timer or StageTimer()
+    with timer.stage('s3_fetch'):
+        response = aws_client('s3').get_object(Bucket=bucket, Key=key)
+        if response.get('ContentLength', 0) >= STREAM_PARSE_THRESHOLD_BYTES:
+            print(f"Streaming parse of {key} ({response['ContentLength']:,} bytes)")
+            body = None
+        else:
+            body = response['Body'].read()
+
+    with timer.stage('json_parse'):
+        if body is None:
+            output = bedrock_stream.parse_bedrock_stream(response['Body'])
+        else:
+            output = json.loads(body.decode('utf-8'))
+    return output, normalize_etag(response.get('ETag'))
+
+
+def fetch_bedrock_output(bucket, key, timer=None):
+    """Download and parse one Bedrock output file"""
+    return fetch_bedrock_result(bucket, key, timer)[0]
+
+
+def fetch_bedrock_outputs(targets, timers):
+    """
+    Fetch (position, bucket, key) targets concurrently.
+
+    Returns {position: (parsed output, etag) or the exception raised fetching it}.
+    Fetch and parse times go to timers[position].
+    """
+    outputs = {}
+    if not targets:
+        return outputs
+
+    with ThreadPoolExecutor(max_workers=min(FETCH_CONCURRENCY, len(targets))) as pool:
+        futures = {
+            pool.submit(fetch_bedrock_result, bucket, key, timers[position]): position
+            for position, bucket, key in targets
+        }
+        for future in as_completed(futures):
+            try:
+                outputs[futures[future]] = future.result()
             except Exception as e:
-                print(f"Could not move PDF: {str(e)}")
-            
-            return {
-                'statusCode': 200,
-                'invoice_id': invoice_id,
-                'invoice_number': invoice_data.get('invoice_number'),
-                'status': status
-            }
-            
+                outputs[futures[future]] = e
+    return outputs
+
+
+def lookup_processed_results(targets):
+    """
+    Idempotency check for (position, bucket, key, etag) targets, before any
+    download or parsing.
+
+    Returns {position: stored result} for objects already saved. An etag of
+    None (e.g. records built by job_completion_handler) matches any version
+    of the key. A failed lookup only costs the fast path.
+    """
+    if not targets:
+        return {}
+
+    def lookup(cursor):
+        return execute_values(cursor, """
+            SELECT v.position, p.result
+            FROM (VALUES %s) AS v(position, bucket, object_key, etag)
+            JOIN processed_results p
+              ON p.bucket = v.bucket
+             AND p.object_key = v.object_key
+             AND (v.etag IS NULL OR p.etag = v.etag)
+        """, [
+            (position, bucket, key, etag)
+            for position, bucket, key, etag in targets
+        ], template='(%s, %s, %s, %s::text)', page_size=len(targets), fetch=True)
+
+    try:
+        return dict(db.run_in_transaction(lookup))
+    except Exception as e:
+        print(f"⚠ Idempotency lookup failed, processing normally: {str(e)}")
+        return {}
+
+
+def record_processed_results(cursor, entries):
+    """Add (bucket, key, etag, result) to the ledger inside the invoice transaction"""
+    if not entries:
+        return
+    execute_values(cursor, """
+        INSERT INTO processed_results (bucket, object_key, etag, result)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+    """, [
+        (bucket, key, etag, json.dumps(result))
+        for bucket, key, etag, result in entries
+    ], page_size=len(entries))
+
+
+def _saved_result(invoice_id, invoice_data, status):
+    return {
+        'statusCode': 200,
+        'invoice_id': invoice_id,
+        'invoice_number': invoice_data.get('invoice_number'),
+        'status': status
+    }
+
+
+def _raw_json_default(value):
+    # Streamed line items are only kept as a count
+    if isinstance(value, bedrock_stream.LineItemSpool):
+        return {'streamed_line_items': len(value)}
+    return str(value)
+
+
+def log_extraction(entries):
+    """
+    Write one bedrock_extraction_log row per extracted document and emit its
+    stage timings as metrics.
+
+    entries are (key, invoice_id, bedrock_output, results entry, StageTimer,
+    elapsed_ms); the database stages of a batch are shared by its records.
+    Logging never fails the invocation.
+    """
+    rows = []
+    for key, invoice_id, bedrock_output, result, timer, elapsed_ms in entries:
+        blueprint = bedrock_output.get('matched_blueprint') or {}
+        emit_metrics('invoice_processor', timer.stages, {
+            'key': key,
+            'invoice_id': invoice_id,
+            'success': invoice_id is not None,
+        })
+        rows.append((
+            invoice_id,
+            (blueprint.get('name') or '')[:100] or None,
+            round(blueprint.get('confidence', 0) * 100, 2),
+            json.dumps(bedrock_output, default=_raw_json_default),
+            int(elapsed_ms),
+            invoice_id is not None,
+            result.get('error'),
+            json.dumps(timer.stages)
+        ))
+
+    if not rows:
+        return
+
+    def write_log(cursor):
+        execute_values(cursor, """
+            INSERT INTO bedrock_extraction_log (
+                invoice_id, model_version, overall_confidence, raw_json,
+                processing_time_ms, success, error_message, stage_timings
+            )
+            VALUES %s
+        """, rows, page_size=len(rows))
+
+    try:
+        db.run_in_transaction(write_log)
+    except Exception as e:
+        print(f"⚠ Could not write extraction log: {str(e)}")
+
+
+def record_pipeline(entries):
+    """
+    Fill in the processor's pipeline_ledger timestamps.
+
+    entries are (job_id, output_at, committed_at, final_status, pdf_moved_at);
+    None leaves a column as it is. The first output and commit of a job are
+    kept. Upserted, since bedrock_trigger may not have written its part yet.
+    Best effort, like the extraction log.
+    """
+    if not entries:
+        return
+
+    def write(cursor):
+        execute_values(cursor, """
+            INSERT INTO pipeline_ledger (job_id, output_at, committed_at, final_status, pdf_moved_at)
+            VALUES %s
+            ON CONFLICT (job_id) DO UPDATE SET
+                output_at = COALESCE(pipeline_ledger.output_at, EXCLUDED.output_at),
+                committed_at = COALESCE(pipeline_ledger.committed_at, EXCLUDED.committed_at),
+                final_status = COALESCE(EXCLUDED.final_status, pipeline_ledger.final_status),
+                pdf_moved_at = COALESCE(pipeline_ledger.pdf_moved_at, EXCLUDED.pdf_moved_at)
+        """, entries, template='(%s, %s::timestamptz, %s::timestamptz, %s, %s::timestamptz)',
+            page_size=len(entries))
+
+    try:
+        db.run_in_transaction(write)
+    except Exception as e:
+        print(f"⚠ Could not write pipeline_ledger: {str(e)}")
+
+
+def has_time_left(context):
+    """True unless the invocation is within DEFER_BELOW_REMAINING_MS of its timeout"""
+    return context is None or context.get_remaining_time_in_millis() >= DEFER_BELOW_REMAINING_MS
+
+
+def sweep_has_time_left(context):
+    """True unless the sweep is within DEFERRED_ITEM_RESERVE_MS of its timeout"""
+    return context is None or context.get_remaining_time_in_millis() >= DEFERRED_ITEM_RESERVE_MS
+
+
+def run_side_effects(effects, context=None):
+    """
+    Run independent post-commit side effects concurrently.
+
+    effects is a list of (failure_message, function, args, deferral). A side
+    effect that raises is reported with its failure_message and does not stop
+    the others. One that would start too close to the Lambda timeout is not
+    run; its deferral, an (action_type, payload) for deferred_actions, is
+    returned instead.
+    Returns ([(failure_message, error)], [deferral]).
+    """
+    failures = []
+    deferred = []
+    if not effects:
+        return failures, deferred
+
+    def run(function, args, deferral):
+        # Checked when the side effect starts, not when it is queued
+        if not has_time_left(context):
+            return deferral
+        function(*args)
+        return None
+
+    with ThreadPoolExecutor(max_workers=min(SIDE_EFFECT_CONCURRENCY, len(effects))) as pool:
+        futures = {
+            pool.submit(run, function, args, deferral): failure_message
+            for failure_message, function, args, deferral in effects
+        }
+        for future in as_completed(futures):
+            try:
+                deferral = future.result()
+            except Exception as e:
+                print(f"{futures[future]}: {str(e)}")
+                failures.append((futures[future], str(e)))
+                continue
+            if deferral is not None:
+                deferred.append(deferral)
+    return failures, deferred
+
+
+def defer_actions(actions):
+    """Queue (action_type, payload) side effects for deferred_actions_handler"""
+    if not actions:
+        return
+
+    def write_actions(cursor):
+        execute_values(cursor, """
+            INSERT INTO deferred_actions (action_type, payload)
+            VALUES %s
+        """, [
+            (action_type, json.dumps(payload, default=str))
+            for action_type, payload in actions
+        ], page_size=len(actions))
+
+    try:
+        db.run_in_transaction(write_actions)
+        print(f"⚠ Deferred {len(actions)} side effect(s) to deferred_actions, not enough time left")
+    except Exception as e:
+        # Keep the payloads in the logs so they can be replayed by hand
+        print(f"✗ Could not defer side effects {json.dumps(actions, default=str)}: {str(e)}")
+
+
+def collect_chunks(targets, outputs, results, timers):
+    """
+    Record the results of split-PDF chunks and merge the documents they complete.
+
+    bedrock_trigger splits long PDFs into page-range chunks (document_chunks).
+    Each chunk's result location is recorded as it arrives; the chunk that
+    completes its document claims the merge (split_documents.merged_at) and
+    gets the merged result to save, keyed under the document's own job
+    (<document_id>/merged/custom_output/0/result.json) so the original PDF is
+    found and moved as usual. Chunks still waiting for the rest are reported
+    as stored.
+
+    Returns ({position: merge dict} for the completing chunks, positions of
+    the chunks only stored); finish_merges releases or cleans up after the
+    merges once the batch is saved.
+    """
+    chunk_targets = {
+        job_id_from_key(key): (position, bucket, key)
+        for position, bucket, key in targets
+        if not isinstance(outputs[position], Exception)
+    }
+    if not chunk_targets:
+        return {}, set()
+
+    def store(cursor):
+        cursor.execute("""
+            SELECT job_id, document_id
+            FROM document_chunks
+            WHERE job_id = ANY(%s)
+        """, (list(chunk_targets),))
+        chunks = dict(cursor.fetchall())
+        if not chunks:
+            return chunks, {}, {}
+        documents = sorted(set(chunks.values()))
+
+        # Serializes invocations that bring in the last chunks of a document
+        cursor.execute("""
+            SELECT document_id
+            FROM split_documents
+            WHERE document_id = ANY(%s)
+            ORDER BY document_id
+            FOR UPDATE
+        """, (documents,))
+        execute_values(cursor, """
+            UPDATE document_chunks AS c
+            SET result_bucket = v.bucket,
+                result_key = v.object_key,
+                completed_at = NOW()
+            FROM (VALUES %s) AS v(job_id, bucket, object_key)
+            WHERE c.job_id = v.job_id
+        """, [
+            (job_id, chunk_targets[job_id][1], chunk_targets[job_id][2])
+            for job_id in chunks
+        ], page_size=len(chunks))
+
+        cursor.execute("""
+            UPDATE split_documents AS d
+            SET merged_at = NOW()
+            WHERE d.document_id = ANY(%s)
+              AND d.merged_at IS NULL
+              AND NOT EXISTS (
+                  SELECT 1
+                  FROM document_chunks c
+                  WHERE c.document_id = d.document_id
+                    AND c.completed_at IS NULL
+              )
+            RETURNING d.document_id, d.source_bucket
+        """, (documents,))
+        complete = dict(cursor.fetchall())
+
+        cursor.execute("""
+            SELECT document_id, job_id, chunk_key, result_bucket, result_key
+            FROM document_chunks
+            WHERE document_id = ANY(%s)
+            ORDER BY document_id, chunk_index
+        """, (documents,))
+        parts = {}
+        for document_id, job_id, chunk_key, result_bucket, result_key in cursor.fetchall():
+            parts.setdefault(document_id, []).append((job_id, chunk_key, result_bucket, result_key))
+        return chunks, complete, parts
+
+    chunks, complete, parts = db.run_in_transaction(store)
+
+    arrived = {}
+    for job_id, document_id in chunks.items():
+        position, _, key = chunk_targets[job_id]
+        arrived.setdefault(document_id, []).append((position, key))
+        results[position] = {
+            'statusCode': 200,
+            'message': f'Chunk of {document_id} stored',
+            'key': key
+        }
+
+    merges = {}
+    for document_id, source_bucket in complete.items():
+        # The last of the document's chunks in this batch saves the merge
+        position, key = max(arrived[document_id])
+        try:
+            merged = merge_document(parts[document_id], chunks, chunk_targets, outputs, timers[position])
+        except Exception as e:
+            print(f"Error: could not merge {document_id}: {str(e)}")
+            release_merges([document_id])
+            for other, other_key in arrived[document_id]:
+                results[other] = _failure(other_key, str(e))
+            continue
+
+        print(f"✓ Merged {len(parts[document_id])} chunk(s) of {document_id} in page order")
+        results[position] = None
+        merges[position] = {
+            'document_id': document_id,
+            'key': f'{document_id}/merged/custom_output/0/result.json',
+            'output': merged,
+            'chunk_pdfs': [(source_bucket, chunk_key) for _, chunk_key, _, _ in parts[document_id]],
+        }
+
+    stored = {
+        chunk_targets[job_id][0] for job_id in chunks
+        if chunk_targets[job_id][0] not in merges
+        and results[chunk_targets[job_id][0]]['statusCode'] == 200
+    }
+    return merges, stored
+
+
+def merge_document(parts, chunks, chunk_targets, outputs, timer):
+    """
+    Merged Bedrock result of one split document.
+
+    parts are its chunks in page order, as (job_id, chunk_key, result_bucket,
+    result_key). Chunks of this batch are already parsed in outputs; the ones
+    that arrived in earlier invocations are fetched again.
+    """
+    earlier = [
+        (job_id, result_bucket, result_key)
+        for job_id, _, result_bucket, result_key in parts
+        if job_id not in chunks
+    ]
+    earlier_timers = {job_id: StageTimer() for job_id, _, _ in earlier}
+    fetched = fetch_bedrock_outputs(earlier, earlier_timers)
+    for earlier_timer in earlier_timers.values():
+        timer.merge(earlier_timer)
+
+    chunk_outputs = []
+    for job_id, _, _, _ in parts:
+        if job_id in chunks:
+            chunk_outputs.append(outputs[chunk_targets[job_id][0]])
+            continue
+        if isinstance(fetched[job_id], Exception):
+            raise fetched[job_id]
+        chunk_outputs.append(fetched[job_id][0])
+
+    with timer.stage('chunk_merge'):
+        return chunk_merge.merge_chunk_outputs(chunk_outputs)
+
+
+def release_merges(document_ids):
+    """Let the next delivery of a chunk merge these documents again"""
+    if not document_ids:
+        return
+
+    def release(cursor):
+        cursor.execute("""
+            UPDATE split_documents
+            SET merged_at = NULL
+            WHERE document_id = ANY(%s)
+        """, (list(document_ids),))
+
+    try:
+        db.run_in_transaction(release)
+    except Exception as e:
+        print(f"✗ Could not release merges of {document_ids}: {str(e)}")
+
+
+def finish_merges(merges, invoice_ids):
+    """
+    After the batch is saved: release the merges that did not make it, so a
+    redelivered chunk retries them, and delete the chunk PDFs of the rest.
+    """
+    release_merges([
+        merge['document_id'] for position, merge in merges.items()
+        if position not in invoice_ids
+    ])
+
+    chunk_pdfs = {}
+    for position, merge in merges.items():
+        if position in invoice_ids:
+            for bucket, key in merge['chunk_pdfs']:
+                chunk_pdfs.setdefault(bucket, []).append(key)
+    for bucket, keys in chunk_pdfs.items():
+        for start in range(0, len(keys), S3_DELETE_BATCH):
+            try:
+                aws_client('s3').delete_objects(Bucket=bucket, Delete={
+                    'Objects': [{'Key': key} for key in keys[start:start + S3_DELETE_BATCH]],
+                    'Quiet': True
+                })
+            except Exception as e:
+                print(f"⚠ Could not delete chunk PDFs in {bucket}: {str(e)}")
+
+
+def _failure(key, error):
+    return {'statusCode': 500, 'error': error, 'key': key}
+
+
+def process_records(s3_records, context=None):
+    """
+    Extract, validate and persist every S3 record of one event.
+
+    Returns one result per record, in event order. Successful results have the
+    shape the handler has always returned for a single invoice; failures carry
+    statusCode 500, the error and the record's key. With the Lambda context,
+    post-commit side effects that no longer fit the time budget are deferred.
+    """
+    started = time.perf_counter()
+    results = [None] * len(s3_records)
+    records = []
+    positions = []
+    seen_numbers = set()
+
+    # 1. EXTRACT - fetch every custom_output result of the batch concurrently
+    candidates = []
+    output_times = {}
+    for position, s3_record in enumerate(s3_records):
+        bucket = s3_record['s3']['bucket']['name']
+        key = s3_record['s3']['object']['key']
+
+        # Only process custom_output result.json files
+        if 'custom_output' not in key or not key.endswith('result.json'):
+            print(f"Skipping non-custom-output file: {key}")
+            results[position] = {'statusCode': 200, 'message': 'Skipped', 'key': key}
+            continue
+
+        candidates.append((position, bucket, key, normalize_etag(s3_record['s3']['object'].get('eTag'))))
+        output_times[position] = s3_record.get('eventTime')
+
+    # Redelivered events: return what the first delivery saved
+    processed = lookup_processed_results(candidates)
+    targets = []
+    for position, bucket, key, etag in candidates:
+        if position in processed:
+            print(f"✓ Already processed s3://{bucket}/{key}, returning stored result")
+            results[position] = processed[position]
+            continue
+        print(f"Processing: s3://{bucket}/{key}")
+        targets.append((position, bucket, key))
+
+    timers = {position: StageTimer() for position, _, _ in targets}
+    fetched = fetch_bedrock_outputs(targets, timers)
+    outputs = {}
+    etags = {}
+    for position, output in fetched.items():
+        if isinstance(output, Exception):
+            outputs[position] = output
+        else:
+            outputs[position], etags[position] = output
+
+    # Chunks of a split PDF wait for the rest of their document; the one that
+    # completes it carries the merged document from here on
+    try:
+        merges, stored = collect_chunks(targets, outputs, results, timers)
+    except Exception as e:
+        print(f"⚠ Split-PDF chunk check failed, processing normally: {str(e)}")
+        merges, stored = {}, set()
+
+    # 2. VALIDATE - per record, so one bad document only fails itself
+    for position, bucket, key in targets:
+        if results[position] is not None:
+            continue
+        try:
+            bedrock_output = outputs[position]
+            if isinstance(bedrock_output, Exception):
+                raise bedrock_output
+            if position in merges:
+                key, bedrock_output = merges[position]['key'], merges[position]['output']
+            with timers[position].stage('validation'):
+                invoice_data = extract_invoice_data(bedrock_output, bucket, key)
+                status, validation_errors = validate_invoice(invoice_data)
         except Exception as e:
-            conn.rollback()
-            cursor.close()
-            conn.close()
-            raise e
-        
+            print(f"Error: {key}: {str(e)}")
+            results[position] = _failure(key, str(e))
+            continue
+
+        if any(not invoice_data.get(field) for field in REQUIRED_FIELDS):
+            results[position] = _failure(key, '; '.join(validation_errors))
+            continue
+
+        # Two documents with the same invoice_number in one batch - keep the first
+        invoice_number = invoice_data['invoice_number']
+        if invoice_number in seen_numbers:
+            results[position] = _failure(key, f"Duplicate invoice_number in batch: {invoice_number}")
+            continue
+        seen_numbers.add(invoice_number)
+
+        records.append({
+            'invoice_data': invoice_data,
+            'status': status,
+            'etag': etags[position],
+            'output_at': output_times.get(position)
+        })
+        positions.append(position)
+
+    invoice_ids = {}
+    if records:
+        invoice_ids = persist_records(records, positions, results, timers, context)
+    finish_merges(merges, invoice_ids)
+
+    # 5. Log every document that was extracted, with its stage timings
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    log_extraction([
+        (
+            key,
+            invoice_ids.get(position),
+            outputs[position],
+            results[position],
+            timers[position],
+            elapsed_ms
+        )
+        for position, _, key in targets
+        if not isinstance(outputs[position], Exception) and position not in stored
+    ])
+
+    return results
+
+
+def persist_records(records, positions, results, timers, context=None):
+    """
+    Write validated records in one transaction, then run the post-commit side
+    effects. Fills in results and returns {position: invoice_id} of the saved records.
+
+    The per-table database stages are measured for the batch as a whole and
+    added to every record's timer.
+    """
+    job_ids = {job_id_from_key(record['invoice_data']['s3_key']) for record in records}
+
+    batch_timer = StageTimer()
+
+    def write_batch(cursor):
+        saved, failed, cache_entries = save_invoices(cursor, records, batch_timer)
+        with batch_timer.stage('db_duplicates'):
+            reused = resolve_duplicate_uploads(cursor, records, failed)
+            mark_extracted(cursor, {
+                job_id_from_key(records[idx]['invoice_data']['s3_key']) for idx in saved
+            })
+        # Committed together with the invoices, so a redelivery can never
+        # see one without the other
+        with batch_timer.stage('db_ledger'):
+            outcomes = [(idx, invoice_id, records[idx]['status']) for idx, invoice_id in saved.items()]
+            outcomes += [(idx, invoice_id, 'duplicate') for idx, invoice_id in reused.items()]
+            record_processed_results(cursor, [
+                (data['s3_bucket'], data['s3_key'], records[idx]['etag'] or '',
+                 _saved_result(invoice_id, data, status))
+                for idx, invoice_id, status in outcomes
+                for data in [records[idx]['invoice_data']]
+            ])
+        with batch_timer.stage('db_pdf_index'):
+            source_pdfs = lookup_source_pdfs(cursor, job_ids)
+        return saved, reused, failed, cache_entries, source_pdfs
+
+    # 3. PROCESS - Write the whole batch in one transaction
+    try:
+        with batch_timer.stage('db_transaction'):
+            saved, reused, failed, cache_entries, source_pdfs = db.run_in_transaction(write_batch)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        for record, position in zip(records, positions):
+            results[position] = _failure(record['invoice_data']['s3_key'], str(e))
+        return {}
+    finally:
+        for position in positions:
+            timers[position].merge(batch_timer)
+    committed_at = datetime.now(timezone.utc)
+    dimension_cache.remember(cache_entries)
+    db.log_stats()
+    dimension_cache.log_stats()
+
+    for idx, error in failed.items():
+        invoice_data = records[idx]['invoice_data']
+        print(f"✗ Invoice {invoice_data.get('invoice_number')} not saved: {error}")
+        results[positions[idx]] = _failure(invoice_data['s3_key'], error)
+
+    # 4. Post-commit side effects for the invoices that made it in. SNS
+    # publishes and PDF moves are independent, so they run concurrently.
+    side_effects = []
+    job_statuses = {}
+    job_outputs = {}
+    for idx, invoice_id in saved.items():
+        invoice_data = records[idx]['invoice_data']
+        status = records[idx]['status']
+        print(f"✓ Invoice {invoice_data.get('invoice_number')} saved (ID: {invoice_id})")
+
+        # Send SNS notification for high-value invoices
+        if invoice_total(invoice_data) > HIGH_VALUE_THRESHOLD:
+            side_effects.append((
+                '⚠ Failed to send SNS notification',
+                send_approval_notification,
+                (invoice_data, invoice_id, timers[positions[idx]]),
+                ('sns_publish', {
+                    'invoice_id': invoice_id,
+                    **{field: invoice_data.get(field) for field in NOTIFICATION_FIELDS}
+                })
+            ))
+
+        job_statuses.setdefault(job_id_from_key(invoice_data['s3_key']), []).append((status, positions[idx]))
+        job_outputs.setdefault(job_id_from_key(invoice_data['s3_key']), []).append(records[idx]['output_at'])
+
+        results[positions[idx]] = _saved_result(invoice_id, invoice_data, status)
+
+    # Re-uploads point at the invoice saved from the first upload; no second
+    # approval request, and the copy ends up in the failed bucket for review
+    for idx, invoice_id in reused.items():
+        invoice_data = records[idx]['invoice_data']
+        print(f"↺ Invoice {invoice_data.get('invoice_number')} is a re-upload of invoice ID {invoice_id}")
+        job_statuses.setdefault(job_id_from_key(invoice_data['s3_key']), []).append(('duplicate', positions[idx]))
+        job_outputs.setdefault(job_id_from_key(invoice_data['s3_key']), []).append(records[idx]['output_at'])
+        results[positions[idx]] = _saved_result(invoice_id, invoice_data, 'duplicate')
+
+    # Move each job's PDF once, even when it held several invoices. A job with
+    # a failed invoice keeps its PDF in the incoming bucket for the retry.
+    failed_jobs = {job_id_from_key(records[idx]['invoice_data']['s3_key']) for idx in failed}
+    job_status = {}
+    job_timers = {}
+    moved_at = {}
+
+    def move_pdf(job_id, source, status, timer):
+        if move_original_pdf(job_id, source, status, timer):
+            moved_at[job_id] = datetime.now(timezone.utc)
+
+    # Jobs missing from bedrock_jobs (e.g. submitted before the index existed)
+    # share one scan of the incoming bucket's tags
+    unresolved = set(job_statuses) - failed_jobs - source_pdfs.keys()
+    lookup_timer = StageTimer()
+    if unresolved:
+        print(f"{len(unresolved)} job(s) not in bedrock_jobs, scanning PDF tags")
+        try:
+            with lookup_timer.stage('pdf_lookup'):
+                source_pdfs.update(find_original_pdfs_by_tag(unresolved))
+        except Exception as e:
+            print(f"⚠ Could not scan PDF tags: {str(e)}")
+
+    for job_id, entries in job_statuses.items():
+        if job_id in failed_jobs:
+            print(f"⚠ Leaving PDF for job {job_id} in place, some of its invoices failed")
+            job_status[job_id] = 'failed'
+            continue
+        # Only a fully approved job goes to the processed bucket
+        status = next((status for status, _ in entries if status != 'approved'), 'approved')
+        job_status[job_id] = status
+        job_timers[job_id] = StageTimer()
+        if job_id in unresolved:
+            job_timers[job_id].merge(lookup_timer)
+        side_effects.append((
+            'Could not move PDF',
+            move_pdf,
+            (job_id, source_pdfs.get(job_id), status, job_timers[job_id]),
+            ('pdf_move', {'job_id': job_id, 'source': source_pdfs.get(job_id), 'status': status})
+        ))
+
+    _, deferred = run_side_effects(side_effects, context)
+    defer_actions(deferred)
+    for job_id, job_timer in job_timers.items():
+        for _, position in job_statuses[job_id]:
+            timers[position].merge(job_timer)
+
+    # Bedrock output -> DB commit -> PDF moved, per job
+    record_pipeline([
+        (
+            job_id,
+            max((output_at for output_at in job_outputs[job_id] if output_at), default=None),
+            committed_at,
+            status,
+            moved_at.get(job_id)
+        )
+        for job_id, status in job_status.items()
+    ])
+
+    return {positions[idx]: invoice_id for outcome in (saved, reused) for idx, invoice_id in outcome.items()}
+
+
+def summarize_results(results):
+    """
+    Collapse per-record results into the handler's return value.
+
+    A single-record event returns that record's result unchanged; batches get
+    every result plus the list of failures.
+    """
+    if len(results) == 1:
+        result = dict(results[0])
+        result.pop('key', None)
+        return result
+
+    failures = [result for result in results if result['statusCode'] != 200]
+    return {
+        'statusCode': 200 if not failures else 207,
+        'processed': len(results) - len(failures),
+        'failed': len(failures),
+        'results': results,
+        'failures': failures
+    }
+
+
+def lambda_handler(event, context):
+    """
+    Triggered when Bedrock outputs result.json
+    Extracts data, validates, and writes every record of the event to the
+    database in one transaction
+    """
+
+    try:
+        results = process_records(event.get('Records', []), context)
+        if not results:
+            return {'statusCode': 200, 'message': 'Skipped'}
+        return summarize_results(results)
+
     except Exception as e:
         print(f"Error: {str(e)}")
         return {
             'statusCode': 500,
             'error': str(e)
         }
+
+
+def s3_records_from_message(message):
+    """
+    Pull the S3 event records out of one SQS message body.
+
+    Handles S3 notifications delivered straight to the queue as well as ones
+    fanned out through SNS (the S3 event is then the SNS Message string).
+    """
+    body = json.loads(message['body'])
+    if body.get('Type') == 'Notification' and 'Message' in body:
+        body = json.loads(body['Message'])
+    # S3 sends an s3:TestEvent when the notification is first configured
+    if body.get('Event') == 's3:TestEvent':
+        return []
+    return body.get('Records', [])
+
+
+def sqs_handler(event, context):
+    """
+    Alternative entry point: consume Bedrock output notifications from SQS
+
+    Every S3 record of every message in the batch goes through the same path
+    as the S3-triggered handler - one warm connection, one transaction, bulk
+    writes. Messages whose records failed are returned as batchItemFailures
+    (the event source mapping needs ReportBatchItemFailures) so only they are
+    redelivered.
+    """
+    s3_records = []
+    owners = []
+    failed_message_ids = []
+
+    for message in event.get('Records', []):
+        try:
+            records = s3_records_from_message(message)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"✗ Unreadable message {message.get('messageId')}: {str(e)}")
+            failed_message_ids.append(message['messageId'])
+            continue
+        s3_records.extend(records)
+        owners.extend([message['messageId']] * len(records))
+
+    print(f"SQS batch: {len(event.get('Records', []))} message(s), {len(s3_records)} S3 record(s)")
+
+    try:
+        results = process_records(s3_records, context)
+    except Exception as e:
+        # Nothing is known to be saved - let the whole batch be redelivered
+        print(f"Error: {str(e)}")
+        raise
+
+    for message_id, result in zip(owners, results):
+        if result['statusCode'] != 200 and message_id not in failed_message_ids:
+            failed_message_ids.append(message_id)
+
+    if failed_message_ids:
+        print(f"⚠ {len(failed_message_ids)} message(s) will be redelivered")
+
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': message_id} for message_id in failed_message_ids
+        ]
+    }
+
+
+def custom_output_targets(job_metadata):
+    """
+    List (bucket, key) of every segment's custom_output in a job_metadata.json
+
+    Segments where no blueprint matched have no custom output and are returned
+    separately as (segment description, status) so they can be reported.
+    """
+    targets = []
+    unmatched = []
+    for asset in job_metadata.get('output_metadata', []):
+        for index, segment in enumerate(asset.get('segment_metadata', [])):
+            path = segment.get('custom_output_path')
+            if not path or segment.get('custom_output_status', 'MATCH') != 'MATCH':
+                unmatched.append((
+                    f"asset {asset.get('asset_id')} segment {index}",
+                    segment.get('custom_output_status')
+                ))
+                continue
+            bucket, _, key = path[len('s3://'):].partition('/')
+            targets.append((bucket, key))
+    return targets, unmatched
+
+
+def job_completion_handler(event, context):
+    """
+    Alternative entry point: one invocation per Bedrock job
+
+    Subscribe it to the output bucket with a `job_metadata.json` suffix
+    filter instead of triggering on every object Bedrock writes. It reads the
+    job's metadata, fetches every custom_output segment concurrently and
+    persists them together, so multi-invoice PDFs land in one transaction and
+    the original PDF is moved once.
+    """
+    try:
+        s3_records = []
+        skipped = []
+        for record in event.get('Records', []):
+            bucket = record['s3']['bucket']['name']
+            key = record['s3']['object']['key']
+            if not key.endswith('job_metadata.json'):
+                print(f"Skipping non-metadata file: {key}")
+                continue
+
+            job_metadata = fetch_bedrock_output(bucket, key)
+            job_id = job_metadata.get('job_id') or job_id_from_key(key)
+            if job_metadata.get('job_status') not in (None, 'PROCESSED'):
+                print(f"⚠ Job {job_id} finished with status {job_metadata.get('job_status')}")
+
+            targets, unmatched = custom_output_targets(job_metadata)
+            for segment, status in unmatched:
+                print(f"⚠ Job {job_id} {segment}: no custom output ({status})")
+                skipped.append({'statusCode': 500, 'error': f"No custom output for {segment} ({status})", 'key': key})
+            print(f"Job {job_id}: {len(targets)} custom output segment(s)")
+
+            s3_records.extend(
+                {
+                    's3': {'bucket': {'name': target_bucket}, 'object': {'key': target_key}},
+                    'eventTime': record.get('eventTime')
+                }
+                for target_bucket, target_key in targets
+            )
+
+        results = process_records(s3_records, context) + skipped
+        if not results:
+            return {'statusCode': 200, 'message': 'Skipped'}
+        return summarize_results(results)
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {
+            'statusCode': 500,
+            'error': str(e)
+        }
+
+
+def claim_deferred_actions(cursor, limit):
+    """
+    Lease up to limit deferred actions to this sweep.
+
+    SKIP LOCKED lets overlapping sweeps claim disjoint batches; a claimed
+    action becomes claimable again once its lease runs out, which is how a
+    failed or interrupted action gets retried.
+    """
+    cursor.execute("""
+        UPDATE deferred_actions
+        SET claimed_until = NOW() + %s * INTERVAL '1 second',
+            attempts = attempts + 1
+        WHERE action_id IN (
+            SELECT action_id
+            FROM deferred_actions
+            WHERE (claimed_until IS NULL OR claimed_until < NOW())
+              AND attempts < %s
+            ORDER BY action_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING action_id, action_type, payload
+    """, (DEFERRED_LEASE_SECONDS, DEFERRED_MAX_ATTEMPTS, limit))
+    return cursor.fetchall()
+
+
+def sweep_notifications(actions, context=None):
+    """
+    Send deferred approval requests as SNS digests.
+
+    Returns ({action_id: error}, action_ids of the digests not started
+    because the sweep ran low on time).
+    """
+    errors = {}
+    skipped = set()
+    for start in range(0, len(actions), DIGEST_MAX_INVOICES):
+        chunk = actions[start:start + DIGEST_MAX_INVOICES]
+        if not sweep_has_time_left(context):
+            skipped.update(action_id for action_id, _ in chunk)
+            continue
+        try:
+            if len(chunk) == 1:
+                payload = chunk[0][1]
+                send_approval_notification(payload, payload['invoice_id'])
+            else:
+                send_approval_digest([payload for _, payload in chunk])
+        except Exception as e:
+            print(f"⚠ Failed to send SNS notification: {str(e)}")
+            errors.update({action_id: str(e) for action_id, _ in chunk})
+    return errors, skipped
+
+
+def copy_pdf(source, dest_bucket):
+    incoming_bucket, original_pdf_key = source
+    aws_client('s3').copy_object(
+        CopySource={'Bucket': incoming_bucket, 'Key': original_pdf_key},
+        Bucket=dest_bucket,
+        Key=original_pdf_key
+    )
+
+
+def sweep_pdf_moves(actions, context=None):
+    """
+    Move the PDFs of deferred jobs in bulk.
+
+    Sources missing from the payload are resolved with one bedrock_jobs query
+    and, failing that, one tag scan for all of them. Copies run concurrently
+    and the deletes go out as delete_objects calls per incoming bucket. A copy
+    or delete batch that would start with too little time left is skipped;
+    copying again on the next sweep is harmless.
+
+    Returns ({action_id: error}, action_ids of the moves not finished because
+    the sweep ran low on time).
+    """
+    errors = {}
+    skipped = set()
+    sources = {
+        payload['job_id']: tuple(payload['source'])
+        for _, payload in actions if payload.get('source')
+    }
+    missing = {payload['job_id'] for _, payload in actions} - sources.keys()
+    if missing:
+        sources.update(db.run_in_transaction(lambda cursor: lookup_source_pdfs(cursor, missing)))
+        missing -= sources.keys()
+    if missing:
+        print(f"{len(missing)} deferred job(s) not in bedrock_jobs, scanning PDF tags")
+        sources.update(find_original_pdfs_by_tag(missing))
+
+    copies = []
+    for action_id, payload in actions:
+        source = sources.get(payload['job_id'])
+        if not source:
+            print(f"⚠ Could not find original PDF for job_id: {payload['job_id']}")
+            continue
+        dest_bucket = os.environ['PROCESSED_BUCKET' if payload['status'] == 'approved' else 'FAILED_BUCKET']
+        copies.append((action_id, source, dest_bucket))
+    if not copies:
+        return errors, skipped
+
+    def copy(source, dest_bucket):
+        # Checked when the copy starts, not when it is queued
+        if not sweep_has_time_left(context):
+            return False
+        copy_pdf(source, dest_bucket)
+        return True
+
+    copied = {}
+    with ThreadPoolExecutor(max_workers=min(SIDE_EFFECT_CONCURRENCY, len(copies))) as pool:
+        futures = {
+            pool.submit(copy, source, dest_bucket): (action_id, source, dest_bucket)
+            for action_id, source, dest_bucket in copies
+        }
+        for future in as_completed(futures):
+            action_id, source, dest_bucket = futures[future]
+            try:
+                if not future.result():
+                    skipped.add(action_id)
+                    continue
+                copied.setdefault(source, []).append((action_id, dest_bucket))
+            except Exception as e:
+                print(f"Could not move PDF: {str(e)}")
+                errors[action_id] = str(e)
+
+    keys_by_bucket = {}
+    for incoming_bucket, original_pdf_key in copied:
+        keys_by_bucket.setdefault(incoming_bucket, []).append(original_pdf_key)
+
+    for incoming_bucket, keys in keys_by_bucket.items():
+        for start in range(0, len(keys), S3_DELETE_BATCH):
+            chunk = keys[start:start + S3_DELETE_BATCH]
+            if not sweep_has_time_left(context):
+                skipped.update(
+                    action_id for key in chunk for action_id, _ in copied[(incoming_bucket, key)]
+                )
+                continue
+            try:
+                response = aws_client('s3').delete_objects(
+                    Bucket=incoming_bucket,
+                    Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True}
+                )
+                delete_errors = {error['Key']: error.get('Message') for error in response.get('Errors', [])}
+            except Exception as e:
+                delete_errors = {key: str(e) for key in chunk}
+
+            for key in chunk:
+                for action_id, dest_bucket in copied[(incoming_bucket, key)]:
+                    if key in delete_errors:
+                        print(f"Could not move PDF: {key}: {delete_errors[key]}")
+                        errors[action_id] = delete_errors[key]
+                    elif dest_bucket == os.environ['PROCESSED_BUCKET']:
+                        print(f"✓ Moved {key} to processed bucket")
+                    else:
+                        print(f"⚠ Moved {key} to failed bucket")
+
+    moved_at = datetime.now(timezone.utc)
+    job_ids = {action_id: payload['job_id'] for action_id, payload in actions}
+    record_pipeline([
+        (job_id, None, None, None, moved_at)
+        for job_id in {
+            job_ids[action_id]
+            for moves in copied.values()
+            for action_id, _ in moves
+            if action_id not in errors and action_id not in skipped
+        }
+    ])
+    return errors, skipped
+
+
+def finish_deferred_actions(cursor, done_ids, errors, skipped_ids=()):
+    """
+    Drop completed actions; failed ones keep their lease and are retried when
+    it expires. Skipped ones are released at once, without using an attempt.
+    """
+    if done_ids:
+        cursor.execute("DELETE FROM deferred_actions WHERE action_id = ANY(%s)", (done_ids,))
+    if skipped_ids:
+        cursor.execute("""
+            UPDATE deferred_actions
+            SET claimed_until = NULL, attempts = attempts - 1
+            WHERE action_id = ANY(%s)
+        """, (list(skipped_ids),))
+    if errors:
+        execute_values(cursor, """
+            UPDATE deferred_actions AS d
+            SET last_error = v.error
+            FROM (VALUES %s) AS v(action_id, error)
+            WHERE d.action_id = v.action_id
+        """, list(errors.items()), page_size=len(errors))
+
+
+def deferred_actions_handler(event, context):
+    """
+    Alternative entry point: sweeper for deferred post-commit side effects
+
+    Run it on a schedule (e.g. an EventBridge rule every 5 minutes). It claims
+    deferred_actions in batches, sends each batch's approval requests as SNS
+    digests and moves its PDFs in bulk, until the table is drained or less
+    than DEFERRED_ITEM_RESERVE_MS is left. Each digest and move checks the
+    time again before it starts; the ones not started go back to the table
+    for the next sweep. Actions that keep failing stop being retried after
+    DEFERRED_MAX_ATTEMPTS and stay in the table with their last_error.
+    """
+    processed = 0
+    failed = 0
+    released = 0
+    while sweep_has_time_left(context):
+        actions = db.run_in_transaction(
+            lambda cursor: claim_deferred_actions(cursor, DEFERRED_BATCH_SIZE)
+        )
+        if not actions:
+            break
+        print(f"Sweeping {len(actions)} deferred action(s)")
+
+        errors = {}
+        notifications = []
+        moves = []
+        for action_id, action_type, payload in actions:
+            if action_type == 'sns_publish':
+                notifications.append((action_id, payload))
+            elif action_type == 'pdf_move':
+                moves.append((action_id, payload))
+            else:
+                errors[action_id] = f"Unknown action_type: {action_type}"
+
+        notification_errors, skipped = sweep_notifications(notifications, context)
+        move_errors, skipped_moves = sweep_pdf_moves(moves, context)
+        errors.update(notification_errors)
+        errors.update(move_errors)
+        skipped |= skipped_moves
+
+        done_ids = [
+            action_id for action_id, _, _ in actions
+            if action_id not in errors and action_id not in skipped
+        ]
+        db.run_in_transaction(lambda cursor: finish_deferred_actions(cursor, done_ids, errors, skipped))
+        processed += len(done_ids)
+        failed += len(errors)
+        released += len(skipped)
+
+        if skipped or len(actions) < DEFERRED_BATCH_SIZE:
+            break
+
+    print(f"Deferred actions: {processed} done, {failed} failed, {released} left for the next sweep")
+    return {
+        'statusCode': 200 if not failed else 207,
+        'processed': processed,
+        'failed': failed,
+        'released': released
+    }
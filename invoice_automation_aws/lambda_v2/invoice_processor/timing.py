@@ -0,0 +1,55 @@
+"""
+Per-stage timing for the invoice processor
+
+StageTimer accumulates wall time per named stage. emit_metrics prints the
+timings as one CloudWatch Embedded Metric Format line, which CloudWatch Logs
+turns into metrics without any extra API calls.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'InvoiceAutomation')
+
+
+class StageTimer:
+    """Accumulates milliseconds per stage name"""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, ms):
+        self.stages[name] = round(self.stages.get(name, 0) + ms, 2)
+
+    def merge(self, other):
+        for name, ms in other.stages.items():
+            self.add(name, ms)
+
+
+def emit_metrics(function_name, stages, properties=None):
+    """Print stage timings (ms) as a CloudWatch EMF record"""
+    metrics = {f'{name}_ms': ms for name, ms in stages.items()}
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Function']],
+                'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in metrics],
+            }],
+        },
+        'Function': function_name,
+        **(properties or {}),
+        **metrics,
+    }
+    print(json.dumps(record, default=str))
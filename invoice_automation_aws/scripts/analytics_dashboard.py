@@ -1,192 +1,156 @@
+"""
+Generate dashboard.html from the invoice rollup tables
+
+The page is built from five sections. Each section has a watermark: a value
+that changes whenever the section's input does (a fingerprint of the rollup
+table it reads, and for the recent invoices the newest invoice_id and
+processed_at). The watermarks and the HTML of every section are cached beside
+the output in dashboard.html.cache/. A run where no watermark moved leaves
+dashboard.html as it is; otherwise only the sections whose watermark moved
+are queried and rendered again, the rest come from the cache.
+
+Rows are read from server-side cursors and written straight to buffered
+files as they arrive, so neither the rows nor the page are ever held in
+memory whole. How many rows each table shows is set with the DASHBOARD_*
+environment variables or the matching options.
+
+Usage:
+    python scripts/analytics_dashboard.py
+    python scripts/analytics_dashboard.py --output reports/dashboard.html --force
+    python scripts/analytics_dashboard.py --months 24 --top-vendors 20 --recent 100
+"""
+
+import argparse
+import json
 import psycopg2
 import os
+import shutil
 from dotenv import load_dotenv
 from datetime import datetime
-from collections import defaultdict
 
 load_dotenv('config/.env')
 
-def generate_dashboard():
-    """Generate a simple HTML analytics dashboard"""
-    
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        port=5432,
-        database='invoice_automation',
-        user='postgres',
-        password=os.getenv('DB_PASSWORD')
-    )
-    
-    cursor = conn.cursor()
-    
-    # Get summary statistics
-    cursor.execute("""
-        SELECT 
-            COUNT(*) as total_invoices,
-            SUM(total_amount) as total_amount,
-            AVG(total_amount) as avg_amount
-        FROM invoices
-    """)
-    total_invoices, total_amount, avg_amount = cursor.fetchone()
-    
-    # Get monthly trend data
-    cursor.execute("""
-        SELECT 
-            DATE_TRUNC('month', invoice_date) as month,
-            COUNT(*) as invoice_count,
-            SUM(total_amount) as total_amount
-        FROM invoices
-        WHERE invoice_date IS NOT NULL
-        GROUP BY DATE_TRUNC('month', invoice_date)
-        ORDER BY month DESC
-        LIMIT 12
-    """)
-    monthly_data = cursor.fetchall()
-    
-    # Get status breakdown
-    cursor.execute("""
-        SELECT status, COUNT(*) as count, SUM(total_amount) as amount
-        FROM invoices
-        GROUP BY status
-        ORDER BY count DESC
-    """)
-    status_data = cursor.fetchall()
-    
-    # Get top vendors
-    cursor.execute("""
-        SELECT v.vendor_name, COUNT(i.invoice_id) as invoice_count, SUM(i.total_amount) as total_amount
-        FROM vendors v
-        JOIN invoices i ON v.vendor_id = i.vendor_id
-        GROUP BY v.vendor_name
-        ORDER BY total_amount DESC
-        LIMIT 5
-    """)
-    vendor_data = cursor.fetchall()
-    
-    # Get recent invoices
-    cursor.execute("""
-        SELECT i.invoice_number, v.vendor_name, i.total_amount, i.status, i.processed_at
-        FROM invoices i
-        JOIN vendors v ON i.vendor_id = v.vendor_id
-        ORDER BY i.processed_at DESC
-        LIMIT 10
-    """)
-    recent_invoices = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    
-    # Generate HTML
-    html = f"""
+# Rows shown per table
+MONTHS_SHOWN = int(os.environ.get('DASHBOARD_MONTHS', '12'))
+TOP_VENDORS_SHOWN = int(os.environ.get('DASHBOARD_TOP_VENDORS', '5'))
+RECENT_INVOICES_SHOWN = int(os.environ.get('DASHBOARD_RECENT_INVOICES', '10'))
+
+# Rows fetched per round trip by the server-side cursors
+FETCH_ROWS = int(os.environ.get('DASHBOARD_FETCH_ROWS', '2000'))
+
+# Write buffer of the page and the cached sections
+WRITE_BUFFER_BYTES = 64 * 1024
+
+PAGE_HEAD = """
 <!DOCTYPE html>
 <html>
 <head>
     <title>Invoice Automation Analytics Dashboard</title>
     <style>
-        body {{
+        body {
             font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
             margin: 0;
             padding: 20px;
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             min-height: 100vh;
-        }}
-        .container {{
+        }
+        .container {
             max-width: 1200px;
             margin: 0 auto;
-        }}
-        h1 {{
+        }
+        h1 {
             color: white;
             text-align: center;
             margin-bottom: 30px;
             font-size: 2.5em;
             text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-        }}
-        .stats-grid {{
+        }
+        .stats-grid {
             display: grid;
             grid-template-columns: repeat(3, 1fr);
             gap: 20px;
             margin-bottom: 30px;
-        }}
-        .stat-card {{
+        }
+        .stat-card {
             background: white;
             padding: 25px;
             border-radius: 10px;
             box-shadow: 0 4px 6px rgba(0,0,0,0.1);
             transition: transform 0.3s;
-        }}
-        .stat-card:hover {{
+        }
+        .stat-card:hover {
             transform: translateY(-5px);
             box-shadow: 0 6px 12px rgba(0,0,0,0.15);
-        }}
-        .stat-value {{
+        }
+        .stat-value {
             font-size: 2.5em;
             font-weight: bold;
             color: #667eea;
             margin: 10px 0;
-        }}
-        .stat-label {{
+        }
+        .stat-label {
             color: #666;
             font-size: 0.9em;
             text-transform: uppercase;
             letter-spacing: 1px;
-        }}
-        .chart-container {{
+        }
+        .chart-container {
             background: white;
             padding: 30px;
             border-radius: 10px;
             box-shadow: 0 4px 6px rgba(0,0,0,0.1);
             margin-bottom: 20px;
-        }}
-        h2 {{
+        }
+        h2 {
             color: #333;
             border-bottom: 3px solid #667eea;
             padding-bottom: 10px;
             margin-top: 0;
-        }}
-        table {{
+        }
+        table {
             width: 100%;
             border-collapse: collapse;
             margin-top: 20px;
-        }}
-        th {{
+        }
+        th {
             background: #667eea;
             color: white;
             padding: 12px;
             text-align: left;
             font-weight: 600;
-        }}
-        td {{
+        }
+        td {
             padding: 12px;
             border-bottom: 1px solid #eee;
-        }}
-        tr:hover {{
+        }
+        tr:hover {
             background: #f5f5f5;
-        }}
-        .status-approved {{
+        }
+        .status-approved {
             background: #4caf50;
             color: white;
             padding: 5px 10px;
             border-radius: 5px;
             font-size: 0.85em;
             font-weight: bold;
-        }}
-        .status-pending {{
+        }
+        .status-pending {
             background: #ff9800;
             color: white;
             padding: 5px 10px;
             border-radius: 5px;
             font-size: 0.85em;
             font-weight: bold;
-        }}
-        .status-failed {{
+        }
+        .status-failed {
             background: #f44336;
             color: white;
             padding: 5px 10px;
             border-radius: 5px;
             font-size: 0.85em;
             font-weight: bold;
-        }}
-        .bar {{
+        }
+        .bar {
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             height: 30px;
             border-radius: 5px;
@@ -196,19 +160,115 @@ def generate_dashboard():
             padding-left: 10px;
             color: white;
             font-weight: bold;
-        }}
-        .footer {{
+        }
+        .footer {
             text-align: center;
             color: white;
             margin-top: 30px;
             font-size: 0.9em;
-        }}
+        }
     </style>
 </head>
 <body>
     <div class="container">
         <h1>📊 Invoice Automation Dashboard</h1>
         
+"""
+
+PAGE_FOOT = """
+        <div class="footer">
+            Generated on {generated} | Invoice Automation System
+        </div>
+    </div>
+</body>
+</html>
+    """
+
+# One query for the watermark of every section. The rollup views have a row
+# per month, status or vendor, so fingerprinting them whole is cheap, and is
+# exact where an updated_at could miss a transaction that committed late.
+# Groups that dropped to zero are left out, as backfill_rollups.py drops them.
+# The vendors fingerprint carries the names shown, so a rename counts too
+WATERMARKS = """
+    WITH rollups AS (
+        SELECT
+            (SELECT md5(COALESCE(string_agg(status || ':' || invoice_count || ':' || total_amount, ',' ORDER BY status), ''))
+             FROM invoice_status_totals_current WHERE invoice_count <> 0 OR total_amount <> 0) AS statuses,
+            (SELECT md5(COALESCE(string_agg(month || ':' || invoice_count || ':' || total_amount, ',' ORDER BY month), ''))
+             FROM invoice_monthly_totals_current WHERE invoice_count <> 0 OR total_amount <> 0) AS months,
+            (SELECT md5(COALESCE(string_agg(t.vendor_id || ':' || COALESCE(v.vendor_name, '') || ':' || t.invoice_count
+                                            || ':' || t.total_amount, ',' ORDER BY t.vendor_id), ''))
+             FROM invoice_vendor_totals_current t
+             LEFT JOIN vendors v ON v.vendor_id = t.vendor_id
+             WHERE t.invoice_count <> 0 OR t.total_amount <> 0) AS vendors,
+            (SELECT COALESCE(SUM(invoice_count) || ':' || SUM(total_amount), '')
+             FROM invoice_status_totals_current) AS totals,
+            (SELECT MAX(invoice_id) FROM invoices) AS max_invoice_id,
+            (SELECT MAX(processed_at) FROM invoices) AS max_processed_at
+    )
+    SELECT totals, months, statuses, vendors,
+           -- Approvals set processed_at; a delete shows in the status totals,
+           -- a vendor rename in the vendors fingerprint
+           COALESCE(max_invoice_id::text, '') || '/' || COALESCE(max_processed_at::text, '') || '/' || statuses
+               || '/' || vendors
+    FROM rollups
+"""
+
+SUMMARY_QUERY = """
+    SELECT 
+        SUM(invoice_count) as total_invoices,
+        SUM(total_amount) as total_amount,
+        SUM(total_amount) / NULLIF(SUM(invoice_count), 0) as avg_amount
+    FROM invoice_status_totals_current
+"""
+
+# Oldest month first, with the largest amount for the bar widths
+MONTHLY_QUERY = """
+    SELECT month, invoice_count, total_amount, MAX(total_amount) OVER () AS max_amount
+    FROM (
+        SELECT month, invoice_count, total_amount
+        FROM invoice_monthly_totals_current
+        WHERE invoice_count > 0
+        ORDER BY month DESC
+        LIMIT %(limit)s
+    ) AS shown
+    ORDER BY month
+"""
+
+STATUS_QUERY = """
+    SELECT status, invoice_count as count, total_amount as amount, MAX(invoice_count) OVER () AS max_count
+    FROM invoice_status_totals_current
+    WHERE invoice_count > 0
+    ORDER BY count DESC
+"""
+
+VENDORS_QUERY = """
+    SELECT v.vendor_name, t.invoice_count, t.total_amount
+    FROM invoice_vendor_totals_current t
+    JOIN vendors v ON v.vendor_id = t.vendor_id
+    WHERE t.invoice_count > 0
+    ORDER BY t.total_amount DESC
+    LIMIT %(limit)s
+"""
+
+# idx_invoices_processed_at
+RECENT_QUERY = """
+    SELECT i.invoice_number, v.vendor_name, i.total_amount, i.status, i.processed_at
+    FROM invoices i
+    JOIN vendors v ON i.vendor_id = v.vendor_id
+    ORDER BY i.processed_at DESC
+    LIMIT %(limit)s
+"""
+
+
+def status_class(status):
+    return f"status-{status.replace('_', '-')}" if status in ['approved', 'failed'] else "status-pending"
+
+
+def render_summary(out, rows):
+    total_invoices, total_amount, avg_amount = next(iter(rows), (None, None, None))
+    
+    out.write(f"""
         <div class="stats-grid">
             <div class="stat-card">
                 <div class="stat-label">Total Invoices</div>
@@ -223,19 +283,23 @@ def generate_dashboard():
                 <div class="stat-value">${avg_amount or 0:,.2f}</div>
             </div>
         </div>
-        
+    """)
+
+
+def render_monthly(out, rows):
+    out.write("""
         <div class="chart-container">
             <h2>Invoice Volume Over Time</h2>
             <div style="margin-top: 20px;">
-    """
+    """)
     
     # Generate monthly trend bars
-    if monthly_data:
-        max_amount = max([row[2] for row in monthly_data])
-        for month, count, amount in reversed(monthly_data):
-            month_str = month.strftime('%B %Y') if month else 'Unknown'
-            width = (amount / max_amount * 100) if max_amount > 0 else 0
-            html += f"""
+    empty = True
+    for month, count, amount, max_amount in rows:
+        empty = False
+        month_str = month.strftime('%B %Y') if month else 'Unknown'
+        width = (amount / max_amount * 100) if max_amount > 0 else 0
+        out.write(f"""
                 <div style="margin-bottom: 15px;">
                     <div style="display: flex; justify-content: space-between; margin-bottom: 5px;">
                         <span style="font-weight: 600;">{month_str}</span>
@@ -243,14 +307,18 @@ def generate_dashboard():
                     </div>
                     <div class="bar" style="width: {width}%;">${amount:,.0f}</div>
                 </div>
-            """
-    else:
-        html += "<p style='color: #999; text-align: center;'>No invoice data available</p>"
+            """)
+    if empty:
+        out.write("<p style='color: #999; text-align: center;'>No invoice data available</p>")
     
-    html += """
+    out.write("""
             </div>
         </div>
-        
+    """)
+
+
+def render_status(out, rows):
+    out.write("""
         <div class="chart-container">
             <h2>Invoice Status Breakdown</h2>
             <table>
@@ -260,26 +328,27 @@ def generate_dashboard():
                     <th>Total Amount</th>
                     <th>Distribution</th>
                 </tr>
-    """
-    
-    max_count = max([row[1] for row in status_data]) if status_data else 1
+    """)
     
-    for status, count, amount in status_data:
-        status_class = f"status-{status.replace('_', '-')}" if status in ['approved', 'failed'] else "status-pending"
+    for status, count, amount, max_count in rows:
         width = (count / max_count * 100) if max_count > 0 else 0
-        html += f"""
+        out.write(f"""
                 <tr>
-                    <td><span class="{status_class}">{status.upper()}</span></td>
+                    <td><span class="{status_class(status)}">{status.upper()}</span></td>
                     <td>{count}</td>
                     <td>${amount or 0:,.2f}</td>
                     <td><div class="bar" style="width: {width}%">{count}</div></td>
                 </tr>
-        """
+        """)
     
-    html += """
+    out.write("""
             </table>
         </div>
-        
+    """)
+
+
+def render_vendors(out, rows):
+    out.write("""
         <div class="chart-container">
             <h2>Top Vendors by Amount</h2>
             <table>
@@ -288,21 +357,25 @@ def generate_dashboard():
                     <th>Invoice Count</th>
                     <th>Total Amount</th>
                 </tr>
-    """
+    """)
     
-    for vendor_name, invoice_count, total in vendor_data:
-        html += f"""
+    for vendor_name, invoice_count, total in rows:
+        out.write(f"""
                 <tr>
                     <td>{vendor_name}</td>
                     <td>{invoice_count}</td>
                     <td>${total:,.2f}</td>
                 </tr>
-        """
+        """)
     
-    html += """
+    out.write("""
             </table>
         </div>
-        
+    """)
+
+
+def render_recent(out, rows):
+    out.write("""
         <div class="chart-container">
             <h2>Recent Invoices</h2>
             <table>
@@ -313,41 +386,145 @@ def generate_dashboard():
                     <th>Status</th>
                     <th>Processed</th>
                 </tr>
-    """
+    """)
     
-    for invoice_number, vendor_name, total_amt, status, processed_at in recent_invoices:
-        status_class = f"status-{status.replace('_', '-')}" if status in ['approved', 'failed'] else "status-pending"
-        html += f"""
+    for invoice_number, vendor_name, total_amt, status, processed_at in rows:
+        out.write(f"""
                 <tr>
                     <td>{invoice_number}</td>
                     <td>{vendor_name}</td>
                     <td>${total_amt:,.2f}</td>
-                    <td><span class="{status_class}">{status.upper()}</span></td>
+                    <td><span class="{status_class(status)}">{status.upper()}</span></td>
                     <td>{processed_at.strftime('%Y-%m-%d %H:%M') if processed_at else 'N/A'}</td>
                 </tr>
-        """
+        """)
     
-    html += f"""
+    out.write("""
             </table>
         </div>
-        
-        <div class="footer">
-            Generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | Invoice Automation System
-        </div>
-    </div>
-</body>
-</html>
-    """
+    """)
+
+
+# section -> (query, renderer), in page order
+SECTIONS = {
+    'summary': (SUMMARY_QUERY, render_summary),
+    'monthly': (MONTHLY_QUERY, render_monthly),
+    'status': (STATUS_QUERY, render_status),
+    'vendors': (VENDORS_QUERY, render_vendors),
+    'recent': (RECENT_QUERY, render_recent),
+}
+
+
+def stream_rows(conn, name, query, params=None):
+    """Rows of query from a server-side cursor, FETCH_ROWS per round trip"""
+    cursor = conn.cursor(name=f'dashboard_{name}')
+    cursor.itersize = FETCH_ROWS
+    try:
+        cursor.execute(query, params)
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+def load_watermarks(path):
+    """{section: watermark} from the last run, or {}"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def generate_dashboard(output_file='dashboard.html', force=False, months=MONTHS_SHOWN,
+                       top_vendors=TOP_VENDORS_SHOWN, recent=RECENT_INVOICES_SHOWN):
+    """Generate a simple HTML analytics dashboard"""
+    
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD')
+    )
+    
+    cursor = conn.cursor()
+    
+    # Aggregates come from the rollup views: the totals plus the deltas the
+    # invoices triggers appended since the last fold
+    # (scripts/create_missing_tables.py, scripts/backfill_rollups.py), so
+    # none of these scan invoices
+    cursor.execute("SELECT to_regclass('invoice_status_totals_current')")
+    if cursor.fetchone()[0] is None:
+        print("✗ Rollup views not found: run scripts/create_missing_tables.py "
+              "and scripts/backfill_rollups.py first")
+        cursor.close()
+        conn.close()
+        return None
+    
+    # Fold the pending deltas in their own short transaction, so the views
+    # stay small; the views are exact whether or not this ran
+    cursor.execute("SELECT fold_invoice_rollup_deltas()")
+    conn.commit()
+    
+    cache_dir = output_file + '.cache'
+    watermark_file = os.path.join(cache_dir, 'watermarks.json')
+    cached = {} if force or not os.path.exists(output_file) else load_watermarks(watermark_file)
+    
+    # A different page size is a different section
+    limits = {'monthly': months, 'vendors': top_vendors, 'recent': recent}
+    cursor.execute(WATERMARKS)
+    watermarks = {
+        section: f"{value}|{limits.get(section, '')}"
+        for section, value in zip(SECTIONS, cursor.fetchone())
+    }
+    cursor.close()
+    fragments = {section: os.path.join(cache_dir, f'{section}.html') for section in SECTIONS}
+    stale = [
+        section for section in SECTIONS
+        if cached.get(section) != watermarks[section] or not os.path.exists(fragments[section])
+    ]
+    
+    if not stale:
+        conn.close()
+        print(f"✓ Dashboard up to date, nothing changed since the last run: {output_file}")
+        return output_file
+    
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        for section in stale:
+            query, render = SECTIONS[section]
+            with open(fragments[section] + '.tmp', 'w', encoding='utf-8', buffering=WRITE_BUFFER_BYTES) as out:
+                render(out, stream_rows(conn, section, query, {'limit': limits.get(section)}))
+            os.replace(fragments[section] + '.tmp', fragments[section])
+            cached[section] = watermarks[section]
+    finally:
+        conn.close()
     
-    # Save to file
-    output_file = 'dashboard.html'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html)
+    # Save to file: the page is assembled from the section files, never in memory
+    with open(output_file + '.tmp', 'w', encoding='utf-8', buffering=WRITE_BUFFER_BYTES) as out:
+        out.write(PAGE_HEAD)
+        for section in SECTIONS:
+            with open(fragments[section], encoding='utf-8') as fragment:
+                shutil.copyfileobj(fragment, out)
+        out.write(PAGE_FOOT.format(generated=datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    os.replace(output_file + '.tmp', output_file)
+    # Written after the page, so a crash in between only costs a rebuild
+    with open(watermark_file, 'w', encoding='utf-8') as f:
+        json.dump(cached, f)
     
     print(f"✓ Dashboard generated: {output_file}")
+    print(f"  Sections regenerated: {', '.join(stale)}")
     print(f"  Open in browser to view analytics")
     
     return output_file
 
 if __name__ == '__main__':
-    generate_dashboard()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', default='dashboard.html', help='Where to write the page')
+    parser.add_argument('--force', action='store_true', help='Regenerate every section')
+    parser.add_argument('--months', type=int, default=MONTHS_SHOWN, help='Months in the volume chart')
+    parser.add_argument('--top-vendors', type=int, default=TOP_VENDORS_SHOWN, help='Vendors in the top vendors table')
+    parser.add_argument('--recent', type=int, default=RECENT_INVOICES_SHOWN, help='Invoices in the recent invoices table')
+    args = parser.parse_args()
+    generate_dashboard(args.output, force=args.force, months=args.months,
+                       top_vendors=args.top_vendors, recent=args.recent)
@@ -0,0 +1,131 @@
+"""
+Fill the dashboard rollup tables from the invoices table
+
+Run once after create_missing_tables.py has created invoice_monthly_totals,
+invoice_status_totals and invoice_vendor_totals; from then on the triggers on
+invoices append their changes to invoice_rollup_deltas. Writes to invoices
+are blocked while it runs (SHARE lock), and the pending deltas are dropped
+with the old totals, so no change is counted twice or missed. Running it
+again rebuilds the rollups from scratch.
+
+--fold only moves the pending deltas into the totals, as each dashboard run
+does. --check compares the rollups (deltas included) with a fresh aggregate
+of invoices instead, and changes nothing.
+
+Usage:
+    python scripts/backfill_rollups.py
+    python scripts/backfill_rollups.py --fold
+    python scripts/backfill_rollups.py --check
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv('config/.env')
+
+# rollup table -> (key column, expression over invoices, rows that have a key)
+ROLLUPS = {
+    'invoice_monthly_totals': ('month', "DATE_TRUNC('month', invoice_date)::date", 'invoice_date IS NOT NULL'),
+    'invoice_status_totals': ('status', 'status', 'status IS NOT NULL'),
+    'invoice_vendor_totals': ('vendor_id', 'vendor_id', 'vendor_id IS NOT NULL'),
+}
+
+
+def backfill(cursor):
+    cursor.execute("LOCK TABLE invoices IN SHARE MODE")
+    # Waits for a fold in progress; the deltas are all in the rebuilt totals
+    cursor.execute("LOCK TABLE invoice_rollup_deltas IN EXCLUSIVE MODE")
+    cursor.execute("DELETE FROM invoice_rollup_deltas")
+    print(f"✓ invoice_rollup_deltas: {cursor.rowcount} pending rows dropped")
+    for table, (key, expression, condition) in ROLLUPS.items():
+        start = time.perf_counter()
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"""
+            INSERT INTO {table} ({key}, invoice_count, total_amount, updated_at)
+            SELECT {expression}, COUNT(*), COALESCE(SUM(total_amount), 0), NOW()
+            FROM invoices
+            WHERE {condition}
+            GROUP BY 1
+        """)
+        print(f"✓ {table}: {cursor.rowcount} rows in {time.perf_counter() - start:.2f}s")
+
+
+def check(cursor):
+    """Number of rollup rows that differ from the aggregate of invoices"""
+    mismatches = 0
+    for table, (key, expression, condition) in ROLLUPS.items():
+        cursor.execute(f"""
+            WITH actual AS (
+                SELECT {expression} AS key, COUNT(*) AS invoice_count,
+                       COALESCE(SUM(total_amount), 0) AS total_amount
+                FROM invoices
+                WHERE {condition}
+                GROUP BY 1
+            ),
+            rollup AS (
+                SELECT {key} AS key, invoice_count, total_amount
+                FROM {table}_current
+                WHERE invoice_count <> 0 OR total_amount <> 0
+            )
+            SELECT COALESCE(a.key::text, r.key::text), a.invoice_count, r.invoice_count,
+                   a.total_amount, r.total_amount
+            FROM actual a
+            FULL JOIN rollup r ON r.key = a.key
+            WHERE a.invoice_count IS DISTINCT FROM r.invoice_count
+               OR a.total_amount IS DISTINCT FROM r.total_amount
+            ORDER BY 1
+        """)
+        rows = cursor.fetchall()
+        mismatches += len(rows)
+        print(f"{'✓' if not rows else '✗'} {table}: {len(rows)} mismatched rows")
+        for group, actual_count, rollup_count, actual_amount, rollup_amount in rows[:10]:
+            print(f"    {group}: count {actual_count} vs {rollup_count}, amount {actual_amount} vs {rollup_amount}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--fold', action='store_true', help='Only fold the pending deltas into the rollups')
+    parser.add_argument('--check', action='store_true', help='Compare the rollups with invoices, change nothing')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD')
+    )
+    cursor = conn.cursor()
+
+    try:
+        if args.check:
+            mismatches = check(cursor)
+            conn.rollback()
+            sys.exit(1 if mismatches else 0)
+        if args.fold:
+            start = time.perf_counter()
+            cursor.execute("SELECT fold_invoice_rollup_deltas()")
+            folded = cursor.fetchone()[0]
+            conn.commit()
+            print(f"✓ Folded {folded} deltas in {time.perf_counter() - start:.2f}s")
+            return
+        backfill(cursor)
+        conn.commit()
+        print("\n✓ Rollups backfilled")
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error: {str(e)}")
+        sys.exit(1)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
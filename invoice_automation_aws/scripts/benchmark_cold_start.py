@@ -0,0 +1,309 @@
+"""
+Cold-start benchmark for the three Lambda handlers
+
+Runs each handler in a fresh Python process, the way a new Lambda container
+starts, and reports:
+
+  import - importing lambda_function and whatever it imports (the init phase)
+  first  - the first invocation (boto3/psycopg2 if not imported yet, clients,
+           secret, connection, the work itself)
+  warm   - a second invocation in the same process
+
+and which of boto3 and psycopg2 the import alone loaded. AWS calls are
+answered in-process by a botocore before-send hook, so client construction
+and request/response handling are measured but there is no network. The hook
+is installed after the import, and the time boto3 takes to import at that
+point counts towards the first invocation, where the handler would have paid
+for it. The database is the Postgres in config/.env, as for the other
+benchmarks; the rows a run creates are removed at the end.
+
+With --baseline-dir the same runs are made against a second lambda_v2 (e.g. a
+worktree of an earlier commit) and both are shown with the difference.
+
+Usage:
+    python scripts/benchmark_cold_start.py --runs 5
+    python scripts/benchmark_cold_start.py --lambda-dir /path/to/other/checkout/lambda_v2
+    git worktree add /tmp/before HEAD~1
+    python scripts/benchmark_cold_start.py --baseline-dir /tmp/before/invoice_automation_aws/lambda_v2
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv('config/.env')
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_v2')
+HANDLERS = ('bedrock_trigger', 'invoice_processor', 'invoice_approval')
+# Reported when lambda_function's import alone loaded them
+HEAVY_MODULES = ('boto3', 'psycopg2')
+BENCH_VENDOR = '__cold_start_vendor__'
+BENCH_CUSTOMER = '__cold_start_customer__'
+
+HANDLER_ENV = {
+    'AWS_DEFAULT_REGION': os.getenv('AWS_REGION', 'us-east-1'),
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'INCOMING_BUCKET': 'bench-incoming',
+    'PROCESSED_BUCKET': 'bench-processed',
+    'FAILED_BUCKET': 'bench-failed',
+    'OUTPUT_BUCKET': 's3://bench-output',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:bench',
+    'BEDROCK_PROJECT_ARN': 'arn:aws:bedrock:us-east-1:000000000000:data-automation-project/bench',
+    'BEDROCK_PROFILE_ARN': 'arn:aws:bedrock:us-east-1:000000000000:data-automation-profile/bench',
+}
+
+
+def connect():
+    import psycopg2
+    return psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD')
+    )
+
+
+def result_json(invoice_number):
+    return json.dumps({
+        'matched_blueprint': {'name': 'invoice', 'confidence': 0.97},
+        'inference_result': {
+            'invoice_number': invoice_number,
+            'company_name': BENCH_VENDOR,
+            'bill_to': BENCH_CUSTOMER,
+            'invoice_date': '2026-01-15',
+            'due_date': '2026-02-14',
+            'total_amount': 1250.0,
+            'invoice_items': [
+                {'description': f'Item {n}', 'quantity': 1, 'unit_price': 125.0, 'amount': 125.0}
+                for n in range(10)
+            ]
+        }
+    }).encode('utf-8')
+
+
+def install_aws_responses(boto3, run_id):
+    """Answer every AWS call of the handlers locally"""
+    from botocore.awsrequest import AWSResponse
+
+    class RawBody(io.BytesIO):
+        def stream(self, **kwargs):
+            chunk = self.read()
+            while chunk:
+                yield chunk
+                chunk = self.read()
+
+    secret = json.dumps({
+        'host': os.getenv('DB_HOST'),
+        'port': 5432,
+        'dbname': 'invoice_automation',
+        'username': 'postgres',
+        'password': os.getenv('DB_PASSWORD') or ''
+    })
+    invocations = iter(range(1, 1000))
+
+    def respond(request, event_name, **kwargs):
+        operation = event_name.split('.')[-1]
+        status, headers, body = 200, {}, b''
+        if operation == 'GetSecretValue':
+            body = json.dumps({'SecretString': secret}).encode()
+        elif operation == 'InvokeDataAutomationAsync':
+            body = json.dumps({
+                'invocationArn': f'arn:aws:bedrock:us-east-1:000000000000:data-automation-invocation/'
+                                 f'cold-{run_id}-{next(invocations)}'
+            }).encode()
+        elif operation == 'GetObject':
+            # Keys look like cold-<run>-<n>/0/custom_output/0/result.json
+            job_id = request.url.split('/')[-5]
+            body = result_json(f"COLD-{job_id[len('cold-'):]}")
+            headers = {'Content-Length': str(len(body)), 'ETag': '"bench"'}
+        elif operation == 'CopyObject':
+            body = b'<CopyObjectResult><ETag>"bench"</ETag></CopyObjectResult>'
+        elif operation == 'DeleteObject':
+            status = 204
+        return AWSResponse(request.url, status, headers, RawBody(body))
+
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register('before-send', respond)
+
+
+def handler_event(handler, run_id, n, invoice_ids):
+    if handler == 'bedrock_trigger':
+        return {'Records': [{'s3': {
+            'bucket': {'name': HANDLER_ENV['INCOMING_BUCKET']},
+            'object': {'key': f'cold-{run_id}-{n}.pdf'}
+        }}]}
+    if handler == 'invoice_processor':
+        return {'Records': [{'s3': {
+            'bucket': {'name': 'bench-output'},
+            'object': {'key': f'cold-{run_id}-{n}/0/custom_output/0/result.json'}
+        }}]}
+    return {'queryStringParameters': {
+        # A decided invoice cannot be decided again, so each call gets its own
+        'invoice_id': invoice_ids.split(',')[n - 1],
+        'action': 'approve' if n == 1 else 'reject'
+    }}
+
+
+def child(handler, lambda_dir, run_id, invoice_ids):
+    """Import and invoke one handler twice, printing the timings as JSON"""
+    os.environ.update(HANDLER_ENV)
+    sys.path.insert(0, os.path.join(lambda_dir, handler))
+
+    start = time.perf_counter()
+    import lambda_function
+    timings = {
+        'import': time.perf_counter() - start,
+        'loaded': [module for module in HEAVY_MODULES if module in sys.modules],
+    }
+
+    # Nearly free if the import above already loaded boto3
+    start = time.perf_counter()
+    import boto3
+    install_aws_responses(boto3, run_id)
+    sdk = time.perf_counter() - start
+
+    for n, name in ((1, 'first'), (2, 'warm')):
+        event = handler_event(handler, run_id, n, invoice_ids)
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(event, None)
+        timings[name] = time.perf_counter() - start
+        if response.get('statusCode') != 200:
+            raise SystemExit(f"{handler} returned {response}")
+    timings['first'] += sdk
+
+    print('BENCH ' + json.dumps(timings))
+
+
+def run_child(handler, lambda_dir, run_id, invoice_ids=''):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', handler, lambda_dir, run_id, invoice_ids],
+        check=True, capture_output=True, text=True
+    ).stdout
+    line = [line for line in output.splitlines() if line.startswith('BENCH ')][-1]
+    return json.loads(line[len('BENCH '):])
+
+
+def cleanup(cursor):
+    cursor.execute("""
+        DELETE FROM bedrock_extraction_log
+        WHERE invoice_id IN (SELECT invoice_id FROM invoices WHERE invoice_number LIKE 'COLD-%')
+    """)
+    cursor.execute("""
+        SELECT 1 FROM information_schema.tables WHERE table_name = 'invoice_status_audit'
+    """)
+    if cursor.fetchone():
+        cursor.execute("""
+            DELETE FROM invoice_status_audit
+            WHERE invoice_id IN (SELECT invoice_id FROM invoices WHERE invoice_number LIKE 'COLD-%')
+        """)
+    cursor.execute("""
+        DELETE FROM invoice_line_items
+        WHERE invoice_id IN (SELECT invoice_id FROM invoices WHERE invoice_number LIKE 'COLD-%')
+    """)
+    cursor.execute("DELETE FROM invoices WHERE invoice_number LIKE 'COLD-%'")
+    cursor.execute("DELETE FROM vendors WHERE vendor_name = %s", (BENCH_VENDOR,))
+    cursor.execute("DELETE FROM customers WHERE customer_name = %s", (BENCH_CUSTOMER,))
+    cursor.execute("DELETE FROM bedrock_jobs WHERE job_id LIKE 'cold-%'")
+    cursor.execute("""
+        SELECT 1 FROM information_schema.tables WHERE table_name = 'processed_results'
+    """)
+    if cursor.fetchone():
+        cursor.execute("DELETE FROM processed_results WHERE object_key LIKE 'cold-%'")
+
+
+def benchmark(cursor, lambda_dir, runs, label):
+    """{handler: {'import', 'first', 'warm', 'cold': p50 in ms, 'loaded': modules}}"""
+    timings = {handler: [] for handler in HANDLERS}
+    for run in range(runs):
+        run_id = f'{os.getpid()}{label}{run}'
+        for n in (1, 2):
+            # Let the processor find the PDF of each job with the indexed lookup
+            cursor.execute("""
+                INSERT INTO bedrock_jobs (job_id, source_bucket, source_key)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (job_id) DO NOTHING
+            """, (f'cold-{run_id}-{n}', HANDLER_ENV['INCOMING_BUCKET'], f'cold-{run_id}-{n}.pdf'))
+
+        timings['bedrock_trigger'].append(run_child('bedrock_trigger', lambda_dir, run_id))
+        timings['invoice_processor'].append(run_child('invoice_processor', lambda_dir, run_id))
+        # The processor approved both invoices; put them back up for a decision
+        cursor.execute("""
+            UPDATE invoices SET status = 'pending_review'
+            WHERE invoice_number IN (%s, %s)
+            RETURNING invoice_number, invoice_id
+        """, (f'COLD-{run_id}-1', f'COLD-{run_id}-2'))
+        invoice_ids = ','.join(str(invoice_id) for _, invoice_id in sorted(cursor.fetchall()))
+        timings['invoice_approval'].append(run_child('invoice_approval', lambda_dir, run_id, invoice_ids))
+
+    results = {}
+    for handler in HANDLERS:
+        results[handler] = {
+            name: statistics.median(run[name] for run in timings[handler]) * 1000
+            for name in ('import', 'first', 'warm')
+        }
+        results[handler]['cold'] = statistics.median(run['import'] + run['first'] for run in timings[handler]) * 1000
+        results[handler]['loaded'] = timings[handler][-1]['loaded']
+    return results
+
+
+def print_results(title, results):
+    print(f"\n{title}\n")
+    print(f"{'Handler':<18} {'import p50':>11} {'first p50':>10} {'warm p50':>9} {'cold total p50':>15}  loaded by import")
+    print("-" * 86)
+    for handler in HANDLERS:
+        r = results[handler]
+        print(f"{handler:<18} {r['import']:>9.1f}ms {r['first']:>8.1f}ms "
+              f"{r['warm']:>7.1f}ms {r['cold']:>13.1f}ms  {', '.join(r['loaded']) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5, help='Fresh processes per handler')
+    parser.add_argument('--lambda-dir', default=LAMBDA_DIR, help='lambda_v2 directory to benchmark')
+    parser.add_argument('--baseline-dir', help='lambda_v2 directory to compare against (e.g. an earlier commit)')
+    parser.add_argument('--child', nargs=4, metavar=('HANDLER', 'LAMBDA_DIR', 'RUN_ID', 'INVOICE_IDS'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    lambda_dir = os.path.abspath(args.lambda_dir)
+    conn = connect()
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    try:
+        if args.baseline_dir:
+            baseline_dir = os.path.abspath(args.baseline_dir)
+            baseline = benchmark(cursor, baseline_dir, args.runs, 'b')
+            print_results(f"Baseline: {args.runs} cold starts per handler from {baseline_dir}", baseline)
+        results = benchmark(cursor, lambda_dir, args.runs, 'x')
+        print_results(f"{args.runs} cold starts per handler from {lambda_dir}", results)
+
+        if args.baseline_dir:
+            print(f"\n{'Change':<18} {'import':>11} {'cold total':>15}")
+            print("-" * 46)
+            for handler in HANDLERS:
+                before, after = baseline[handler], results[handler]
+                print(f"{handler:<18} {after['import'] - before['import']:>+9.1f}ms "
+                      f"{after['cold'] - before['cold']:>+13.1f}ms")
+        print("\nAWS calls are answered locally; database round trips go to the configured Postgres.")
+    finally:
+        cleanup(cursor)
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
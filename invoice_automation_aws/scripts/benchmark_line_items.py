@@ -0,0 +1,131 @@
+"""
+Micro-benchmark for invoice line-item writes
+
+Compares the old path (one INSERT per line item), a single multi-row INSERT
+and a COPY stream across invoice sizes, reporting round trips and wall time.
+Everything runs inside one transaction that is rolled back at the end, so the
+database is left untouched.
+
+Usage:
+    python scripts/benchmark_line_items.py --sizes 1,10,50,200,1000 --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+import psycopg2.extensions
+from dotenv import load_dotenv
+
+load_dotenv('config/.env')
+os.environ.setdefault('AWS_DEFAULT_REGION', os.getenv('AWS_REGION', 'us-east-1'))
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_v2', 'invoice_processor'))
+import lambda_function as processor  # noqa: E402
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor that counts statements sent to the server"""
+    round_trips = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.round_trips += 1
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        CountingCursor.round_trips += 1
+        return super().copy_expert(sql, file, size)
+
+
+def insert_row_by_row(cursor, rows):
+    for row in rows:
+        cursor.execute("""
+            INSERT INTO invoice_line_items (
+                invoice_id, description, quantity, unit_price, amount, line_number
+            )
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, row)
+
+
+def insert_multi_row(cursor, rows):
+    processor.LINE_ITEM_COPY_THRESHOLD = len(rows) + 1
+    processor.insert_line_items(cursor, rows)
+
+
+def insert_copy(cursor, rows):
+    processor.LINE_ITEM_COPY_THRESHOLD = 0
+    processor.insert_line_items(cursor, rows)
+
+
+STRATEGIES = [
+    ('row-by-row', insert_row_by_row),
+    ('multi-row', insert_multi_row),
+    ('copy', insert_copy),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1,10,50,200,1000',
+                        help='Comma separated line-item counts')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD'),
+        cursor_factory=CountingCursor
+    )
+    cursor = conn.cursor()
+
+    try:
+        # Parent rows for the line items' foreign key
+        cursor.execute("""
+            INSERT INTO vendors (vendor_name) VALUES ('__benchmark_vendor__')
+            RETURNING vendor_id
+        """)
+        vendor_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO invoices (invoice_number, vendor_id, invoice_date, total_amount)
+            VALUES ('__benchmark_invoice__', %s, CURRENT_DATE, 0)
+            RETURNING invoice_id
+        """, (vendor_id,))
+        invoice_id = cursor.fetchone()[0]
+
+        print(f"\n{'Items':>6}  {'Strategy':<11} {'Round trips':>11} {'Median ms':>10} {'ms/item':>8}")
+        print("-" * 52)
+
+        for size in sizes:
+            rows = [
+                (invoice_id, f"Benchmark item {n}\twith tab", 2, 12.5, 25.0, n)
+                for n in range(1, size + 1)
+            ]
+            for name, strategy in STRATEGIES:
+                timings = []
+                for _ in range(args.repeat):
+                    cursor.execute("SAVEPOINT bench")
+                    CountingCursor.round_trips = 0
+                    start = time.perf_counter()
+                    strategy(cursor, rows)
+                    timings.append((time.perf_counter() - start) * 1000)
+                    round_trips = CountingCursor.round_trips
+                    cursor.execute("ROLLBACK TO SAVEPOINT bench")
+
+                median = statistics.median(timings)
+                print(f"{size:>6}  {name:<11} {round_trips:>11} {median:>10.2f} {median / size:>8.3f}")
+            print()
+    finally:
+        conn.rollback()
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
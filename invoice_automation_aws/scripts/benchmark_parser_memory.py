@@ -0,0 +1,119 @@
+"""
+Peak memory benchmark: full json.loads vs streaming parse of a Bedrock result
+
+Generates a synthetic result.json with many invoice_items, then runs each
+parse path in a fresh Python process and reports its peak RSS. Both paths feed
+the line items through the processor's COPY stream, like a real insert does.
+
+  full   - Body.read().decode() + json.loads, the default for small results
+  stream - bedrock_stream.parse_bedrock_stream, used above STREAM_PARSE_THRESHOLD_BYTES
+
+Usage:
+    python scripts/benchmark_parser_memory.py --items 50000,200000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+PROCESSOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_v2', 'invoice_processor')
+
+
+def write_sample(path, item_count):
+    """Write a result.json shaped like Bedrock custom output"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"matched_blueprint": {"name": "invoice", "confidence": 0.97}, "inference_result": {')
+        f.write('"invoice_number": "INV-BENCH-0001", "company_name": "Benchmark Supplies Ltd", ')
+        f.write('"invoice_date": "2026-01-15", "total_amount": 125000.0, "invoice_items": [')
+        for n in range(item_count):
+            if n:
+                f.write(', ')
+            json.dump({
+                'description': f'Line item {n} - assorted office supplies and consumables',
+                'quantity': 3,
+                'unit_price': 19.99,
+                'amount': 59.97
+            }, f)
+        f.write(']}}')
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def child(mode, path):
+    """Parse path with one strategy and print baseline/peak RSS as JSON"""
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    sys.path.insert(0, PROCESSOR_DIR)
+    import bedrock_stream
+    import lambda_function as processor
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+
+    with open(path, 'rb') as body:
+        if mode == 'full':
+            document = json.loads(body.read().decode('utf-8'))
+        else:
+            document = bedrock_stream.parse_bedrock_stream(body)
+
+    invoice_data = processor.extract_invoice_data(document, 'bench', 'bench/result.json')
+    rows = (
+        (1, item.get('description'), item.get('quantity'), item.get('unit_price'), item.get('amount'), n)
+        for n, item in enumerate(invoice_data['line_items'], 1)
+    )
+    stream = processor._CopyStream(rows)
+    copied = 0
+    while True:
+        chunk = stream.read(8192)
+        if not chunk:
+            break
+        copied += len(chunk)
+
+    print(json.dumps({
+        'baseline_mb': baseline,
+        'peak_mb': peak_rss_mb(),
+        'seconds': time.perf_counter() - start,
+        'items': len(invoice_data['line_items']),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--items', default='50000,200000', help='Comma separated invoice_items counts')
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    print(f"\n{'Items':>8} {'File MB':>8}  {'Mode':<7} {'Peak RSS MB':>11} {'Over baseline':>14} {'Seconds':>8}")
+    print("-" * 63)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for item_count in [int(n) for n in args.items.split(',')]:
+            path = os.path.join(tmp, f'result_{item_count}.json')
+            write_sample(path, item_count)
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+
+            for mode in ('full', 'stream'):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--child', mode, path],
+                    check=True, capture_output=True, text=True
+                ).stdout.strip().splitlines()[-1]
+                stats = json.loads(output)
+                print(f"{item_count:>8} {size_mb:>8.1f}  {mode:<7} {stats['peak_mb']:>11.1f} "
+                      f"{stats['peak_mb'] - stats['baseline_mb']:>14.1f} {stats['seconds']:>8.2f}")
+            print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Benchmark: dashboard analytics in Postgres vs on a columnar snapshot
+
+Runs the same metrics two ways and reports the median time of each:
+
+  sql      - aggregate queries over invoices / invoice_line_items on Postgres
+  snapshot - snapshot_analytics.py on the columns written by export_snapshot.py
+             (export and load times reported separately)
+
+and checks that both ways give the same numbers. --synthetic N first adds N
+invoices (with line items, over --vendors vendors) so there is something to
+measure. Everything runs inside one transaction that is rolled back at the
+end, so the database is left untouched; the synthetic invoices do hold locks
+on the rollup rows until then, so point it at a development database.
+
+Needs numpy.
+
+Usage:
+    python scripts/benchmark_snapshot_analytics.py --synthetic 1000000 --repeat 3
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+import export_snapshot
+import snapshot_analytics as analytics
+
+load_dotenv('config/.env')
+
+SYNTHETIC_PREFIX = 'BENCH-'
+
+SQL_METRICS = {
+    'summary': """
+        SELECT COUNT(*), SUM(total_amount), AVG(total_amount)
+        FROM invoices
+    """,
+    'monthly + growth': """
+        SELECT month, invoice_count, total_amount,
+               total_amount / NULLIF(LAG(total_amount) OVER (ORDER BY month), 0) - 1 AS growth
+        FROM (
+            SELECT DATE_TRUNC('month', invoice_date) AS month, COUNT(*) AS invoice_count,
+                   SUM(total_amount) AS total_amount
+            FROM invoices
+            WHERE invoice_date IS NOT NULL
+            GROUP BY 1
+        ) AS months
+        ORDER BY month DESC
+        LIMIT 12
+    """,
+    'status': """
+        SELECT status, COUNT(*), SUM(total_amount)
+        FROM invoices
+        WHERE status IS NOT NULL
+        GROUP BY status
+        ORDER BY 2 DESC
+    """,
+    'top vendors': """
+        SELECT v.vendor_name, COUNT(i.invoice_id), SUM(i.total_amount)
+        FROM vendors v
+        JOIN invoices i ON v.vendor_id = i.vendor_id
+        GROUP BY v.vendor_name
+        ORDER BY 3 DESC
+        LIMIT 5
+    """,
+    'vendor percentiles': """
+        SELECT vendor_id,
+               percentile_disc(ARRAY[0.5, 0.9, 0.99]) WITHIN GROUP (ORDER BY total_amount)
+        FROM invoices
+        WHERE vendor_id IS NOT NULL
+        GROUP BY vendor_id
+    """,
+    'recent': """
+        SELECT i.invoice_id, v.vendor_name, i.total_amount, i.status, i.processed_at
+        FROM invoices i
+        LEFT JOIN vendors v ON i.vendor_id = v.vendor_id
+        ORDER BY i.processed_at DESC
+        LIMIT 10
+    """,
+    'line item checks': """
+        SELECT COUNT(*) FILTER (WHERE items.invoice_id IS NOT NULL AND items.amount <> i.total_amount),
+               AVG(items.line_items)
+        FROM invoices i
+        LEFT JOIN (
+            SELECT invoice_id, COUNT(*) AS line_items, SUM(amount) AS amount
+            FROM invoice_line_items
+            GROUP BY invoice_id
+        ) AS items ON items.invoice_id = i.invoice_id
+    """,
+}
+
+SNAPSHOT_METRICS = {
+    'summary': analytics.summary,
+    'monthly + growth': analytics.monthly,
+    'status': analytics.status_breakdown,
+    'top vendors': analytics.top_vendors,
+    'vendor percentiles': analytics.vendor_spend_percentiles,
+    'recent': analytics.recent,
+    'line item checks': analytics.line_item_checks,
+}
+
+
+def add_synthetic(conn, invoices, vendors):
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO vendors (vendor_name)
+        SELECT %s || 'VENDOR-' || n FROM generate_series(1, %s) AS n
+        ON CONFLICT (vendor_name) DO NOTHING
+    """, (SYNTHETIC_PREFIX, vendors))
+    # Amounts skewed per vendor, so the percentiles differ between vendors
+    cursor.execute("""
+        INSERT INTO invoices (invoice_number, vendor_id, invoice_date, total_amount, status, processed_at)
+        SELECT %(prefix)s || n,
+               v.vendor_id,
+               DATE '2023-01-01' + (n %% 1000),
+               ROUND((50 + (hashint4(n) & 65535) * (1 + v.vendor_id %% 7) / 10.0)::numeric, 2),
+               (ARRAY['approved', 'approved', 'approved', 'pending_review', 'rejected', 'failed'])[1 + n %% 6],
+               TIMESTAMP '2023-01-01' + n * INTERVAL '1 minute'
+        FROM generate_series(1, %(invoices)s) AS n
+        JOIN LATERAL (
+            SELECT vendor_id FROM vendors WHERE vendor_name = %(prefix)s || 'VENDOR-' || (1 + n %% %(vendors)s)
+        ) AS v ON TRUE
+    """, {'prefix': SYNTHETIC_PREFIX, 'invoices': invoices, 'vendors': vendors})
+    # Three line items per invoice that add up to its total
+    cursor.execute("""
+        INSERT INTO invoice_line_items (invoice_id, description, quantity, unit_price, amount)
+        SELECT i.invoice_id, 'Item ' || k, 1, share, share
+        FROM invoices i
+        CROSS JOIN generate_series(1, 3) AS k
+        CROSS JOIN LATERAL (
+            SELECT CASE WHEN k < 3 THEN ROUND(i.total_amount / 3, 2)
+                        ELSE i.total_amount - 2 * ROUND(i.total_amount / 3, 2) END AS share
+        ) AS s
+        WHERE i.invoice_number LIKE %s
+    """, (SYNTHETIC_PREFIX + '%',))
+    # Planner statistics for the uncommitted rows too
+    cursor.execute("ANALYZE invoices")
+    cursor.execute("ANALYZE invoice_line_items")
+    cursor.close()
+
+
+def timed(function, repeat):
+    """(median milliseconds, last result)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), result
+
+
+def same_results(sql, snapshot):
+    """Whether the two paths agree on the metrics both compute the same way"""
+    count, total, _ = sql['summary'][0]
+    checks = [
+        ('summary', (count, round(float(total or 0), 2)) == snapshot['summary'][:2]),
+        ('status', [(s, c, round(float(a), 2)) for s, c, a in sql['status']]
+         == [(s, c, round(a, 2)) for s, c, a in snapshot['status']]),
+        ('top vendors', [(c, round(float(a), 2)) for _, c, a in sql['top vendors']]
+         == [(c, round(a, 2)) for _, _, c, a in snapshot['top vendors']]),
+        ('vendor percentiles', {v: [float(p) for p in ps] for v, ps in sql['vendor percentiles']}
+         == snapshot['vendor percentiles']),
+        ('monthly totals', sorted((c, round(float(a), 2)) for _, c, a, _ in sql['monthly + growth'])
+         == sorted((c, round(a, 2)) for _, c, a, _ in snapshot['monthly + growth'])),
+    ]
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--synthetic', type=int, default=0, help='Invoices to add for the run (rolled back after)')
+    parser.add_argument('--vendors', type=int, default=200, help='Vendors of the synthetic invoices')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--snapshot', default='snapshot_benchmark', help='Where to write the snapshot (deleted after)')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD')
+    )
+
+    try:
+        if args.synthetic:
+            start = time.perf_counter()
+            add_synthetic(conn, args.synthetic, args.vendors)
+            print(f"Added {args.synthetic:,} synthetic invoices in {time.perf_counter() - start:.1f}s")
+
+        cursor = conn.cursor()
+        sql_times, sql_results = {}, {}
+        for metric, query in SQL_METRICS.items():
+            def run(query=query):
+                cursor.execute(query)
+                return cursor.fetchall()
+            sql_times[metric], sql_results[metric] = timed(run, args.repeat)
+
+        start = time.perf_counter()
+        export_stats = export_snapshot.write_snapshot(conn, args.snapshot)
+        export_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        snapshot = analytics.load_snapshot(args.snapshot)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        snapshot_times, snapshot_results = {}, {}
+        for metric, function in SNAPSHOT_METRICS.items():
+            snapshot_times[metric], snapshot_results[metric] = timed(lambda: function(snapshot), args.repeat)
+
+        invoices = export_stats['invoices'][0]
+        size = sum(size for _, size, _ in export_stats.values())
+        print(f"\nSnapshot: {invoices:,} invoices, {size / 1024 / 1024:,.1f} MB, "
+              f"exported in {export_ms:,.0f}ms, mapped in {load_ms:,.1f}ms")
+        print(f"\n{'Metric':<20} {'SQL ms':>10} {'Snapshot ms':>12} {'Speedup':>8}")
+        print("-" * 53)
+        for metric in SQL_METRICS:
+            sql_ms, snapshot_ms = sql_times[metric], snapshot_times[metric]
+            print(f"{metric:<20} {sql_ms:>10.1f} {snapshot_ms:>12.1f} "
+                  f"{sql_ms / snapshot_ms if snapshot_ms else 0:>7.1f}x")
+        print(f"{'all metrics':<20} {sum(sql_times.values()):>10.1f} {sum(snapshot_times.values()):>12.1f}")
+
+        print()
+        ok = True
+        for check, passed in same_results(sql_results, snapshot_results):
+            ok = ok and passed
+            print(f"{'✓' if passed else '✗'} Same {check} both ways")
+    finally:
+        conn.rollback()
+        shutil.rmtree(args.snapshot, ignore_errors=True)
+        conn.close()
+
+    print(f"\n{'✓ Results match' if ok else '✗ Results differ'}")
+
+
+if __name__ == '__main__':
+    main()
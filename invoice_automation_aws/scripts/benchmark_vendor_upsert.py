@@ -0,0 +1,148 @@
+"""
+Concurrency benchmark for the vendor upsert
+
+Reproduces a burst of invoices from one vendor: N workers, each with its own
+connection, repeatedly upsert the same unchanged vendor and then hold the
+transaction open for a while, like the rest of the invoice insert does.
+
+  legacy  - INSERT ... ON CONFLICT (vendor_name) DO UPDATE, the old path. Every
+            transaction locks the vendor row until commit, so workers queue.
+  current - the processor's upsert_vendors: an indexed read, writing only
+            when attributes changed.
+
+Reports time spent waiting in the upsert statement, throughput and how many
+new vendor tuple versions each mode wrote. Point config/.env at a local
+Postgres; the benchmark vendor row is removed at the end.
+
+Usage:
+    python scripts/benchmark_vendor_upsert.py --workers 8 --invoices 20 --hold-ms 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv('config/.env')
+os.environ.setdefault('AWS_DEFAULT_REGION', os.getenv('AWS_REGION', 'us-east-1'))
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_v2', 'invoice_processor'))
+import lambda_function as processor  # noqa: E402
+
+VENDOR_ROW = (
+    '__benchmark_vendor__',
+    '1 Benchmark Way',
+    '555-0100',
+    None,
+    'Net 30',
+    True
+)
+
+
+def connect():
+    return psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD')
+    )
+
+
+def legacy_upsert(cursor):
+    cursor.execute("""
+        INSERT INTO vendors (vendor_name, vendor_address, vendor_phone, vendor_email, payment_terms, is_approved)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (vendor_name) DO UPDATE SET
+            vendor_address = EXCLUDED.vendor_address,
+            vendor_phone = EXCLUDED.vendor_phone
+        RETURNING vendor_id
+    """, VENDOR_ROW)
+    cursor.fetchone()
+
+
+def current_upsert(cursor):
+    processor.upsert_vendors(cursor, [VENDOR_ROW])
+
+
+def vendor_updates(cursor):
+    cursor.execute("""
+        SELECT n_tup_upd FROM pg_stat_user_tables WHERE relname = 'vendors'
+    """)
+    return cursor.fetchone()[0]
+
+
+def run(mode, upsert, workers, invoices, hold_ms):
+    waits = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(workers)
+
+    def worker():
+        conn = connect()
+        cursor = conn.cursor()
+        barrier.wait()
+        for _ in range(invoices):
+            start = time.perf_counter()
+            upsert(cursor)
+            waited = (time.perf_counter() - start) * 1000
+            # Rest of the invoice transaction
+            cursor.execute("SELECT pg_sleep(%s)", (hold_ms / 1000,))
+            conn.commit()
+            with lock:
+                waits.append(waited)
+        cursor.close()
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    waits.sort()
+    p95 = waits[int(len(waits) * 0.95) - 1] if len(waits) > 1 else waits[0]
+    print(f"{mode:<8} {elapsed:>8.2f}s {len(waits) / elapsed:>10.1f}/s "
+          f"{statistics.median(waits):>10.2f} {p95:>10.2f} {max(waits):>10.2f}", end='')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--invoices', type=int, default=20, help='Invoices per worker')
+    parser.add_argument('--hold-ms', type=float, default=20,
+                        help='Time each transaction stays open after the upsert')
+    args = parser.parse_args()
+
+    conn = connect()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    legacy_upsert(cursor)
+
+    print(f"\n{args.workers} workers x {args.invoices} invoices, {args.hold_ms:g} ms held per transaction\n")
+    print(f"{'Mode':<8} {'Wall':>9} {'Throughput':>11} {'p50 wait':>10} {'p95 wait':>10} {'max wait':>10} {'tuples written':>15}")
+    print("-" * 79)
+
+    try:
+        for mode, upsert in (('legacy', legacy_upsert), ('current', current_upsert)):
+            before = vendor_updates(cursor)
+            run(mode, upsert, args.workers, args.invoices, args.hold_ms)
+            # Table statistics are reported asynchronously
+            time.sleep(1)
+            cursor.execute("SELECT pg_stat_clear_snapshot()")
+            print(f" {vendor_updates(cursor) - before:>15}")
+        print("\nWaits are in ms and measure time spent in the upsert statement (row-lock queueing).")
+    finally:
+        cursor.execute("DELETE FROM vendors WHERE vendor_name = %s", (VENDOR_ROW[0],))
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Concurrent approval decisions against a real Postgres
+
+Creates --invoices test invoices in pending_review, then for each of them
+starts --approvers threads at the same moment, alternately approving and
+rejecting, each on its own connection. Two ways of deciding are compared:
+
+  naive       - read the invoice, then update it unconditionally: the old
+                invoice_approval behavior
+  conditional - invoice_approval's apply_action: one UPDATE that only applies
+                to a pending invoice, sets approved_at and writes the audit
+                row in the same statement
+
+Every invoice must be decided exactly once: one approver told it worked,
+the others told it was already decided, one invoice_status_audit row, and
+approved_at set only if it ended up approved. The test invoices are deleted
+afterwards.
+
+Needs the tables from create_missing_tables.py and DB_HOST / DB_PASSWORD in
+config/.env; no AWS account needed.
+
+Usage:
+    python scripts/check_approval_concurrency.py --invoices 50 --approvers 4
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_v2', 'invoice_approval'))
+import lambda_function as approval  # noqa: E402
+
+load_dotenv('config/.env')
+
+TEST_VENDOR = 'CONCURRENCY CHECK VENDOR'
+TEST_PREFIX = 'CONC-CHECK-'
+
+
+def connect():
+    return psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD')
+    )
+
+
+def naive_decision(cursor, invoice_id, new_status, think_seconds):
+    """Read, then update unconditionally; True if the approver is told it worked"""
+    cursor.execute("SELECT status FROM invoices WHERE invoice_id = %s", (invoice_id,))
+    if not cursor.fetchone():
+        return False
+    # The approver's request is still in flight when the other one reads
+    time.sleep(think_seconds)
+    cursor.execute("""
+        UPDATE invoices
+        SET status = %s, processed_at = %s
+        WHERE invoice_id = %s
+    """, (new_status, datetime.now(), invoice_id))
+    return True
+
+
+def conditional_decision(cursor, invoice_id, new_status, think_seconds):
+    changed, _ = approval.apply_action(cursor, new_status, [invoice_id])
+    return bool(changed)
+
+
+def create_invoices(conn, count):
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO vendors (vendor_name) VALUES (%s)
+        ON CONFLICT (vendor_name) DO UPDATE SET vendor_name = EXCLUDED.vendor_name
+        RETURNING vendor_id
+    """, (TEST_VENDOR,))
+    vendor_id = cursor.fetchone()[0]
+    cursor.execute("""
+        INSERT INTO invoices (invoice_number, vendor_id, invoice_date, total_amount, status)
+        SELECT %s || n, %s, CURRENT_DATE, 60000 + n, 'pending_review'
+        FROM generate_series(1, %s) AS n
+        RETURNING invoice_id
+    """, (TEST_PREFIX, vendor_id, count))
+    invoice_ids = sorted(row[0] for row in cursor.fetchall())
+    conn.commit()
+    return invoice_ids
+
+
+def delete_invoices(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        DELETE FROM invoice_status_audit
+        WHERE invoice_id IN (SELECT invoice_id FROM invoices WHERE invoice_number LIKE %s)
+    """, (TEST_PREFIX + '%',))
+    cursor.execute("DELETE FROM invoices WHERE invoice_number LIKE %s", (TEST_PREFIX + '%',))
+    cursor.execute("DELETE FROM vendors WHERE vendor_name = %s", (TEST_VENDOR,))
+    conn.commit()
+
+
+def run(mode, decide, args):
+    """Race the approvers on fresh invoices; returns the number of invoices decided more than once"""
+    admin = connect()
+    delete_invoices(admin)
+    invoice_ids = create_invoices(admin, args.invoices)
+
+    connections = [connect() for _ in range(args.approvers)]
+    successes = {invoice_id: 0 for invoice_id in invoice_ids}
+    lock = threading.Lock()
+
+    def approver(index, invoice_id, barrier):
+        conn = connections[index]
+        new_status = 'approved' if index % 2 == 0 else 'rejected'
+        barrier.wait()
+        try:
+            decided = decide(conn.cursor(), invoice_id, new_status, args.think_ms / 1000)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if decided:
+            with lock:
+                successes[invoice_id] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.approvers) as pool:
+        for invoice_id in invoice_ids:
+            barrier = threading.Barrier(args.approvers)
+            futures = [pool.submit(approver, index, invoice_id, barrier) for index in range(args.approvers)]
+            for future in futures:
+                future.result()
+    elapsed = time.perf_counter() - start
+
+    cursor = admin.cursor()
+    cursor.execute("""
+        SELECT i.invoice_id, i.status, i.approved_at IS NOT NULL,
+               (SELECT COUNT(*) FROM invoice_status_audit a WHERE a.invoice_id = i.invoice_id)
+        FROM invoices i
+        WHERE i.invoice_id = ANY(%s)
+    """, (invoice_ids,))
+    rows = cursor.fetchall()
+
+    double = sum(1 for count in successes.values() if count > 1)
+    undecided = sum(1 for count in successes.values() if count == 0)
+    audited = sum(1 for _, _, _, audit_rows in rows if audit_rows == 1)
+    approved_at_ok = sum(1 for _, status, has_approved_at, _ in rows if has_approved_at == (status == 'approved'))
+    final = {}
+    for _, status, _, _ in rows:
+        final[status] = final.get(status, 0) + 1
+
+    print(f"\n{mode}: {len(invoice_ids)} invoices x {args.approvers} approvers in {elapsed:.2f}s")
+    print(f"  Final statuses:              {final}")
+    print(f"  Decided more than once:      {double}")
+    print(f"  Not decided at all:          {undecided}")
+    print(f"  Exactly one audit row:       {audited}")
+    print(f"  approved_at matches status:  {approved_at_ok}")
+
+    delete_invoices(admin)
+    for conn in connections:
+        conn.close()
+    admin.close()
+
+    ok = double == 0 and undecided == 0 and audited == len(rows) and approved_at_ok == len(rows)
+    return ok, double
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--invoices', type=int, default=50, help='Invoices to decide')
+    parser.add_argument('--approvers', type=int, default=4, help='Concurrent approvers per invoice')
+    parser.add_argument('--think-ms', type=float, default=5, help='Naive mode: pause between read and update')
+    args = parser.parse_args()
+
+    _, naive_double = run('naive', naive_decision, args)
+    ok, _ = run('conditional', conditional_decision, args)
+
+    print(f"\nNaive read-then-update decided {naive_double} of {args.invoices} invoices more than once")
+    print('✓ Approval concurrency check passed' if ok else '✗ Approval concurrency check failed')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Concurrent PDF splitting against a real Postgres
+
+Runs bedrock_trigger's split_large_pdfs on a batch of long statements (built
+from sample_invoices/ as in check_pdf_splitting.py), mixed with short PDFs,
+a missing one and a corrupt one, with --threads PDFs split at once. S3 is an
+in-memory stand-in; the tracking rows go to the database in config/.env
+through the function's own db.py.
+
+Every split document must have its split_documents, document_chunks,
+bedrock_jobs, document_hashes and pending_submissions rows, every uploaded
+chunk must be tracked, and the short, missing and corrupt PDFs must be left
+whole. Then the same batch is split with one PDF whose row the database
+rejects: none of the batch may be recorded as split and none of its chunks
+may be left in S3. The rows written are deleted afterwards.
+
+Needs pypdf, the tables from create_missing_tables.py and DB_HOST /
+DB_PASSWORD in config/.env; no AWS account needed.
+
+Usage:
+    python scripts/check_concurrent_splits.py --documents 16 --threads 8
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_v2')
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'bedrock_trigger'))
+import db  # noqa: E402
+import lambda_function as trigger  # noqa: E402
+from check_pdf_splitting import SAMPLE_DIR, build_statement  # noqa: E402
+
+load_dotenv('config/.env')
+
+TEST_BUCKET = 'split-check-incoming'
+
+
+class StubS3:
+    """get_object / put_object / delete_objects over a dict, safe across threads"""
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+        self._lock = threading.Lock()
+
+    def get_object(self, Bucket, Key):
+        with self._lock:
+            data = self.objects[(Bucket, Key)]
+
+        class Body:
+            def read(self):
+                return data
+        return {'Body': Body()}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with self._lock:
+            self.objects[(Bucket, Key)] = Body
+
+    def delete_objects(self, Bucket, Delete):
+        with self._lock:
+            for obj in Delete['Objects']:
+                self.objects.pop((Bucket, obj['Key']), None)
+
+    def chunk_keys(self):
+        with self._lock:
+            return {key for bucket, key in self.objects if trigger.is_chunk(key)}
+
+
+def tracked_rows(cursor, document_ids):
+    """{document_id: (chunk_count, chunk rows, bedrock_jobs rows, document_hashes rows, pending chunk rows)}"""
+    cursor.execute("""
+        SELECT d.document_id, d.chunk_count,
+               (SELECT COUNT(*) FROM document_chunks c WHERE c.document_id = d.document_id),
+               (SELECT COUNT(*) FROM bedrock_jobs j WHERE j.job_id = d.document_id),
+               (SELECT COUNT(*) FROM document_hashes h WHERE h.job_id = d.document_id),
+               (SELECT COUNT(*) FROM pending_submissions p
+                WHERE p.source_bucket = d.source_bucket
+                  AND p.source_key IN (SELECT chunk_key FROM document_chunks c WHERE c.document_id = d.document_id))
+        FROM split_documents d
+        WHERE d.document_id = ANY(%s)
+    """, (list(document_ids),))
+    return {row[0]: row[1:] for row in cursor.fetchall()}
+
+
+def cleanup(cursor):
+    cursor.execute("DELETE FROM pending_submissions WHERE source_bucket = %s", (TEST_BUCKET,))
+    cursor.execute("DELETE FROM document_hashes WHERE source_bucket = %s", (TEST_BUCKET,))
+    cursor.execute("""
+        DELETE FROM bedrock_jobs
+        WHERE job_id IN (SELECT document_id FROM split_documents WHERE source_bucket = %s)
+    """, (TEST_BUCKET,))
+    cursor.execute("""
+        DELETE FROM document_chunks
+        WHERE document_id IN (SELECT document_id FROM split_documents WHERE source_bucket = %s)
+    """, (TEST_BUCKET,))
+    cursor.execute("DELETE FROM split_documents WHERE source_bucket = %s", (TEST_BUCKET,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--documents', type=int, default=16, help='Long statements in the batch')
+    parser.add_argument('--threads', type=int, default=8, help='PDFs split at once (HASH_CONCURRENCY)')
+    parser.add_argument('--chunk-pages', type=int, default=3, help='Pages per chunk')
+    args = parser.parse_args()
+
+    # db.py normally reads these from Secrets Manager
+    db._secret = {
+        'host': os.getenv('DB_HOST'),
+        'port': 5432,
+        'dbname': 'invoice_automation',
+        'username': 'postgres',
+        'password': os.getenv('DB_PASSWORD'),
+    }
+    db._secret_fetched_at = time.monotonic()
+    trigger.HASH_CONCURRENCY = args.threads
+    trigger.SPLIT_CHUNK_PAGES = args.chunk_pages
+
+    sample_paths = sorted(glob.glob(os.path.join(SAMPLE_DIR, '*.pdf')))
+    statement, _ = build_statement(sample_paths)
+    with open(sample_paths[0], 'rb') as f:
+        short_pdf = f.read()
+    trigger.SPLIT_PAGE_THRESHOLD = trigger.pdf_split.count_pages(short_pdf)
+
+    long_pdfs = [(TEST_BUCKET, f'statements/statement-{n:03d}.pdf') for n in range(args.documents)]
+    short_pdfs = [(TEST_BUCKET, f'invoices/short-{n}.pdf') for n in range(3)]
+    objects = {pdf: statement for pdf in long_pdfs}
+    objects.update({pdf: short_pdf for pdf in short_pdfs})
+    objects[(TEST_BUCKET, 'invoices/corrupt.pdf')] = b'%PDF-1.4 not really'
+    batch = long_pdfs + short_pdfs + [(TEST_BUCKET, 'invoices/corrupt.pdf'), (TEST_BUCKET, 'invoices/missing.pdf')]
+    # The statements are identical; distinct hashes keep them distinct documents
+    hashes = {pdf: hashlib.sha256(pdf[1].encode()).hexdigest() for pdf in batch}
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD')
+    )
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cleanup(cursor)
+
+    ok = True
+    try:
+        # 1. Every PDF splits
+        s3 = StubS3(objects)
+        trigger._clients['s3'] = s3
+        start = time.perf_counter()
+        split = trigger.split_large_pdfs(batch, True, hashes)
+        elapsed = time.perf_counter() - start
+        documents = {trigger.document_of(chunks[0][1]): pdf for pdf, chunks in split.items()}
+        rows = tracked_rows(cursor, documents)
+        chunk_count = sum(len(chunks) for chunks in split.values())
+        print(f"\nSplit {len(split)} of {len(batch)} PDFs into {chunk_count} chunks "
+              f"with {args.threads} threads in {elapsed:.2f}s")
+
+        cursor.execute("SELECT chunk_key FROM document_chunks WHERE document_id = ANY(%s)", (list(documents),))
+        tracked_chunks = {key for key, in cursor.fetchall()}
+        checks = [
+            ('every long statement split', set(split) == set(long_pdfs)),
+            ('every split document recorded', set(rows) == set(documents)),
+            ('every chunk row written', all(chunks == expected for expected, chunks, _, _, _ in rows.values())),
+            ('every document in bedrock_jobs', all(jobs == 1 for _, _, jobs, _, _ in rows.values())),
+            ('every document hash recorded', all(hashed == 1 for _, _, _, hashed, _ in rows.values())),
+            ('every chunk claimed in pending_submissions',
+             all(pending == expected for expected, _, _, _, pending in rows.values())),
+            ('no untracked chunk in S3', s3.chunk_keys() == tracked_chunks),
+        ]
+
+        # 2. One row the database rejects fails the whole batch cleanly
+        cleanup(cursor)
+        s3 = StubS3(objects)
+        rejected = (TEST_BUCKET, 'statements/' + 'x' * 1030 + '.pdf')
+        s3.objects[rejected] = statement
+        trigger._clients['s3'] = s3
+        split = trigger.split_large_pdfs(batch + [rejected], True, hashes)
+        cursor.execute("SELECT COUNT(*) FROM split_documents WHERE source_bucket = %s", (TEST_BUCKET,))
+        recorded = cursor.fetchone()[0]
+        checks += [
+            ('failed batch submitted whole', not split),
+            ('failed batch left no split rows', recorded == 0),
+            ('failed batch left no chunks in S3', not s3.chunk_keys()),
+        ]
+
+        print()
+        for name, passed in checks:
+            ok = ok and passed
+            print(f"{'✓' if passed else '✗'} {name[0].upper() + name[1:]}")
+    finally:
+        cleanup(cursor)
+        cursor.close()
+        conn.close()
+        db.discard_connection()
+
+    print(f"\n{'✓ Concurrent splitting check passed' if ok else '✗ Concurrent splitting check failed'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
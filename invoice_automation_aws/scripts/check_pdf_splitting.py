@@ -0,0 +1,164 @@
+"""
+Local check of page-range splitting and chunk merging
+
+Builds one long statement by concatenating the PDFs in sample_invoices/, splits
+it with bedrock_trigger's pdf_split, and checks that the chunks cover every
+page exactly once and in order (page text compared with the original).
+
+Then stands in for Bedrock: each chunk gets a result listing, as line items,
+the sample invoices that start on its pages, with the statement header only
+in the first chunk and the total only in the last. The results are merged in
+a shuffled arrival order with invoice_processor's chunk_merge, after sorting
+by chunk as the processor does, and the merged line items must come out in
+page order with the full total.
+
+Needs pypdf. No AWS account or database needed.
+
+Usage:
+    python scripts/check_pdf_splitting.py --chunk-pages 3
+    python scripts/check_pdf_splitting.py --chunk-pages 4 --output-dir /tmp/chunks
+"""
+
+import argparse
+import csv
+import glob
+import io
+import os
+import random
+import sys
+import time
+
+from pypdf import PdfReader, PdfWriter
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_v2')
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'bedrock_trigger'))
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'invoice_processor'))
+import chunk_merge  # noqa: E402
+import pdf_split  # noqa: E402
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample_invoices')
+
+
+def build_statement(pdf_paths):
+    """Concatenate PDFs; returns (bytes, first page number of each PDF)"""
+    writer = PdfWriter()
+    first_pages = []
+    for path in pdf_paths:
+        first_pages.append(len(writer.pages) + 1)
+        for page in PdfReader(path).pages:
+            writer.add_page(page)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue(), first_pages
+
+
+def page_texts(data):
+    return [page.extract_text() for page in PdfReader(io.BytesIO(data)).pages]
+
+
+def chunk_result(chunk_index, chunk_count, first, last, invoices, first_pages):
+    """What Bedrock would return for pages first..last of the statement"""
+    inference = {
+        'invoice_items': [
+            {
+                'description': f"{invoice['Invoice Number']} (page {page})",
+                'quantity': 1,
+                'unit_price': float(invoice['Total']),
+                'amount': float(invoice['Total'])
+            }
+            for invoice, page in zip(invoices, first_pages)
+            if first <= page <= last
+        ]
+    }
+    if chunk_index == 0:
+        inference.update({
+            'invoice_number': 'STMT-SAMPLE',
+            'company_name': invoices[0]['Vendor'],
+            'bill_to': invoices[0]['Customer'],
+            'invoice_date': invoices[-1]['Date'],
+        })
+    if chunk_index == chunk_count - 1:
+        inference['total_amount'] = round(sum(float(invoice['Total']) for invoice in invoices), 2)
+    return {
+        'matched_blueprint': {'name': 'invoice', 'confidence': 0.9 + chunk_index / 1000},
+        'inference_result': inference
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--chunk-pages', type=int, default=3, help='Pages per chunk')
+    parser.add_argument('--sample-dir', default=SAMPLE_DIR)
+    parser.add_argument('--output-dir', help='Also write the chunks here for inspection')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the shuffled arrival order')
+    args = parser.parse_args()
+
+    with open(os.path.join(args.sample_dir, 'invoices_summary.csv'), newline='') as f:
+        invoices = list(csv.DictReader(f))
+    paths = [os.path.join(args.sample_dir, os.path.basename(invoice['Filename'])) for invoice in invoices]
+    missing = sorted(set(glob.glob(os.path.join(args.sample_dir, '*.pdf'))) - set(paths))
+    if missing:
+        print(f"⚠ Not in invoices_summary.csv, left out: {', '.join(os.path.basename(p) for p in missing)}")
+
+    statement, first_pages = build_statement(paths)
+    page_count = pdf_split.count_pages(statement)
+    print(f"\nStatement: {len(paths)} sample invoices, {page_count} pages, {len(statement):,} bytes")
+
+    # 1. Split
+    start = time.perf_counter()
+    ranges = pdf_split.page_ranges(page_count, args.chunk_pages)
+    chunks = pdf_split.split_pdf(statement, ranges)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Split into {len(chunks)} chunks of up to {args.chunk_pages} pages in {elapsed:.1f}ms\n")
+
+    print(f"{'Chunk':<30} {'Pages':>7} {'Bytes':>8}  Text matches")
+    print("-" * 60)
+    original_texts = page_texts(statement)
+    chunk_texts = []
+    ok = True
+    for (first, last), data in zip(ranges, chunks):
+        key = pdf_split.chunk_key('', 'statement', first, last)
+        texts = page_texts(data)
+        matches = texts == original_texts[first - 1:last]
+        ok = ok and matches
+        chunk_texts.extend(texts)
+        print(f"{key:<30} {len(texts):>7} {len(data):>8,}  {'✓' if matches else '✗'}")
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            with open(os.path.join(args.output_dir, os.path.basename(key)), 'wb') as f:
+                f.write(data)
+
+    if chunk_texts != original_texts:
+        print("✗ Chunks do not cover the statement page for page")
+        ok = False
+
+    # 2. Merge, with the results arriving in any order
+    results = [
+        (index, chunk_result(index, len(ranges), first, last, invoices, first_pages))
+        for index, (first, last) in enumerate(ranges)
+    ]
+    random.Random(args.seed).shuffle(results)
+    print(f"\nResults arrive as chunks {[index for index, _ in results]}")
+
+    merged = chunk_merge.merge_chunk_outputs([output for _, output in sorted(results, key=lambda r: r[0])])
+    inference = merged['inference_result']
+    descriptions = [item['description'] for item in inference['invoice_items']]
+    expected = [f"{invoice['Invoice Number']} (page {page})" for invoice, page in zip(invoices, first_pages)]
+    expected_total = round(sum(float(invoice['Total']) for invoice in invoices), 2)
+
+    checks = [
+        ('line items in page order', descriptions == expected),
+        ('header from the first chunk', inference.get('invoice_number') == 'STMT-SAMPLE'),
+        ('total from the last chunk', inference.get('total_amount') == expected_total),
+        ('lowest confidence', merged['matched_blueprint']['confidence'] == 0.9),
+    ]
+    for name, passed in checks:
+        ok = ok and passed
+        print(f"{'✓' if passed else '✗'} Merged {name}")
+
+    print(f"\n{'✓ Splitting and merging check passed' if ok else '✗ Splitting and merging check failed'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
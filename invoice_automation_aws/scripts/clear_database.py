@@ -16,6 +16,13 @@ cursor = conn.cursor()
 
 try:
     # Delete in order to respect foreign key constraints
+    cursor.execute("DELETE FROM processed_results")
+    cursor.execute("DELETE FROM invoice_status_audit")
+    cursor.execute("DELETE FROM pipeline_ledger")
+    cursor.execute("DELETE FROM document_hashes")
+    cursor.execute("DELETE FROM document_chunks")
+    cursor.execute("DELETE FROM split_documents")
+    cursor.execute("DELETE FROM deferred_actions")
     cursor.execute("DELETE FROM bedrock_extraction_log")
     cursor.execute("DELETE FROM invoice_line_items")
     cursor.execute("DELETE FROM invoices")
@@ -77,6 +77,324 @@ try:
         )
     """)
     
+    # 6. Create bedrock_jobs table (job_id -> original PDF index)
+    print("Creating bedrock_jobs table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bedrock_jobs (
+            job_id VARCHAR(100) PRIMARY KEY,
+            source_bucket VARCHAR(255) NOT NULL,
+            source_key VARCHAR(1024) NOT NULL,
+            invocation_arn VARCHAR(500),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # 7. Per-stage timings on the extraction log
+    print("Updating bedrock_extraction_log table...")
+    cursor.execute("""
+        ALTER TABLE bedrock_extraction_log 
+        ADD COLUMN IF NOT EXISTS stage_timings JSONB
+    """)
+    
+    # 8. Create deferred_actions table (post-commit work the processor ran out of time for)
+    print("Creating deferred_actions table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS deferred_actions (
+            action_id BIGSERIAL PRIMARY KEY,
+            action_type VARCHAR(20) NOT NULL,
+            payload JSONB NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_until TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # 9. Create processed_results table (idempotency ledger for redelivered S3 events)
+    print("Creating processed_results table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS processed_results (
+            bucket VARCHAR(255) NOT NULL,
+            object_key VARCHAR(1024) NOT NULL,
+            etag VARCHAR(100) NOT NULL,
+            result JSONB NOT NULL,
+            processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (bucket, object_key, etag)
+        )
+    """)
+    
+    # 10. Create pending_submissions table (PDFs not yet accepted by Bedrock)
+    print("Creating pending_submissions table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pending_submissions (
+            source_bucket VARCHAR(255) NOT NULL,
+            source_key VARCHAR(1024) NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (source_bucket, source_key)
+        )
+    """)
+    
+    # 11. Content hashes of submitted PDFs, so re-uploads skip Bedrock
+    print("Adding duplicate_of to bedrock_jobs...")
+    cursor.execute("""
+        ALTER TABLE bedrock_jobs 
+        ADD COLUMN IF NOT EXISTS duplicate_of VARCHAR(100)
+    """)
+    
+    print("Creating document_hashes table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS document_hashes (
+            sha256 CHAR(64) PRIMARY KEY,
+            job_id VARCHAR(100) NOT NULL,
+            source_bucket VARCHAR(255),
+            source_key VARCHAR(1024),
+            extracted_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_document_hashes_job_id 
+        ON document_hashes(job_id)
+    """)
+    
+    # 12. Split PDFs and their page-range chunks
+    print("Creating split_documents table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS split_documents (
+            document_id VARCHAR(100) PRIMARY KEY,
+            source_bucket VARCHAR(255) NOT NULL,
+            source_key VARCHAR(1024) NOT NULL,
+            page_count INTEGER NOT NULL,
+            chunk_count INTEGER NOT NULL,
+            merged_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    print("Creating document_chunks table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS document_chunks (
+            document_id VARCHAR(100) NOT NULL REFERENCES split_documents(document_id),
+            chunk_index INTEGER NOT NULL,
+            first_page INTEGER NOT NULL,
+            last_page INTEGER NOT NULL,
+            chunk_key VARCHAR(1024) NOT NULL UNIQUE,
+            job_id VARCHAR(100) UNIQUE,
+            result_bucket VARCHAR(255),
+            result_key VARCHAR(1024),
+            completed_at TIMESTAMP,
+            PRIMARY KEY (document_id, chunk_index)
+        )
+    """)
+    
+    # 13. Per-stage timestamps of every document, for end-to-end latency
+    print("Creating pipeline_ledger table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_ledger (
+            job_id VARCHAR(100) PRIMARY KEY,
+            source_bucket VARCHAR(255),
+            source_key VARCHAR(1024),
+            uploaded_at TIMESTAMP,
+            bedrock_started_at TIMESTAMP,
+            output_at TIMESTAMP,
+            committed_at TIMESTAMP,
+            pdf_moved_at TIMESTAMP,
+            final_status VARCHAR(20)
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pipeline_ledger_uploaded_at 
+        ON pipeline_ledger(uploaded_at)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pipeline_ledger_committed_at 
+        ON pipeline_ledger(committed_at)
+    """)
+    
+    # 14. One row per approval decision, written by the same statement
+    print("Creating invoice_status_audit table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS invoice_status_audit (
+            audit_id BIGSERIAL PRIMARY KEY,
+            invoice_id INTEGER NOT NULL,
+            from_status VARCHAR(20),
+            to_status VARCHAR(20) NOT NULL,
+            changed_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_invoice_status_audit_invoice 
+        ON invoice_status_audit(invoice_id)
+    """)
+    
+    # 15. Dashboard rollups: statement-level triggers on invoices append deltas,
+    #     folded into the totals by fold_invoice_rollup_deltas() (fill them once
+    #     with scripts/backfill_rollups.py)
+    print("Creating invoice rollup tables...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS invoice_monthly_totals (
+            month DATE PRIMARY KEY,
+            invoice_count BIGINT NOT NULL DEFAULT 0,
+            total_amount NUMERIC(16, 2) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS invoice_status_totals (
+            status VARCHAR(50) PRIMARY KEY,
+            invoice_count BIGINT NOT NULL DEFAULT 0,
+            total_amount NUMERIC(16, 2) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS invoice_vendor_totals (
+            vendor_id INTEGER PRIMARY KEY,
+            invoice_count BIGINT NOT NULL DEFAULT 0,
+            total_amount NUMERIC(16, 2) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS invoice_rollup_deltas (
+            delta_id BIGSERIAL PRIMARY KEY,
+            month DATE,
+            status VARCHAR(50),
+            vendor_id INTEGER,
+            invoice_count INTEGER NOT NULL,
+            total_amount NUMERIC(16, 2) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    # Rows inserted or deleted by one statement count +1 / -1; an UPDATE is
+    # -1 for the old row and +1 for the new one, so groups whose totals did
+    # not move (e.g. only processed_at changed) add nothing. Only new delta
+    # rows are written: concurrent invoice writers never wait on each other's
+    # month, status or vendor totals
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION maintain_invoice_rollups() RETURNS trigger AS $$
+        DECLARE
+            changes TEXT;
+        BEGIN
+            changes := CASE TG_OP
+                WHEN 'INSERT' THEN
+                    'SELECT 1 AS sign, invoice_date, status, vendor_id, total_amount FROM new_rows'
+                WHEN 'DELETE' THEN
+                    'SELECT -1 AS sign, invoice_date, status, vendor_id, total_amount FROM old_rows'
+                ELSE
+                    'SELECT 1 AS sign, invoice_date, status, vendor_id, total_amount FROM new_rows
+                     UNION ALL
+                     SELECT -1, invoice_date, status, vendor_id, total_amount FROM old_rows'
+            END;
+
+            EXECUTE format($sql$
+                INSERT INTO invoice_rollup_deltas (month, status, vendor_id, invoice_count, total_amount)
+                SELECT DATE_TRUNC('month', invoice_date)::date, status, vendor_id,
+                       SUM(sign), SUM(sign * COALESCE(total_amount, 0))
+                FROM (%s) AS changes
+                GROUP BY 1, 2, 3
+                HAVING SUM(sign) <> 0 OR SUM(sign * COALESCE(total_amount, 0)) <> 0
+            $sql$, changes);
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    # Moves the committed deltas into the totals in one short transaction;
+    # rows are taken in key order, so concurrent folds cannot deadlock.
+    # Returns the number of deltas folded
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION fold_invoice_rollup_deltas() RETURNS BIGINT AS $$
+        DECLARE
+            folded BIGINT;
+        BEGIN
+            WITH deltas AS (
+                DELETE FROM invoice_rollup_deltas
+                RETURNING month, status, vendor_id, invoice_count, total_amount
+            ),
+            monthly AS (
+                INSERT INTO invoice_monthly_totals AS t (month, invoice_count, total_amount, updated_at)
+                SELECT month, SUM(invoice_count), SUM(total_amount), NOW()
+                FROM deltas
+                WHERE month IS NOT NULL
+                GROUP BY 1
+                HAVING SUM(invoice_count) <> 0 OR SUM(total_amount) <> 0
+                ORDER BY 1
+                ON CONFLICT (month) DO UPDATE
+                SET invoice_count = t.invoice_count + EXCLUDED.invoice_count,
+                    total_amount = t.total_amount + EXCLUDED.total_amount,
+                    updated_at = EXCLUDED.updated_at
+            ),
+            statuses AS (
+                INSERT INTO invoice_status_totals AS t (status, invoice_count, total_amount, updated_at)
+                SELECT status, SUM(invoice_count), SUM(total_amount), NOW()
+                FROM deltas
+                WHERE status IS NOT NULL
+                GROUP BY 1
+                HAVING SUM(invoice_count) <> 0 OR SUM(total_amount) <> 0
+                ORDER BY 1
+                ON CONFLICT (status) DO UPDATE
+                SET invoice_count = t.invoice_count + EXCLUDED.invoice_count,
+                    total_amount = t.total_amount + EXCLUDED.total_amount,
+                    updated_at = EXCLUDED.updated_at
+            ),
+            vendors AS (
+                INSERT INTO invoice_vendor_totals AS t (vendor_id, invoice_count, total_amount, updated_at)
+                SELECT vendor_id, SUM(invoice_count), SUM(total_amount), NOW()
+                FROM deltas
+                WHERE vendor_id IS NOT NULL
+                GROUP BY 1
+                HAVING SUM(invoice_count) <> 0 OR SUM(total_amount) <> 0
+                ORDER BY 1
+                ON CONFLICT (vendor_id) DO UPDATE
+                SET invoice_count = t.invoice_count + EXCLUDED.invoice_count,
+                    total_amount = t.total_amount + EXCLUDED.total_amount,
+                    updated_at = EXCLUDED.updated_at
+            )
+            SELECT COUNT(*) INTO folded FROM deltas;
+            RETURN folded;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    # Totals plus the deltas not folded yet: what the dashboard reads, exact
+    # whenever the last fold ran
+    for table, key in [
+        ('invoice_monthly_totals', 'month'),
+        ('invoice_status_totals', 'status'),
+        ('invoice_vendor_totals', 'vendor_id'),
+    ]:
+        cursor.execute(f"""
+            CREATE OR REPLACE VIEW {table}_current AS
+            SELECT {key}, SUM(invoice_count)::bigint AS invoice_count, SUM(total_amount) AS total_amount
+            FROM (
+                SELECT {key}, invoice_count, total_amount FROM {table}
+                UNION ALL
+                SELECT {key}, invoice_count, total_amount FROM invoice_rollup_deltas WHERE {key} IS NOT NULL
+            ) AS combined
+            GROUP BY {key}
+        """)
+    # Transition tables allow one event per trigger
+    for event, transition in [
+        ('INSERT', 'NEW TABLE AS new_rows'),
+        ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+        ('DELETE', 'OLD TABLE AS old_rows'),
+    ]:
+        cursor.execute(f"DROP TRIGGER IF EXISTS invoices_rollup_{event.lower()} ON invoices")
+        cursor.execute(f"""
+            CREATE TRIGGER invoices_rollup_{event.lower()}
+            AFTER {event} ON invoices
+            REFERENCING {transition}
+            FOR EACH STATEMENT EXECUTE FUNCTION maintain_invoice_rollups()
+        """)
+    # Recent invoices on the dashboard
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_invoices_processed_at 
+        ON invoices(processed_at)
+    """)
+    
     conn.commit()
     print("\n✓ All tables created/updated successfully!")
     
@@ -0,0 +1,244 @@
+"""
+Local HTTP server for the dashboard data
+
+Serves the analytics_dashboard queries as JSON and the dashboard page itself,
+so viewing the dashboard no longer means re-running the script by hand:
+
+  GET /api/summary  /api/monthly  /api/status  /api/vendors  /api/recent
+  GET /             the dashboard page, rendered from the same cached rows
+  GET /api/cache    hit / miss / coalesced counts per endpoint
+
+Each endpoint's result is cached for its TTL. Every response carries an ETag,
+and a request with a matching If-None-Match gets a 304 without a body.
+Requests that arrive while an endpoint is being fetched wait for that fetch
+instead of starting their own, so concurrent viewers cost one query.
+
+Usage:
+    python scripts/dashboard_server.py --port 8050
+    python scripts/dashboard_server.py --ttl 5 --recent 50
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from datetime import date, datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from psycopg2.pool import ThreadedConnectionPool
+
+import analytics_dashboard as dashboard
+
+# Seconds each endpoint's result is served from the cache; totals move with
+# every invoice, the monthly and vendor rankings slowly
+DEFAULT_TTL_SECONDS = {
+    'summary': 30,
+    'monthly': 300,
+    'status': 30,
+    'vendors': 300,
+    'recent': 10,
+}
+
+CacheEntry = namedtuple('CacheEntry', ['rows', 'body', 'etag', 'expires_at'])
+
+
+def json_value(value):
+    if isinstance(value, Decimal):
+        # SUM() of a count comes back as a NUMERIC without decimals
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+class CachedEndpoint:
+    """One endpoint: its query, the cached result and the fetch in flight"""
+
+    def __init__(self, name, query, limit, ttl):
+        self.name = name
+        self.query = query
+        self.limit = limit
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._entry = None
+        self._inflight = None
+
+    def get(self, pool):
+        """The cached entry, or a fresh one; concurrent callers share one fetch"""
+        with self._lock:
+            if self._entry and self._entry.expires_at > time.monotonic():
+                self.stats['hits'] += 1
+                return self._entry
+            if self._inflight:
+                self.stats['coalesced'] += 1
+                future, leader = self._inflight, False
+            else:
+                self.stats['misses'] += 1
+                future = self._inflight = Future()
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            entry = self._fetch(pool)
+        except Exception as e:
+            with self._lock:
+                self.stats['errors'] += 1
+                self._inflight = None
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._entry = entry
+            self._inflight = None
+        future.set_result(entry)
+        return entry
+
+    def _fetch(self, pool):
+        conn = pool.getconn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.query, {'limit': self.limit})
+            columns = [column.name for column in cursor.description]
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.rollback()
+        except Exception:
+            pool.putconn(conn, close=True)
+            raise
+        pool.putconn(conn)
+
+        records = json.dumps([dict(zip(columns, row)) for row in rows], default=json_value)
+        body = (
+            f'{{"endpoint": {json.dumps(self.name)}, '
+            f'"fetched_at": "{datetime.now().isoformat(timespec="seconds")}", '
+            f'"ttl_seconds": {self.ttl}, "rows": {records}}}'
+        ).encode('utf-8')
+        # Over the rows only, so a refetch of unchanged data keeps its ETag
+        etag = '"' + hashlib.sha1(records.encode('utf-8')).hexdigest() + '"'
+        return CacheEntry(rows, body, etag, time.monotonic() + self.ttl)
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    server_version = 'InvoiceDashboard/1.0'
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/') or '/'
+        endpoints = self.server.endpoints
+        try:
+            if path in ('/', '/dashboard.html'):
+                self.send_page([endpoint.get(self.server.pool) for endpoint in endpoints.values()])
+            elif path == '/api/cache':
+                stats = {name: endpoint.stats for name, endpoint in endpoints.items()}
+                self.send_body(200, 'application/json', json.dumps(stats).encode('utf-8'))
+            elif path.startswith('/api/') and path[len('/api/'):] in endpoints:
+                endpoint = endpoints[path[len('/api/'):]]
+                entry = endpoint.get(self.server.pool)
+                if self.not_modified(entry.etag):
+                    return
+                self.send_body(200, 'application/json', entry.body, entry.etag,
+                               max_age=int(entry.expires_at - time.monotonic()))
+            else:
+                self.send_body(404, 'application/json', b'{"error": "not found"}')
+        except Exception as e:
+            print(f"✗ {path}: {str(e)}")
+            self.send_body(502, 'application/json', json.dumps({'error': str(e)}).encode('utf-8'))
+
+    def not_modified(self, etag):
+        """Answer 304 if the client already has this version"""
+        candidates = [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]
+        if etag not in candidates and 'W/' + etag not in candidates and '*' not in candidates:
+            return False
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        return True
+
+    def send_body(self, status, content_type, body, etag=None, max_age=0):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', f'max-age={max(max_age, 0)}')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_page(self, entries):
+        """The dashboard page, streamed from the cached rows of every section"""
+        etag = '"' + hashlib.sha1(''.join(entry.etag for entry in entries).encode()).hexdigest() + '"'
+        if self.not_modified(etag):
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Cache-Control', 'max-age=0')
+        self.send_header('ETag', etag)
+        # No Content-Length: the page is written as it renders and the
+        # connection closes at the end (HTTP/1.0)
+        self.end_headers()
+
+        out = io.TextIOWrapper(self.wfile, encoding='utf-8')
+        out.write(dashboard.PAGE_HEAD)
+        for (_, render), entry in zip(dashboard.SECTIONS.values(), entries):
+            render(out, entry.rows)
+        out.write(dashboard.PAGE_FOOT.format(generated=datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        out.flush()
+        out.detach()
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--ttl', type=float, help='Cache every endpoint for this many seconds')
+    parser.add_argument('--months', type=int, default=dashboard.MONTHS_SHOWN, help='Months in the volume chart')
+    parser.add_argument('--top-vendors', type=int, default=dashboard.TOP_VENDORS_SHOWN, help='Vendors in the top vendors table')
+    parser.add_argument('--recent', type=int, default=dashboard.RECENT_INVOICES_SHOWN, help='Invoices in the recent invoices table')
+    args = parser.parse_args()
+
+    limits = {'monthly': args.months, 'vendors': args.top_vendors, 'recent': args.recent}
+    endpoints = {
+        name: CachedEndpoint(name, query, limits.get(name),
+                             args.ttl if args.ttl is not None else DEFAULT_TTL_SECONDS[name])
+        for name, (query, _) in dashboard.SECTIONS.items()
+    }
+
+    # At most one fetch per endpoint runs at a time, so this many connections suffice
+    pool = ThreadedConnectionPool(
+        1, len(endpoints),
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD')
+    )
+
+    server = ThreadingHTTPServer((args.host, args.port), DashboardHandler)
+    server.daemon_threads = True
+    server.endpoints = endpoints
+    server.pool = pool
+    print(f"✓ Serving the dashboard on http://{args.host}:{args.port}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.closeall()
+        for name, endpoint in endpoints.items():
+            print(f"  {name:<8} {endpoint.stats}")
+
+
+if __name__ == '__main__':
+    main()
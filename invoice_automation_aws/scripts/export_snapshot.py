@@ -0,0 +1,219 @@
+"""
+Export invoices, line items and vendors to a columnar snapshot
+
+Each table is streamed out of Postgres with COPY and written as one binary
+file per column (NumPy dtypes, see manifest.json), so scripts/snapshot_analytics.py
+can memory-map the columns and analyse them without touching the database.
+All tables are read in one REPEATABLE READ transaction: the snapshot is
+consistent even while the processor keeps writing.
+
+Columns are kept small rather than compressed, so they stay mappable: money
+is integer cents, quantities integer hundredths, dates datetime64, and the
+invoice status a one-byte code into manifest.json's status list (0 = none).
+Line item descriptions are left out.
+
+Needs numpy.
+
+Usage:
+    python scripts/export_snapshot.py --output snapshot
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv('config/.env')
+
+# COPY output parsed and appended to the column files per chunk of this size
+CHUNK_BYTES = 8 * 1024 * 1024
+
+# Written for a NULL timestamp: NumPy reads it back as NaT
+NAT = -9223372036854775808
+
+INVOICES_COPY = """
+    COPY (
+        SELECT invoice_id,
+               COALESCE(vendor_id, -1),
+               COALESCE(invoice_date - DATE '1970-01-01', %(nat)s),
+               ROUND(COALESCE(total_amount, 0) * 100)::bigint,
+               COALESCE(array_position(%(statuses)s::text[], status), 0),
+               COALESCE(EXTRACT(EPOCH FROM processed_at)::bigint, %(nat)s)
+        FROM invoices
+        ORDER BY invoice_id
+    ) TO STDOUT
+"""
+
+LINE_ITEMS_COPY = """
+    COPY (
+        SELECT COALESCE(invoice_id, -1),
+               ROUND(COALESCE(quantity, 0) * 100)::bigint,
+               ROUND(COALESCE(unit_price, 0) * 100)::bigint,
+               ROUND(COALESCE(amount, 0) * 100)::bigint
+        FROM invoice_line_items
+    ) TO STDOUT
+"""
+
+# table -> (COPY statement, [(column, dtype)]), columns in COPY order
+TABLES = {
+    'invoices': (INVOICES_COPY, [
+        ('invoice_id', 'int32'),
+        ('vendor_id', 'int32'),
+        ('invoice_date', 'datetime64[D]'),
+        ('total_cents', 'int64'),
+        ('status', 'uint8'),
+        ('processed_at', 'datetime64[s]'),
+    ]),
+    'invoice_line_items': (LINE_ITEMS_COPY, [
+        ('invoice_id', 'int32'),
+        ('quantity_hundredths', 'int64'),
+        ('unit_price_cents', 'int64'),
+        ('amount_cents', 'int64'),
+    ]),
+}
+
+
+class ColumnSink:
+    """
+    File-like target of COPY TO for rows of integers.
+
+    Collects the streamed rows and, every CHUNK_BYTES, parses the complete
+    lines in one go and appends each column to its own file.
+    """
+
+    def __init__(self, directory, columns):
+        self.columns = columns
+        self.files = [open(os.path.join(directory, f'{name}.bin'), 'wb') for name, _ in columns]
+        self.rows = 0
+        self._parts = []
+        self._size = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= CHUNK_BYTES:
+            self._flush()
+
+    def _flush(self):
+        data = b''.join(self._parts)
+        end = data.rfind(b'\n') + 1
+        self._parts = [data[end:]] if end < len(data) else []
+        self._size = len(data) - end
+        if not end:
+            return
+        values = np.fromstring(data[:end].decode('ascii'), dtype=np.int64, sep=' ')
+        table = values.reshape(-1, len(self.columns))
+        for index, ((_, dtype), f) in enumerate(zip(self.columns, self.files)):
+            table[:, index].astype(dtype).tofile(f)
+        self.rows += len(table)
+
+    def close(self):
+        self._flush()
+        for f in self.files:
+            f.close()
+
+
+def export(conn, directory):
+    """
+    Write a snapshot of the database into directory, replacing any earlier one.
+
+    Returns {table: (rows, bytes, seconds)}.
+    """
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    try:
+        return write_snapshot(conn, directory)
+    finally:
+        conn.rollback()
+        conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+
+
+def write_snapshot(conn, directory):
+    """
+    Like export(), but reads in conn's current transaction and leaves it open,
+    so uncommitted rows of that transaction are included.
+    """
+    cursor = conn.cursor()
+    staging = directory.rstrip('/') + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    cursor.execute("SELECT DISTINCT status FROM invoices WHERE status IS NOT NULL ORDER BY status")
+    statuses = [row[0] for row in cursor.fetchall()]
+    manifest = {
+        'taken_at': datetime.now().isoformat(timespec='seconds'),
+        'statuses': [None] + statuses,
+        'tables': {},
+    }
+    stats = {}
+
+    for table, (copy_sql, columns) in TABLES.items():
+        start = time.perf_counter()
+        os.makedirs(os.path.join(staging, table))
+        sink = ColumnSink(os.path.join(staging, table), columns)
+        try:
+            cursor.copy_expert(cursor.mogrify(copy_sql, {'statuses': statuses, 'nat': NAT}).decode(), sink)
+        finally:
+            sink.close()
+        manifest['tables'][table] = {'rows': sink.rows, 'columns': dict(columns)}
+        size = sum(os.path.getsize(f.name) for f in sink.files)
+        stats[table] = (sink.rows, size, time.perf_counter() - start)
+
+    # Vendors are few; names are text, so they go in a JSON list
+    start = time.perf_counter()
+    buffer = io.StringIO()
+    cursor.copy_expert("COPY (SELECT vendor_id, vendor_name FROM vendors ORDER BY vendor_id) TO STDOUT WITH (FORMAT csv)", buffer)
+    vendors = list(csv.reader(io.StringIO(buffer.getvalue())))
+    os.makedirs(os.path.join(staging, 'vendors'))
+    np.array([int(vendor_id) for vendor_id, _ in vendors], dtype='int32').tofile(
+        os.path.join(staging, 'vendors', 'vendor_id.bin')
+    )
+    with open(os.path.join(staging, 'vendors', 'vendor_name.json'), 'w', encoding='utf-8') as f:
+        json.dump([name for _, name in vendors], f)
+    manifest['tables']['vendors'] = {'rows': len(vendors), 'columns': {'vendor_id': 'int32'}}
+    stats['vendors'] = (len(vendors), len(buffer.getvalue()), time.perf_counter() - start)
+
+    cursor.close()
+
+    with open(os.path.join(staging, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(staging, directory)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', default='snapshot', help='Snapshot directory (replaced)')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD')
+    )
+    try:
+        stats = export(conn, args.output)
+    finally:
+        conn.close()
+
+    print(f"\n{'Table':<20} {'Rows':>12} {'Bytes':>14} {'Seconds':>8} {'Rows/s':>12}")
+    print("-" * 70)
+    for table, (rows, size, seconds) in stats.items():
+        print(f"{table:<20} {rows:>12,} {size:>14,} {seconds:>8.2f} {rows / seconds if seconds else 0:>12,.0f}")
+    print(f"\n✓ Snapshot written to {args.output}/")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+End-to-end latency report from pipeline_ledger
+
+Per pipeline stage - upload -> Bedrock start -> Bedrock output -> DB commit ->
+PDF moved - prints the p50/p95/p99 latency of the documents uploaded in the
+last --days, and the number of jobs committed per hour over the last --hours
+with a rolling 24-hour total.
+
+Percentiles are nearest-rank, computed with CUME_DIST() over each stage's
+durations; the hourly series uses SUM() and LAG() windows. A stage is only
+counted for documents that reached both of its ends.
+
+Usage:
+    python scripts/pipeline_latency_report.py --days 7 --hours 48
+"""
+
+import argparse
+import os
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv('config/.env')
+
+STAGE_LATENCIES = """
+    WITH durations AS (
+        SELECT s.stage_order, s.stage, EXTRACT(EPOCH FROM s.finished - s.started) AS seconds
+        FROM pipeline_ledger l
+        CROSS JOIN LATERAL (VALUES
+            (1, 'upload -> Bedrock start', l.uploaded_at, l.bedrock_started_at),
+            (2, 'Bedrock start -> output', l.bedrock_started_at, l.output_at),
+            (3, 'output -> DB commit', l.output_at, l.committed_at),
+            (4, 'DB commit -> PDF moved', l.committed_at, l.pdf_moved_at),
+            (5, 'upload -> DB commit', l.uploaded_at, l.committed_at),
+            (6, 'upload -> PDF moved', l.uploaded_at, l.pdf_moved_at)
+        ) AS s(stage_order, stage, started, finished)
+        WHERE l.uploaded_at >= NOW() - %s * INTERVAL '1 day'
+          AND s.started IS NOT NULL
+          AND s.finished IS NOT NULL
+    ),
+    ranked AS (
+        SELECT stage_order, stage, seconds,
+               CUME_DIST() OVER (PARTITION BY stage_order ORDER BY seconds) AS cume
+        FROM durations
+    )
+    SELECT stage,
+           COUNT(*) AS documents,
+           MIN(seconds) FILTER (WHERE cume >= 0.50) AS p50,
+           MIN(seconds) FILTER (WHERE cume >= 0.95) AS p95,
+           MIN(seconds) FILTER (WHERE cume >= 0.99) AS p99,
+           MAX(seconds) AS max
+    FROM ranked
+    GROUP BY stage_order, stage
+    ORDER BY stage_order
+"""
+
+HOURLY_THROUGHPUT = """
+    WITH hours AS (
+        -- 23 extra hours in front, so the first shown hour has a full 24h window
+        SELECT generate_series(
+            date_trunc('hour', NOW() - (%(hours)s + 22) * INTERVAL '1 hour'),
+            date_trunc('hour', NOW()),
+            INTERVAL '1 hour'
+        ) AS hour
+    ),
+    committed AS (
+        SELECT date_trunc('hour', committed_at) AS hour,
+               COUNT(*) AS jobs,
+               COUNT(*) FILTER (WHERE final_status = 'approved') AS approved
+        FROM pipeline_ledger
+        WHERE committed_at >= (SELECT MIN(hour) FROM hours)
+        GROUP BY 1
+    ),
+    windowed AS (
+        SELECT h.hour,
+               COALESCE(c.jobs, 0) AS jobs,
+               COALESCE(c.approved, 0) AS approved,
+               SUM(COALESCE(c.jobs, 0)) OVER (ORDER BY h.hour ROWS BETWEEN 23 PRECEDING AND CURRENT ROW) AS last_24h,
+               COALESCE(c.jobs, 0) - LAG(COALESCE(c.jobs, 0)) OVER (ORDER BY h.hour) AS change
+        FROM hours h
+        LEFT JOIN committed c ON c.hour = h.hour
+    )
+    SELECT hour, jobs, approved, last_24h, change
+    FROM windowed
+    WHERE hour > date_trunc('hour', NOW() - %(hours)s * INTERVAL '1 hour')
+    ORDER BY hour
+"""
+
+
+def seconds(value):
+    if value is None:
+        return '-'
+    value = float(value)
+    return f"{value:.1f}s" if value < 120 else f"{value / 60:.1f}m"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--days', type=int, default=7, help='Documents uploaded in the last N days')
+    parser.add_argument('--hours', type=int, default=24, help='Hours of throughput to show')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        port=5432,
+        database='invoice_automation',
+        user='postgres',
+        password=os.getenv('DB_PASSWORD')
+    )
+    cursor = conn.cursor()
+
+    cursor.execute(STAGE_LATENCIES, (args.days,))
+    print(f"\n=== Stage latency, documents uploaded in the last {args.days} day(s) ===")
+    print(f"{'Stage':<26} {'Docs':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    print("-" * 69)
+    rows = cursor.fetchall()
+    for stage, documents, p50, p95, p99, slowest in rows:
+        print(f"{stage:<26} {documents:>6} {seconds(p50):>8} {seconds(p95):>8} "
+              f"{seconds(p99):>8} {seconds(slowest):>8}")
+    if not rows:
+        print("No documents in pipeline_ledger for this period")
+
+    cursor.execute(HOURLY_THROUGHPUT, {'hours': args.hours})
+    print(f"\n=== Jobs committed per hour, last {args.hours} hour(s) ===")
+    print(f"{'Hour':<17} {'Jobs':>6} {'Approved':>9} {'Last 24h':>9} {'Change':>7}")
+    print("-" * 52)
+    for hour, jobs, approved, last_24h, change in cursor.fetchall():
+        print(f"{hour:%Y-%m-%d %H:00} {jobs:>6} {approved:>9} {last_24h:>9} "
+              f"{'' if change is None else f'{change:+d}':>7}")
+
+    cursor.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
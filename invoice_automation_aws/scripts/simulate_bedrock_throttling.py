@@ -0,0 +1,131 @@
+"""
+Bedrock submission under throttling, against a local stub client
+
+The stub accepts a limited number of invoke_data_automation_async calls per
+second and raises ThrottlingException beyond that, like the real service
+does under a burst. A batch of PDFs is then submitted two ways:
+
+  naive    - one call per PDF with no backoff, the old bedrock_trigger behavior
+  adaptive - bedrock_trigger's submission.submit_all: bounded concurrency, a
+             shared adaptive token bucket and jittered exponential backoff
+
+With --budget, the adaptive run gets that many seconds, like an invocation
+close to its timeout: nothing may start after the budget is spent, and the
+PDFs not tried are counted separately from the lost ones.
+
+No AWS account or database needed.
+
+Usage:
+    python scripts/simulate_bedrock_throttling.py --pdfs 300 --capacity 10
+    python scripts/simulate_bedrock_throttling.py --pdfs 300 --capacity 2 --budget 10
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda_v2', 'bedrock_trigger'))
+import submission  # noqa: E402
+
+
+class StubBedrockRuntime:
+    """Accepts capacity calls per second (with a burst of the same size), throttles the rest"""
+
+    def __init__(self, capacity, latency):
+        self.capacity = capacity
+        self.latency = latency
+        self.calls = 0
+        self.throttled = 0
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def invoke_data_automation_async(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.capacity)
+            self._updated = now
+            if self._tokens < 1:
+                self.throttled += 1
+                raise ClientError(
+                    {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                    'InvokeDataAutomationAsync'
+                )
+            self._tokens -= 1
+            job = self.calls
+        time.sleep(self.latency)
+        return {'invocationArn': f'arn:aws:bedrock:us-east-1:000000000000:data-automation-invocation/stub-{job}'}
+
+
+def submit(client, pdf):
+    return client.invoke_data_automation_async(inputConfiguration={'s3Uri': f's3://incoming/{pdf}'})
+
+
+def run_naive(client, pdfs, concurrency):
+    def attempt(pdf):
+        try:
+            submit(client, pdf)
+            return True
+        except ClientError:
+            return False
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return sum(pool.map(attempt, pdfs))
+
+
+def run_adaptive(client, pdfs, concurrency, rate, burst, budget=None):
+    """Returns (submitted, not started before the budget ran out)"""
+    bucket = submission.TokenBucket(rate, burst)
+    deadline = None if budget is None else time.monotonic() + budget
+    outcomes = submission.submit_all(
+        pdfs, lambda pdf: submit(client, pdf), bucket, concurrency=concurrency,
+        time_left=None if deadline is None else lambda: deadline - time.monotonic()
+    )
+    return (
+        sum(1 for _, error, _ in outcomes if error is None),
+        sum(1 for _, error, _ in outcomes if isinstance(error, submission.DeadlineReached))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pdfs', type=int, default=300)
+    parser.add_argument('--capacity', type=float, default=10, help='Calls per second the stub accepts')
+    parser.add_argument('--latency-ms', type=float, default=50, help='Stub response time')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=20,
+                        help='Starting token bucket rate; deliberately above capacity to show it adapt')
+    parser.add_argument('--burst', type=int, default=5)
+    parser.add_argument('--budget', type=float, help='Seconds the adaptive run may take (default: unlimited)')
+    args = parser.parse_args()
+
+    pdfs = [f'invoice_{n:04d}.pdf' for n in range(args.pdfs)]
+    print(f"\n{args.pdfs} PDFs, stub capacity {args.capacity:g}/s, {args.concurrency} workers\n")
+    print(f"{'Mode':<9} {'Submitted':>9} {'Lost':>6} {'Calls':>7} {'Throttled':>10} {'Wall':>8}")
+    print("-" * 54)
+
+    not_started = 0
+    for mode in ('naive', 'adaptive'):
+        client = StubBedrockRuntime(args.capacity, args.latency_ms / 1000)
+        start = time.perf_counter()
+        if mode == 'naive':
+            submitted = run_naive(client, pdfs, args.concurrency)
+        else:
+            submitted, not_started = run_adaptive(client, pdfs, args.concurrency, args.rate, args.burst, args.budget)
+        elapsed = time.perf_counter() - start
+        print(f"{mode:<9} {submitted:>9} {args.pdfs - submitted - not_started:>6} {client.calls:>7} "
+              f"{client.throttled:>10} {elapsed:>7.1f}s")
+
+    if args.budget is not None:
+        print(f"\n{not_started} PDFs not started within the {args.budget:g}s budget; the trigger releases them at once.")
+    print("\nLost PDFs are the ones an invocation gives up on; the trigger keeps them in pending_submissions.")
+
+
+if __name__ == '__main__':
+    main()
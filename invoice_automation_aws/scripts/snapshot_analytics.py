@@ -0,0 +1,239 @@
+"""
+Dashboard metrics and more, computed offline from a columnar snapshot
+
+Works on the directory written by scripts/export_snapshot.py. The columns are
+memory-mapped and every metric is a handful of vectorized NumPy operations
+(bincount, unique, lexsort, searchsorted) over them, so heavy analysis runs
+on a laptop or a batch box instead of the primary Postgres.
+
+Besides the dashboard's summary, monthly, status, top vendor and recent
+invoice figures there are month-over-month growth, per-vendor spend
+percentiles (nearest rank, like percentile_disc) and line item checks.
+
+Needs numpy.
+
+Usage:
+    python scripts/snapshot_analytics.py --snapshot snapshot --top-vendors 10
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+
+def load_snapshot(directory):
+    """
+    {table: {column: array}} of memory-mapped columns, plus 'statuses' (status
+    code -> name), 'vendor_names' ({vendor_id: name}) and 'taken_at'.
+    """
+    with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    snapshot = {'taken_at': manifest['taken_at'], 'statuses': manifest['statuses']}
+    for table, spec in manifest['tables'].items():
+        rows = spec['rows']
+        snapshot[table] = {
+            # np.memmap cannot map an empty file
+            column: np.memmap(os.path.join(directory, table, f'{column}.bin'), dtype=dtype, mode='r', shape=(rows,))
+            if rows else np.empty(0, dtype=dtype)
+            for column, dtype in spec['columns'].items()
+        }
+    with open(os.path.join(directory, 'vendors', 'vendor_name.json'), encoding='utf-8') as f:
+        snapshot['vendor_names'] = dict(zip(snapshot['vendors']['vendor_id'].tolist(), json.load(f)))
+    return snapshot
+
+
+def summary(snapshot):
+    """(invoice count, total amount, average amount)"""
+    cents = snapshot['invoices']['total_cents']
+    count = len(cents)
+    total = int(cents.sum()) / 100
+    return count, total, total / count if count else 0.0
+
+
+def monthly(snapshot, months=12):
+    """
+    [(month, invoice count, total amount, growth)] for the last months that
+    have invoices, oldest first. growth is the change of the total against
+    the previous calendar month, None if that month had no invoices.
+    """
+    dates = snapshot['invoices']['invoice_date']
+    valid = ~np.isnat(dates)
+    if not valid.any():
+        return []
+    month_index = dates[valid].astype('datetime64[M]')
+    first = month_index.min()
+    offsets = (month_index - first).astype(np.int64)
+    counts = np.bincount(offsets)
+    totals = np.bincount(offsets, weights=snapshot['invoices']['total_cents'][valid]) / 100
+
+    previous = np.concatenate(([0.0], totals[:-1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.where(previous > 0, totals / previous - 1, np.nan)
+
+    shown = np.flatnonzero(counts)[-months:]
+    return [
+        (first + offset, int(counts[offset]), float(totals[offset]),
+         None if np.isnan(growth[offset]) else float(growth[offset]))
+        for offset in shown
+    ]
+
+
+def status_breakdown(snapshot):
+    """[(status, invoice count, total amount)], most invoices first"""
+    codes = snapshot['invoices']['status']
+    names = snapshot['statuses']
+    counts = np.bincount(codes, minlength=len(names))
+    totals = np.bincount(codes, weights=snapshot['invoices']['total_cents'], minlength=len(names)) / 100
+    order = np.argsort(-counts, kind='stable')
+    return [(names[code], int(counts[code]), float(totals[code])) for code in order if counts[code] and names[code]]
+
+
+def vendor_totals(snapshot):
+    """(vendor_ids, invoice counts, total amounts), one entry per vendor with invoices"""
+    vendor_ids = snapshot['invoices']['vendor_id']
+    valid = vendor_ids >= 0
+    ids, inverse = np.unique(vendor_ids[valid], return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(ids))
+    totals = np.bincount(inverse, weights=snapshot['invoices']['total_cents'][valid], minlength=len(ids)) / 100
+    return ids, counts, totals
+
+
+def top_vendors(snapshot, limit=5):
+    """[(vendor_id, vendor name, invoice count, total amount)] by total amount"""
+    ids, counts, totals = vendor_totals(snapshot)
+    order = np.argsort(-totals, kind='stable')[:limit]
+    names = snapshot['vendor_names']
+    return [(int(ids[i]), names.get(int(ids[i]), str(ids[i])), int(counts[i]), float(totals[i])) for i in order]
+
+
+def vendor_spend_percentiles(snapshot, percentiles=(50, 90, 99)):
+    """
+    {vendor_id: [invoice total at each percentile]}, nearest rank.
+
+    One sort by (vendor, amount) for all vendors; each vendor's percentiles
+    are then picked out of its slice by index arithmetic.
+    """
+    vendor_ids = snapshot['invoices']['vendor_id']
+    cents = snapshot['invoices']['total_cents']
+    valid = vendor_ids >= 0
+    vendor_ids, cents = vendor_ids[valid], cents[valid]
+    if not len(vendor_ids):
+        return {}
+
+    order = np.lexsort((cents, vendor_ids))
+    sorted_vendors, sorted_cents = vendor_ids[order], cents[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_vendors[1:] != sorted_vendors[:-1])))
+    sizes = np.diff(np.concatenate((starts, [len(sorted_vendors)])))
+
+    columns = [
+        sorted_cents[starts + np.maximum(np.ceil(p / 100 * sizes).astype(np.int64), 1) - 1] / 100
+        for p in percentiles
+    ]
+    return {
+        int(vendor_id): [float(column[i]) for column in columns]
+        for i, vendor_id in enumerate(sorted_vendors[starts])
+    }
+
+
+def recent(snapshot, limit=10):
+    """
+    [(invoice_id, vendor name, total amount, status, processed_at)], newest
+    first; like the dashboard's ORDER BY processed_at DESC, invoices never
+    processed come first.
+    """
+    invoices = snapshot['invoices']
+    keys = invoices['processed_at'].view(np.int64).copy()
+    keys[np.isnat(invoices['processed_at'])] = np.iinfo(np.int64).max
+    if len(keys) > limit:
+        candidates = np.argpartition(-keys, limit)[:limit]
+    else:
+        candidates = np.arange(len(keys))
+    order = candidates[np.argsort(-keys[candidates], kind='stable')]
+
+    names = snapshot['vendor_names']
+    statuses = snapshot['statuses']
+    return [
+        (int(invoices['invoice_id'][i]), names.get(int(invoices['vendor_id'][i])),
+         int(invoices['total_cents'][i]) / 100, statuses[invoices['status'][i]],
+         invoices['processed_at'][i])
+        for i in order
+    ]
+
+
+def line_item_checks(snapshot):
+    """
+    Line items per invoice, and the invoices whose line items do not add up
+    to their total. Line items are matched to invoices with searchsorted,
+    invoice_ids being exported in order.
+    """
+    invoice_ids = snapshot['invoices']['invoice_id']
+    item_invoices = snapshot['invoice_line_items']['invoice_id']
+    if len(invoice_ids):
+        positions = np.minimum(np.searchsorted(invoice_ids, item_invoices), len(invoice_ids) - 1)
+        matched = invoice_ids[positions] == item_invoices
+    else:
+        positions = np.zeros(len(item_invoices), dtype=np.int64)
+        matched = np.zeros(len(item_invoices), dtype=bool)
+
+    items = np.bincount(positions[matched], minlength=len(invoice_ids))
+    line_cents = np.bincount(
+        positions[matched], weights=snapshot['invoice_line_items']['amount_cents'][matched],
+        minlength=len(invoice_ids)
+    )
+    with_items = items > 0
+    return {
+        'line_items': int(len(item_invoices)),
+        'orphaned_line_items': int((~matched).sum()),
+        'invoices_without_items': int((~with_items).sum()),
+        'average_items': float(items[with_items].mean()) if with_items.any() else 0.0,
+        'most_items': int(items.max()) if len(items) else 0,
+        'totals_not_matching_items': int((with_items & (line_cents != snapshot['invoices']['total_cents'])).sum()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--snapshot', default='snapshot', help='Directory written by export_snapshot.py')
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--top-vendors', type=int, default=5)
+    parser.add_argument('--recent', type=int, default=10)
+    args = parser.parse_args()
+
+    snapshot = load_snapshot(args.snapshot)
+    count, total, average = summary(snapshot)
+    print(f"\n=== Snapshot taken {snapshot['taken_at']} ===")
+    print(f"Invoices: {count:,}   Total: ${total:,.2f}   Average: ${average:,.2f}")
+
+    print(f"\n{'Month':<10} {'Invoices':>9} {'Total':>16} {'Growth':>8}")
+    print("-" * 46)
+    for month, invoices, amount, growth in monthly(snapshot, args.months):
+        print(f"{str(month):<10} {invoices:>9,} {amount:>16,.2f} {'' if growth is None else f'{growth:+.1%}':>8}")
+
+    print(f"\n{'Status':<16} {'Invoices':>9} {'Total':>16}")
+    print("-" * 43)
+    for status, invoices, amount in status_breakdown(snapshot):
+        print(f"{status:<16} {invoices:>9,} {amount:>16,.2f}")
+
+    percentiles = vendor_spend_percentiles(snapshot)
+    print(f"\n{'Top vendor':<30} {'Invoices':>9} {'Total':>16} {'p50':>12} {'p90':>12} {'p99':>12}")
+    print("-" * 96)
+    for vendor_id, name, invoices, amount in top_vendors(snapshot, args.top_vendors):
+        p50, p90, p99 = percentiles[vendor_id]
+        print(f"{name[:30]:<30} {invoices:>9,} {amount:>16,.2f} {p50:>12,.2f} {p90:>12,.2f} {p99:>12,.2f}")
+
+    print(f"\n{'Invoice ID':>10}  {'Vendor':<30} {'Amount':>12}  {'Status':<16} Processed")
+    print("-" * 90)
+    for invoice_id, vendor, amount, status, processed_at in recent(snapshot, args.recent):
+        print(f"{invoice_id:>10}  {(vendor or '-')[:30]:<30} {amount:>12,.2f}  {status or '-':<16} {processed_at}")
+
+    print("\n=== Line items ===")
+    for check, value in line_item_checks(snapshot).items():
+        print(f"{check.replace('_', ' ').capitalize():<28} {value:,}" if isinstance(value, int)
+              else f"{check.replace('_', ' ').capitalize():<28} {value:,.2f}")
+
+
+if __name__ == '__main__':
+    main()